@@ -33,6 +33,7 @@ from cf import release, USER_DIR, MANUAL_URL, DATA_DIR, USER_CONFIG_DIR
 from config import Config
 from plugins.core import PluginManager
 from cf.db import DatasourceManager
+from cf.executor import Executor
 from cf.ui import dialogs
 from cf.ui.datasources import DatasourcesDialog
 from cf.ui.widgets import ConnectionsDialog
@@ -75,6 +76,9 @@ class CFApplication(gobject.GObject):
         self.cb = CFAppCallbacks()
         self.__shutdown_tasks = []
         self.config = Config(self, self.options.config)
+        self.executor = Executor(self.config.get('executor.workers', 4))
+        self.register_shutdown_task(self.executor.shutdown,
+                                    'Stopping worker threads', wait=False)
         self.userdb = UserDB(self)
         try:
             self._check_version()
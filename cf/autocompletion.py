@@ -24,9 +24,15 @@ widgets.
 The feature is enabled by calling the :meth:`setup` function. It then
 automatically connects to instance and editor creation and to relevant
 config changes.
+
+Completions are ranked by a fuzzy score (see :func:`cf.db.completion.rank`)
+and by how often identifiers were used in statements executed on the
+data source. The usage counts are stored in the user database.
 """
 
 import itertools
+import logging
+import re
 from gettext import gettext as _
 
 import gobject
@@ -34,13 +40,120 @@ import gtk
 import pango
 
 import sqlparse.keywords
+import sqlparse.lexer
+import sqlparse.tokens
 
-from cf import db
+from cf.db.completion import get_keyword_index, rank
 
 
 SQL_KEYWORDS = set(tuple(sqlparse.keywords.KEYWORDS))
 SQL_KEYWORDS.update(tuple(sqlparse.keywords.KEYWORDS_COMMON))
 
+# Milliseconds to wait for further key presses before matches are
+# computed.
+DEBOUNCE_DELAY = 150
+
+# Delay in milliseconds before columns of tables used in the current
+# statement are loaded in the background.
+PREFETCH_DELAY = 500
+
+USAGE_TABLE = ('create table ac_usage (datasource text, identifier text, '
+               'count integer, primary key (datasource, identifier))')
+
+# Milliseconds to collect usage counts before they're committed to the
+# user database.
+USAGE_COMMIT_DELAY = 5000
+
+# Longer statements aren't counted, e.g. generated statements in dumps.
+USAGE_MAX_STATEMENT = 10000
+
+# Statements counted by UsageStats, leading comments are skipped.
+_SELECT = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/)*select\b', re.I|re.S)
+
+
+class UsageStats(object):
+    """Counts how often identifiers are used in executed statements.
+
+    The counts are stored in the ``ac_usage`` table of the user database
+    and cached per data source. Changes are committed after
+    :data:`USAGE_COMMIT_DELAY` milliseconds or when :meth:`flush` is
+    called.
+
+    :param userdb: A :class:`~cf.userdb.UserDB` instance.
+    """
+
+    def __init__(self, userdb):
+        self.userdb = userdb
+        self._counts = {}
+        self._commit_timer = None
+        if self.userdb.get_table_version('ac_usage') is None:
+            self.userdb.create_table('ac_usage', '0.1', USAGE_TABLE)
+
+    def get_counts(self, datasource):
+        """Returns a dictionary mapping identifiers to usage counts."""
+        if datasource.id is None:
+            return {}
+        counts = self._counts.get(datasource.id)
+        if counts is None:
+            sql = 'select identifier, count from ac_usage where datasource=?'
+            self.userdb.cursor.execute(sql, (datasource.id,))
+            counts = dict(self.userdb.cursor.fetchall())
+            self._counts[datasource.id] = counts
+        return counts
+
+    def add(self, datasource, identifiers):
+        """Increase the usage counts of *identifiers*."""
+        if datasource.id is None or not identifiers:
+            return
+        counts = self.get_counts(datasource)
+        cursor = self.userdb.cursor
+        for identifier in identifiers:
+            if identifier in counts:
+                sql = ('update ac_usage set count=count+1 '
+                       'where datasource=? and identifier=?')
+            else:
+                sql = ('insert into ac_usage (datasource, identifier, count)'
+                       ' values (?, ?, 1)')
+            cursor.execute(sql, (datasource.id, identifier))
+            counts[identifier] = counts.get(identifier, 0) + 1
+        if self._commit_timer is None:
+            self._commit_timer = gobject.timeout_add(USAGE_COMMIT_DELAY,
+                                                     self.flush)
+
+    def flush(self):
+        """Commit pending changes of the usage counts."""
+        if self._commit_timer is not None:
+            gobject.source_remove(self._commit_timer)
+            self._commit_timer = None
+            self.userdb.conn.commit()
+        return False
+
+
+def is_counted(statement):
+    """Returns ``True`` if identifiers in *statement* should be counted.
+
+    Only SELECT statements up to :data:`USAGE_MAX_STATEMENT` characters
+    are counted, so that executing scripts with many INSERT statements
+    doesn't tokenize each of them.
+    """
+    return (len(statement) <= USAGE_MAX_STATEMENT
+            and _SELECT.match(statement) is not None)
+
+
+def extract_identifiers(statement):
+    """Returns the lower-cased names used in *statement*.
+
+    The statement is only tokenized, not parsed. This function doesn't
+    touch any widgets, so it's safe to call it in a worker thread.
+    """
+    names = set()
+    for ttype, value in sqlparse.lexer.tokenize(statement):
+        # Quoted identifiers are symbols.
+        if (ttype in sqlparse.tokens.Name
+            or ttype in sqlparse.tokens.String.Symbol):
+            names.add(value.strip('"`[]').lower())
+    return names
+
 
 def setup(app):
     """Setup autocompletion feature.
@@ -51,6 +164,10 @@ def setup(app):
     """
     app.cb.connect('instance-created', instance_created, app)
     app.config.connect('changed', on_config_changed)
+    usage = UsageStats(app.userdb)
+    app.set_data('cf::ac_usage', usage)
+    app.register_shutdown_task(usage.flush,
+                               'Saving autocompletion statistics')
 
 
 def instance_created(callbacks, window, app):
@@ -71,7 +188,7 @@ def run_action(action, window):
         return
     if editor.textview.get_data('cf::ac_window') is not None:
         return
-    editor_autocomplete(editor)
+    schedule_autocomplete(editor, delay=0)
 
 
 def editor_autocomplete(editor, popup=None, matches=None):
@@ -112,6 +229,115 @@ def editor_autocomplete(editor, popup=None, matches=None):
     selection.select_iter(iter_)
 
 
+def schedule_autocomplete(editor, popup=None, delay=DEBOUNCE_DELAY):
+    """Update the completions after *delay* milliseconds.
+
+    Pending updates for *editor* are cancelled. The current statement is
+    parsed and the matches are ranked in worker threads. Only the result
+    of the most recent request is displayed.
+
+    :param editor: SQLEditor instance.
+    :param popup: The popup window or `None` to create a new one.
+    :param delay: Delay in milliseconds (default: `DEBOUNCE_DELAY`).
+    """
+    textview = editor.textview
+    seq = cancel_autocomplete(textview)
+    timer = gobject.timeout_add(delay, _start_autocomplete,
+                                editor, popup, seq)
+    textview.set_data('cf::ac_timer', timer)
+
+
+def cancel_autocomplete(textview):
+    """Cancel pending completion updates.
+
+    Returns the new sequence number of completion requests.
+    """
+    timer = textview.get_data('cf::ac_timer')
+    if timer is not None:
+        gobject.source_remove(timer)
+        textview.set_data('cf::ac_timer', None)
+    future = textview.get_data('cf::ac_future')
+    if future is not None:
+        future.cancel()
+        textview.set_data('cf::ac_future', None)
+    seq = (textview.get_data('cf::ac_seq') or 0) + 1
+    textview.set_data('cf::ac_seq', seq)
+    return seq
+
+
+def _start_autocomplete(editor, popup, seq):
+    textview = editor.textview
+    textview.set_data('cf::ac_timer', None)
+    request = get_completion_request(editor)
+    if request is None:
+        return False
+    fragment, statement = request
+    if statement is None:
+        _find_matches(editor, popup, seq, fragment, None)
+        return False
+    future = editor.app.executor.submit(parse_identifiers, statement)
+    textview.set_data('cf::ac_future', future)
+    future.add_done_callback(
+        lambda f: _on_identifiers_parsed(f, editor, popup, seq, fragment))
+    return False
+
+
+def _on_identifiers_parsed(future, editor, popup, seq, fragment):
+    textview = editor.textview
+    if seq != textview.get_data('cf::ac_seq') or future.cancelled():
+        return  # a newer request is pending
+    textview.set_data('cf::ac_future', None)
+    try:
+        identifiers = future.result()
+    except:
+        logging.exception('Failed to parse statement:')
+        return
+    # Don't block on loading columns, update the completions when
+    # they're available.
+    loading = None
+    if editor.connection and editor.connection.meta:
+        loading = prefetch_columns(editor.connection.meta, identifiers)
+    if loading is not None:
+        # Not stored in cf::ac_future, the job may be shared with other
+        # requests and must not be cancelled.
+        loading.add_done_callback(
+            lambda f: _on_columns_loaded(editor, popup, seq, fragment,
+                                         identifiers))
+        return
+    _find_matches(editor, popup, seq, fragment, identifiers)
+
+
+def _on_columns_loaded(editor, popup, seq, fragment, identifiers):
+    textview = editor.textview
+    if seq != textview.get_data('cf::ac_seq'):
+        return  # a newer request is pending
+    _find_matches(editor, popup, seq, fragment, identifiers)
+
+
+def _find_matches(editor, popup, seq, fragment, identifiers):
+    textview = editor.textview
+    func = prepare_matches(editor, fragment, identifiers)
+    # Serialized per editor, so that a slow request doesn't occupy more
+    # than one worker. Superseded requests are cancelled before they run.
+    future = editor.app.executor.submit_for(textview, func)
+    textview.set_data('cf::ac_future', future)
+    future.add_done_callback(
+        lambda f: _on_matches_found(f, editor, popup, seq))
+
+
+def _on_matches_found(future, editor, popup, seq):
+    textview = editor.textview
+    if seq != textview.get_data('cf::ac_seq') or future.cancelled():
+        return  # a newer request is pending
+    textview.set_data('cf::ac_future', None)
+    try:
+        matches = future.result()
+    except:
+        logging.exception('Failed to find completions:')
+        return
+    editor_autocomplete(editor, popup, matches)
+
+
 def _is_keyword(value):
     """Return True if value is a SQL keyword."""
     return value.upper() in SQL_KEYWORDS
@@ -216,6 +442,7 @@ def destroy_popup(textview, window):
     sigs = textview.get_data('cf::autocomplete_sigs')
     if sigs is None:
         return
+    cancel_autocomplete(textview)
     for sig in sigs:
         textview.disconnect(sig)
     textview.set_data('cf::autocomplete_sigs', None)
@@ -289,9 +516,10 @@ def apply_selection(popup, editor):
 def build_completions(editor, fragment):
     """Build the common completions.
 
-    The returned list contains the names of database objects if the editor
-    has a connection and meta information. Additionally the list contains
-    SQL keywords.
+    The returned list contains the names of database objects that may
+    match *fragment* if the editor has a connection and meta information.
+    Additionally the list contains SQL keywords that may match *fragment*.
+    Use :func:`find_matches` to filter and rank them.
 
     The returned list is a list of 2-tuples (completion, description) where
     description describes the object (e.g. 'Keyword', 'Table', 'Column'...).
@@ -299,42 +527,44 @@ def build_completions(editor, fragment):
     :param editor: SQLEditor instance.
     :param fragment: The fragment that should be completed.
     """
-    ret = []
+    return _find_candidates(_get_completion_indexes(editor), fragment)
+
+
+def _get_completion_indexes(editor):
+    indexes = []
     # objects
     if editor.connection and editor.connection.meta:
-        meta = editor.connection.meta
-        [ret.append((obj.get_full_name(), obj.typestr))
-         for obj in meta.find(name__ilike=fragment,
-                              cls=(db.objects.Table,
-                                   db.objects.View,
-                                   db.objects.Sequence,
-                                   db.objects.Schema))]
+        indexes.append(editor.connection.meta.completions)
     # keywords
-    kwds = tuple(sqlparse.keywords.KEYWORDS_COMMON)
-    kwds += tuple(sqlparse.keywords.KEYWORDS)
-    [ret.append((kwd, _(u'Keyword')))
-                for kwd in kwds]
+    indexes.append(get_keyword_index())
+    return indexes
+
+
+def _find_candidates(indexes, fragment):
+    ret = []
+    for index in indexes:
+        ret.extend(index.find_fuzzy(fragment))
     return ret
 
 
-def find_matches(completions, fragment):
+def find_matches(completions, fragment, usage=None, limit=None):
     """Find matches in the list of completions.
 
-    The function returns a dictionary with the score determined by
-    :meth:`get_score` as keys. The value is a list of entries in the form
-    (indexes, (solution, description)) where *indexes* is again a 2-tuple
-    defining the start and end index that's needed from *solution* to
-    complete *fragment*, *solution* and *description* is the 2-tuple
-    as returned by :meth:`build_completions`.
+    The function returns a dictionary with the negated score determined
+    by :func:`~cf.db.completion.rank` as keys, so that the best matches
+    have the lowest key. The value is a list of entries in the form
+    (indexes, (solution, description)) where *indexes* is a list of the
+    indexes of the characters in *solution* that matched *fragment*,
+    *solution* and *description* is the 2-tuple as returned by
+    :meth:`build_completions`.
+
+    :param usage: Optional dictionary of identifier usage counts.
+    :param limit: Maximum number of matches (default: all).
     """
     ret = {}
-    for solution, comment in completions:
-        score, indexes = get_score(solution, fragment)
-        if score is None:
-            continue
-        tmp = ret.get(score, [])
-        tmp.append((indexes, (solution, comment)))
-        ret[score] = tmp
+    for score, indexes, completion in rank(completions, fragment,
+                                           usage, limit):
+        ret.setdefault(-score, []).append((indexes, completion))
     return ret
 
 
@@ -372,69 +602,130 @@ def find_identifier(parsed, name=None):
             return real_name
 
 
-def get_score(solution, fragment):
-    """Get score for solution."""
-    solution = solution.lower()
-    fragment = fragment.lower()
-    try:
-        start = solution.index(fragment)
-    except ValueError:
-        return None, None
-    return start, [start+i for i in range(len(fragment))]
-
+def get_completions_from_identifiers(editor, identifiers):
+    """Similar to get_completions but only with children of an identifier.
 
-def get_completions_from_identifiers(editor):
-    """Similar to get_completions but only with children of an identifier."""
-    bounds = editor.textview.get_current_statement()
+    :param editor: SQLEditor instance.
+    :param identifiers: Dictionary as returned by :func:`parse_identifiers`.
+    """
     meta = editor.connection.meta
-    buffer_ = editor.textview.buffer
     completions = []
-    if bounds:
-        parsed = sqlparse.parse(buffer_.get_text(*bounds))[0]
-        for alias, real_name in find_identifier(parsed).iteritems():
-            for obj in meta.find(name=real_name):
-                if obj.typeid in ('table', 'view'):
-                    [completions.append((c.name, c.typestr))
-                     for c in obj.columns.get_children()]
+    for alias, real_name in identifiers.iteritems():
+        for obj in meta.find(name=real_name):
+            if obj.typeid in ('table', 'view'):
+                [completions.append((c.name, c.typestr))
+                 for c in obj.columns.get_children()]
     return completions
 
 
-def get_matches(editor):
-    """Get possible completions."""
+def get_completion_request(editor):
+    """Collect the data needed to find completions.
+
+    Returns a 2-tuple (fragment, statement) or `None` if there's nothing
+    to complete. *statement* is the current statement if it's needed to
+    resolve identifiers, otherwise it's `None`.
+
+    :param editor: SQLEditor instance.
+    """
     buffer_ = editor.textview.buffer
     start, end = get_fragment_bounds(buffer_)
     fragment = buffer_.get_text(start, end)
-    completions = None
-    matches = None
-    if len(fragment) == 0 and editor.connection and editor.connection.meta:
-        completions = get_completions_from_identifiers(editor)
-        matches = find_matches(completions, '')
-    elif len(fragment) < 2:
+    has_meta = bool(editor.connection and editor.connection.meta)
+    if len(fragment) < 2 and not (len(fragment) == 0 and has_meta):
         popup = editor.textview.get_data('cf::ac_window')
         if popup is not None:
             destroy_popup(editor.textview, popup)
-        return
-    if '.' in fragment and editor.connection and editor.connection.meta:
-        parent_name, rest = fragment.split('.', 1)
+        return None
+    statement = None
+    if has_meta and (len(fragment) == 0 or '.' in fragment):
         bounds = editor.textview.get_current_statement()
         if bounds:
-            parsed = sqlparse.parse(buffer_.get_text(*bounds))[0]
-            parent = find_identifier(parsed, parent_name)
-            for obj in editor.connection.meta.find(name=parent):
-                if obj is not None:
-                    if obj.typeid == 'table':
-                        completions = [(c.name, c.typestr)
-                                       for c in obj.columns.get_children()]
-                    elif obj.typeid == 'schema':
-                        completions = [(c.name, c.typestr)
-                                       for c in obj.tables.get_children()+
-                                   obj.views.get_children()]
-                if completions:
-                    matches = find_matches(completions, rest)
-    if completions is None:
-        completions = build_completions(editor, fragment)
-        matches = find_matches(completions, fragment)
-    return matches
+            statement = buffer_.get_text(*bounds)
+    return fragment, statement
+
+
+def parse_identifiers(statement):
+    """Parse *statement* and return its identifiers.
+
+    The returned dictionary maps aliases to real names. This function
+    doesn't touch any widgets, so it's safe to call it in a worker thread.
+    """
+    return find_identifier(sqlparse.parse(statement)[0])
+
+
+def prepare_matches(editor, fragment, identifiers):
+    """Prepare finding the possible completions for *fragment*.
+
+    Completions that depend on database objects are collected in the main
+    thread. The returned function looks up the remaining candidates in
+    the completion indexes and ranks them. It takes no arguments, returns
+    the matches as described in :func:`find_matches` and doesn't touch
+    any widgets or database objects, so it's safe to call it in a worker
+    thread.
+
+    :param editor: SQLEditor instance.
+    :param fragment: The fragment to complete.
+    :param identifiers: Identifiers of the current statement as returned
+      by :func:`parse_identifiers` or `None`.
+    """
+    completions = None
+    has_meta = bool(editor.connection and editor.connection.meta)
+    usage = None
+    app_usage = editor.app.get_data('cf::ac_usage')
+    if editor.connection and app_usage is not None:
+        # Copied, the counts are updated in the main thread.
+        usage = dict(app_usage.get_counts(editor.connection.datasource))
+    limit = editor.app.config.get('editor.autocompletion.max_items', 50)
+    if len(fragment) == 0 and has_meta:
+        completions = get_completions_from_identifiers(editor,
+                                                       identifiers or {})
+        return lambda: find_matches(completions, '', usage, limit)
+    if '.' in fragment and has_meta and identifiers is not None:
+        parent_name, rest = fragment.split('.', 1)
+        parent = identifiers.get(parent_name)
+        found = None
+        for obj in editor.connection.meta.find(name=parent):
+            if obj is not None:
+                if obj.typeid == 'table':
+                    completions = [(c.name, c.typestr)
+                                   for c in obj.columns.get_children()]
+                elif obj.typeid == 'schema':
+                    completions = [(c.name, c.typestr)
+                                   for c in obj.tables.get_children()+
+                               obj.views.get_children()]
+            if completions:
+                found = completions
+        if found:
+            return lambda: find_matches(found, rest, usage, limit)
+        elif completions is not None:
+            return lambda: None
+    indexes = _get_completion_indexes(editor)
+    return lambda: find_matches(_find_candidates(indexes, fragment),
+                                fragment, usage, limit)
+
+
+def get_matches_for(editor, fragment, identifiers):
+    """Get possible completions for *fragment* in the main thread.
+
+    See :func:`prepare_matches` for the parameters.
+    """
+    return prepare_matches(editor, fragment, identifiers)()
+
+
+def get_matches(editor):
+    """Get possible completions.
+
+    Unlike :func:`schedule_autocomplete` this function parses the current
+    statement in the main thread.
+    """
+    request = get_completion_request(editor)
+    if request is None:
+        return None
+    fragment, statement = request
+    identifiers = None
+    if statement is not None:
+        identifiers = parse_identifiers(statement)
+    return get_matches_for(editor, fragment, identifiers)
 
 
 def get_fragment_bounds(buffer_, replace_mode=False, value=None):
@@ -504,7 +795,7 @@ def editor_key_pressed(textview, event, editor, window):
         apply_selection(window, editor)
         textview.stop_emission('key-press-event')
         return True
-    gobject.idle_add(editor_autocomplete, editor, window)
+    schedule_autocomplete(editor, window)
     return False
 
 
@@ -516,8 +807,66 @@ def on_editor_key_pressed_tab(sqlview, event, editor):
     return True
 
 
+def schedule_prefetch(textview, editor):
+    """Load columns of tables in the current statement after a delay."""
+    timer = textview.get_data('cf::ac_prefetch_timer')
+    if timer is not None:
+        gobject.source_remove(timer)
+    timer = gobject.timeout_add(PREFETCH_DELAY, _start_prefetch, editor)
+    textview.set_data('cf::ac_prefetch_timer', timer)
+
+
+def _start_prefetch(editor):
+    textview = editor.textview
+    textview.set_data('cf::ac_prefetch_timer', None)
+    if not (editor.connection and editor.connection.meta):
+        return False
+    bounds = textview.get_current_statement()
+    if not bounds:
+        return False
+    statement = textview.buffer.get_text(*bounds)
+    if statement == textview.get_data('cf::ac_prefetch_statement'):
+        return False
+    textview.set_data('cf::ac_prefetch_statement', statement)
+    future = editor.app.executor.submit(parse_identifiers, statement)
+    future.add_done_callback(lambda f: _on_prefetch_parsed(f, editor))
+    return False
+
+
+def _on_prefetch_parsed(future, editor):
+    if future.cancelled() or future.exception() is not None:
+        return
+    if editor.connection and editor.connection.meta:
+        prefetch_columns(editor.connection.meta, future.result())
+
+
+def prefetch_columns(meta, identifiers):
+    """Load columns of tables and views in *identifiers* in the background.
+
+    :param meta: A :class:`~cf.db.meta.DatabaseMeta` instance.
+    :param identifiers: Dictionary as returned by :func:`parse_identifiers`.
+    """
+    collections = []
+    for real_name in set(identifiers.itervalues()):
+        for obj in meta.find(name=real_name):
+            if obj.typeid in ('table', 'view'):
+                collections.append(obj.columns)
+    return meta.prefetch(collections)
+
+
 def on_editor_created(instance, editor):
     """Connects to key-press-event to track TABs in advanced mode."""
+    if editor.get_data('cf::ac_prefetch_sig') is None:
+        sig = editor.textview.connect('statements-changed',
+                                      schedule_prefetch, editor)
+        editor.set_data('cf::ac_prefetch_sig', sig)
+    if editor.get_data('cf::ac_usage_sig') is None:
+        sig = editor.connect('connection-changed',
+                             on_editor_connection_changed, instance.app)
+        editor.set_data('cf::ac_usage_sig', sig)
+        if editor.connection is not None:
+            on_editor_connection_changed(editor, editor.connection,
+                                         instance.app)
     if instance.app.config.get('editor.tabcompletion'):
         if editor.get_data('cf::ac_tab') is not None:  # already connected
             return
@@ -526,6 +875,36 @@ def on_editor_created(instance, editor):
         editor.set_data('cf::ac_tab', sig)
 
 
+def on_editor_connection_changed(editor, connection, app):
+    """Tracks executed statements to update usage counts."""
+    if connection is None:
+        return
+    datasource = connection.datasource
+    if not datasource.get_data('cf::ac_sig_executed'):
+        sig = datasource.connect('executed', on_query_executed, app)
+        datasource.set_data('cf::ac_sig_executed', sig)
+
+
+def on_query_executed(datasource, query, app):
+    """Counts the identifiers used by *query*."""
+    if query.failed or not is_counted(query.statement):
+        return
+    usage = app.get_data('cf::ac_usage')
+    if usage is None:
+        return
+    future = app.executor.submit(extract_identifiers, query.statement)
+    future.add_done_callback(
+        lambda f: _on_identifiers_extracted(f, usage, datasource))
+
+
+def _on_identifiers_extracted(future, usage, datasource):
+    # Called in the main loop, the user database must not be used in
+    # worker threads.
+    if future.cancelled() or future.exception() is not None:
+        return
+    usage.add(datasource, future.result())
+
+
 def on_config_changed(config, key, enabled):
     """Tracks changes of editor.tabcompletion."""
     if key == 'editor.tabcompletion':
@@ -23,11 +23,10 @@ import logging
 import random
 import os
 import sys
-import thread
 import time
 from ConfigParser import ConfigParser
 from gettext import gettext as _
-from threading import Thread
+from threading import Lock, Thread, Timer
 
 import gobject
 import gtk
@@ -45,6 +44,20 @@ logging.debug('Using Gnome keyring: %r' % USE_KEYRING)
 import sqlparse
 
 
+# Batch size for fetchmany() when rows aren't streamed.
+FETCH_BATCH_SIZE = 1000
+
+# A cancel request may reach the server before the statement does. It's
+# repeated after this many seconds while the statement is running.
+CANCEL_RETRY_DELAY = 0.5
+CANCEL_RETRIES = 3
+
+# Phases recorded in Query.timings, in order of their occurrence.
+TIMING_PHASES = ('prepare', 'parse', 'execute', 'fetch', 'decode',
+                 'grid', 'paint')
+
+timing_log = logging.getLogger('cf.query.timing')
+
 TRANSACTION_IDLE = 1 << 1
 TRANSACTION_COMMIT_ENABLED = 1 << 2
 TRANSACTION_ROLLBACK_ENABLED = 1 << 3
@@ -103,10 +116,17 @@ DIALECTS = {
 
 import cf
 from cf.db import backends
+from cf.db import schemacache
 from cf.db.meta import DatabaseMeta
+from cf.db.pool import ConnectionPool
+from cf.db.columnar import ColumnarResult
+from cf.db.resultcache import ResultCache
+from cf.db.resultstore import ResultStore
 from cf.db.url import make_url
+from cf.db.virtual import VirtualResult
 from cf.ui import dialogs
-from cf.utils import Emit
+from cf.executor import call_in_main_loop
+from cf.utils import normalize_sql
 
 
 class DummyDBAPIError(Exception):
@@ -156,11 +176,14 @@ class Datasource(gobject.GObject):
         self.manager = manager
         self.internal_connection = None
         self._meta = None
+        self._pool = None
         self._conn_count = 0
         self._url = None
         self._backend = None
         self.ask_for_password = False
         self.startup_commands = None
+        # Statement timeout in seconds, 0 means no timeout.
+        self.statement_timeout = 0
         self.name = None
         self.description = None
         self.color = None
@@ -178,6 +201,18 @@ class Datasource(gobject.GObject):
     def backend(self):
         return self._backend
 
+    @property
+    def pool(self):
+        """The :class:`~cf.db.pool.ConnectionPool` of this data source."""
+        if self._pool is None:
+            config = self.manager.app.config
+            self._pool = ConnectionPool(
+                self,
+                min_size=config.get('db.pool.min_size', 1),
+                max_size=config.get('db.pool.max_size', 0),
+                idle_timeout=config.get('db.pool.idle_timeout', 600))
+        return self._pool
+
     def _get_url(self):
         return self._url
 
@@ -227,6 +262,9 @@ class Datasource(gobject.GObject):
             for conn in self.connections:
                 self.internal_connection = conn
                 break
+        if not self.connections and self._meta is not None:
+            # Save objects refreshed since the cache was written.
+            self._meta.save_cache_later()
         self.manager.emit('datasource-changed', self)
 
     def dbconnect(self):
@@ -237,6 +275,7 @@ class Datasource(gobject.GObject):
             conn.num = self._conn_count
             self.connections.add(conn)
             conn.connect('closed', self.on_connection_closed)
+            self.pool.add(conn)
             if self.internal_connection is None:
                 self.internal_connection = conn
             if self.manager is not None:
@@ -304,6 +343,7 @@ class Connection(gobject.GObject):
         self.datasource = datasource
         self.connection = real_conn
         self.num = 0
+        self.last_used = time.time()
 
     @property
     def threadsafety(self):
@@ -340,6 +380,7 @@ class Connection(gobject.GObject):
             return '%s #%d' % (self.datasource.get_label(), self.num)
 
     def execute(self, sql):
+        self.last_used = time.time()
         cur = self.connection.cursor()
         cur.execute(sql)
         if cur.description:
@@ -349,7 +390,11 @@ class Connection(gobject.GObject):
         return self.connection
 
     def close(self):
-        self.connection.close()
+        try:
+            self.connection.close()
+        except:
+            # Still report the connection as closed, it's unusable anyway.
+            logging.exception('Failed to close connection:')
         self.emit('closed')
 
     def prepare_statement(self, sql):
@@ -358,6 +403,7 @@ class Connection(gobject.GObject):
 
     def execute_raw(self, sql):
         """Just for internal use!."""
+        self.last_used = time.time()
         conn = self.connection
         cur = conn.cursor()
         cur.execute(sql)
@@ -435,6 +481,10 @@ class DatasourceManager(gobject.GObject):
         self.app = app
         self._cache = {}
         self.__gobject_init__()
+        self.result_cache = ResultCache(
+            max_size=app.config.get('db.result_cache.max_size',
+                                    10*1024*1024),
+            ttl=app.config.get('db.result_cache.ttl', 300))
 
     def _get_config(self):
         conf = ConfigParser()
@@ -473,6 +523,8 @@ class DatasourceManager(gobject.GObject):
                  datasource.ask_for_password)
         conf.set(datasource.id, 'startup_commands',
                  datasource.startup_commands or '')
+        conf.set(datasource.id, 'statement_timeout',
+                 datasource.statement_timeout or 0)
         conf.set(datasource.id, 'name', datasource.name or '')
         conf.set(datasource.id, 'description', datasource.description or '')
         conf.set(datasource.id, 'color', datasource.color or '')
@@ -498,6 +550,8 @@ class DatasourceManager(gobject.GObject):
         self.get_password_from_keyring(ds)
         ds.ask_for_password = conf.getboolean(id_, 'ask_for_password')
         ds.startup_commands = conf.get(id_, 'startup_commands') or None
+        if conf.has_option(id_, 'statement_timeout'):
+            ds.statement_timeout = conf.getint(id_, 'statement_timeout')
         ds.name = conf.get(id_, 'name') or None
         ds.description = conf.get(id_, 'description') or None
         ds.color = conf.get(id_, 'color') or None
@@ -515,6 +569,7 @@ class DatasourceManager(gobject.GObject):
         if USE_KEYRING:
             datasource.password = None
             self.store_password(datasource)
+        schemacache.remove(datasource)
         self.emit('datasource-deleted', datasource)
 
     def get_all(self):
@@ -576,12 +631,35 @@ class DatasourceManager(gobject.GObject):
 
 
 class Query(gobject.GObject):
-    """Object representing a database query."""
+    """Object representing a database query.
+
+    :Signals:
+
+    started
+      ``def callback(query)``
+
+      Emitted before the statement is sent to the database.
+
+    rows-fetched
+      ``def callback(query, rows)``
+
+      Emitted in streaming mode (see :attr:`fetch_size`) for each batch
+      of rows read from the cursor. When the signal handlers are called
+      the batch is already appended to :attr:`rows`.
+
+    finished
+      ``def callback(query)``
+
+      Emitted when the statement was executed and all rows are fetched.
+    """
 
     __gsignals__ = {
         "started" : (gobject.SIGNAL_RUN_LAST,
                      gobject.TYPE_NONE,
                      tuple()),
+        "rows-fetched" : (gobject.SIGNAL_RUN_FIRST,
+                          gobject.TYPE_NONE,
+                          (gobject.TYPE_PYOBJECT,)),
         "finished" : (gobject.SIGNAL_RUN_LAST,
                       gobject.TYPE_NONE,
                       tuple())
@@ -594,8 +672,12 @@ class Query(gobject.GObject):
         :param connection: A database connection.
         """
         self.__gobject_init__()
+        # Seconds spent in each phase of TIMING_PHASES, see add_timing().
+        self.timings = {}
         self.connection = connection
+        start = time.time()
         self.statement = self.connection.prepare_statement(statement)
+        self.add_timing('prepare', time.time() - start)
         self._parsed = None
         self.description = None
         self.rowcount = -1
@@ -607,48 +689,255 @@ class Query(gobject.GObject):
         self.coding_hint = "utf-8"
         self.errors = list()
         self.error_position = None
+        self.cancelled = False
+        self.timed_out = False
+        # Guards cancelled, _running and _cancel_timer, see cancel().
+        self._lock = Lock()
+        self._running = False
+        self._cancel_timer = None
+        # If set to a positive number, rows are fetched in batches of
+        # this size and "rows-fetched" is emitted for each batch.
+        self.fetch_size = None
+        # If set to a positive number, rows beyond this estimated size
+        # in bytes are written to a temporary file (see ResultStore).
+        self.memory_limit = None
+        # If True, rows are stored column by column (see ColumnarResult).
+        # This takes precedence over memory_limit.
+        self.columnar = False
+        # If True, results of SELECT statements are read from and written
+        # to the result cache of the data source manager.
+        self.use_cache = False
+        # Time when the result was cached, None if it wasn't read from
+        # the result cache.
+        self.cached_at = None
+        # If True, results of SELECT statements are read from a
+        # server-side cursor on demand, if the backend supports it (see
+        # VirtualResult). This takes precedence over the options above.
+        self.virtual = False
+
+    def do_rows_fetched(self, rows):
+        start = time.time()
+        self.rows.extend(rows)
+        self.add_timing('decode', time.time() - start)
+
+    def add_timing(self, phase, seconds):
+        """Add *seconds* to the time spent in *phase*.
+
+        :param phase: One of :data:`TIMING_PHASES`.
+        """
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    def format_timings(self):
+        """Returns the timings as human readable string."""
+        return ', '.join('%s %.1f ms' % (phase, self.timings[phase] * 1000)
+                         for phase in TIMING_PHASES
+                         if phase in self.timings)
+
+    def log_timings(self, phases=TIMING_PHASES):
+        """Write the timings to the ``cf.query.timing`` logger.
+
+        Each call is logged in a single line of key=value pairs.
+
+        :param phases: The phases to log (default: all). Phases recorded
+          later, e.g. the first paint of the results, can be logged as a
+          separate line for the same statement.
+        """
+        parts = ['%s=%.6f' % (phase, self.timings[phase])
+                 for phase in phases if phase in self.timings]
+        timing_log.info('datasource=%s rows=%d failed=%d %s statement=%r',
+                        self.connection.datasource.id, self.rowcount,
+                        self.failed, ' '.join(parts),
+                        normalize_sql(self.statement)[:200])
+
+    def _on_timeout(self):
+        self.timed_out = True
+        self.cancel()
+
+    def cancel(self):
+        """Cancel the query.
+
+        This method can be called from any thread. If the query isn't
+        running yet, it won't be executed at all.
+
+        The statement may not have reached the server yet when the
+        backend is asked to cancel it. So the request is repeated up to
+        :data:`CANCEL_RETRIES` times while the statement is running.
+
+        :returns: ``True`` if the backend was asked to cancel the
+          running statement.
+        """
+        self._lock.acquire()
+        try:
+            self.cancelled = True
+            if not self._running:
+                return False
+            sent = self._cancel_backend()
+            if sent:
+                self._schedule_cancel_retry(CANCEL_RETRIES)
+        finally:
+            self._lock.release()
+        return sent
+
+    def _cancel_backend(self):
+        backend = self.connection.datasource.backend
+        try:
+            return bool(backend.cancel(self.connection))
+        except:
+            logging.exception('Failed to cancel query:')
+            return False
+
+    def _schedule_cancel_retry(self, retries):
+        if self._cancel_timer is not None:
+            self._cancel_timer.cancel()
+        self._cancel_timer = Timer(CANCEL_RETRY_DELAY, self._retry_cancel,
+                                   (retries,))
+        self._cancel_timer.setDaemon(True)
+        self._cancel_timer.start()
+
+    def _retry_cancel(self, retries):
+        self._lock.acquire()
+        try:
+            self._cancel_timer = None
+            if self._running and self._cancel_backend() and retries > 1:
+                self._schedule_cancel_retry(retries - 1)
+        finally:
+            self._lock.release()
 
     @property
     def parsed(self):
         if self._parsed is None:
+            start = time.time()
             self._parsed = sqlparse.parse(self.statement)[0]
+            self.add_timing('parse', time.time() - start)
         return self._parsed
 
-    def execute(self, threaded=False):
+    def _get_result_cache(self):
+        manager = self.connection.datasource.manager
+        if manager is None:
+            return None
+        return manager.result_cache
+
+    def _is_select(self):
+        try:
+            return self.parsed.get_type() == 'SELECT'
+        except:
+            logging.exception('Failed to parse statement:')
+            return False
+
+    def _execute_cached(self, threaded, notify):
+        """Read the result from the cache.
+
+        Returns ``True`` if a cached result was found.
+        """
+        cache = self._get_result_cache()
+        if cache is None or not self._is_select():
+            return False
+        entry = cache.get(self.connection.datasource, self.statement)
+        if entry is None:
+            return False
+        if notify and threaded:
+            call_in_main_loop(self.emit, "started")
+        elif notify:
+            self.emit("started")
+        entry.apply(self)
+        self.executed = True
+        self.execution_time = 0
+        if notify and threaded:
+            call_in_main_loop(self.finish)
+        elif notify:
+            self.finish()
+        return True
+
+    def _invalidate_result_cache(self):
+        """Remove cached results if the statement may change data."""
+        cache = self._get_result_cache()
+        datasource = self.connection.datasource
+        if (cache is not None and cache.has_entries(datasource)
+            and not self._is_select()):
+            cache.invalidate(datasource)
+
+    def _cache_result(self):
+        """Add the result to the cache.
+
+        In threaded mode this method is called in the main loop, so that
+        all rows fetched in streaming mode are already in :attr:`rows`.
+        """
+        cache = self._get_result_cache()
+        state = self.connection.get_property('transaction-state')
+        if (cache is not None and self.use_cache and not self.failed
+            and self.description and state == TRANSACTION_IDLE
+            and not isinstance(self.rows, VirtualResult)
+            and self._is_select()):
+            cache.put(self.connection.datasource, self)
+
+    def execute(self, threaded=False, notify=True):
         """Execute the statement.
 
         :param threaded: If ``True`` the statement is executed in threaded
           mode, otherwise in blocking mode (default: ``False``).
+        :param notify: If ``False``, "started" and "finished" aren't
+          emitted. The caller has to call :meth:`finish` in the main loop
+          when the query was executed.
         """
+        if (self.use_cache and not self.cancelled
+            and self._execute_cached(threaded, notify)):
+            return
         backend = self.connection.datasource.backend
-        if threaded:
-            Emit(self, "started")
-        else:
+        if notify and threaded:
+            call_in_main_loop(self.emit, "started")
+        elif notify:
             self.emit("started")
         start = time.time()
+        self.connection.last_used = start
         dbapi_conn = self.connection.get_dbapi_connection()
-        dbapi_cur = dbapi_conn.cursor()
+        server_cursor = None
+        if self.virtual and not self.cancelled and self._is_select():
+            try:
+                server_cursor = backend.get_server_cursor(self.connection)
+            except:
+                logging.exception('Failed to create server-side cursor:')
+        if server_cursor is not None:
+            dbapi_cur, scrollable = server_cursor
+        else:
+            dbapi_cur = dbapi_conn.cursor()
         operational_error = getattr(backend.dbapi(), 'OperationalError',
                                     DummyDBAPIError)
         programming_error = getattr(backend.dbapi(), 'ProgrammingError',
                                     DummyDBAPIError)
         do_close = False
+        watchdog = None
+        timeout = self.connection.datasource.statement_timeout
+        if timeout:
+            watchdog = Timer(timeout, self._on_timeout)
+            watchdog.setDaemon(True)
+            watchdog.start()
+        self._lock.acquire()
         try:
-            dbapi_cur.execute(self.statement)
-        except Exception, err:
+            self._running = not self.cancelled
+        finally:
+            self._lock.release()
+        if not self._running:
             self.failed = True
-            self.errors.append(str(err))
+            self.errors.append(_(u'Query cancelled'))
+        else:
             try:
-                self.error_position = backend.get_error_position(self, err)
+                dbapi_cur.execute(self.statement)
+            except Exception, err:
+                self.failed = True
+                self.errors.append(str(err))
+                try:
+                    self.error_position = backend.get_error_position(self,
+                                                                     err)
+                except:
+                    logging.exception('Failed to get error position:')
+                    self.error_position = None
+                do_close = backend.should_close(err)
             except:
-                logging.exception('Failed to get error position:')
-                self.error_position = None
-            do_close = backend.should_close(err)
-        except:
-            self.failed = True
-            self.errors.append(str(sys.exc_info()[1]))
+                self.failed = True
+                self.errors.append(str(sys.exc_info()[1]))
         self.executed = True
         self.execution_time = time.time() - start
+        self.add_timing('execute', self.execution_time)
         if not self.failed:
             if hasattr(dbapi_cur, 'statusmessage'):
                 self.messages = [dbapi_cur.statusmessage]
@@ -656,15 +945,129 @@ class Query(gobject.GObject):
                 self.messages = []
             self.description = dbapi_cur.description
             self.rowcount = dbapi_cur.rowcount
-            if self.description:
-                self.rows = dbapi_cur.fetchall()
+            if server_cursor is not None:
+                self._open_virtual_result(dbapi_cur, scrollable)
+            elif self.description and (self.fetch_size or self.memory_limit
+                                       or self.columnar):
+                if self.columnar:
+                    self.rows = ColumnarResult(self.description)
+                elif self.memory_limit:
+                    self.rows = ResultStore(self.memory_limit)
+                else:
+                    self.rows = []
+                self._fetch_batches(dbapi_cur, threaded)
+            elif self.description:
+                try:
+                    fetch_start = time.time()
+                    self.rows = dbapi_cur.fetchall()
+                    self.add_timing('fetch', time.time() - fetch_start)
+                except:
+                    logging.exception('Failed to fetch rows:')
+                    self.failed = True
+                    self.errors.append(str(sys.exc_info()[1]))
+        self._lock.acquire()
+        try:
+            self._running = False
+            cancel_timer = self._cancel_timer
+            self._cancel_timer = None
+        finally:
+            self._lock.release()
+        if cancel_timer is not None:
+            cancel_timer.cancel()
+            cancel_timer.join()
+        if watchdog is not None:
+            watchdog.cancel()
+        if self.timed_out:
+            msg = _(u'Statement timeout (%(sec)d seconds) exceeded.')
+            self.errors.append(msg % {'sec': timeout})
         self.connection.update_transaction_state()
-        if threaded:
-            Emit(self, "finished")
-            Emit(self.connection.datasource, 'executed', self)
-        else:
-            self.emit("finished")
-            self.connection.datasource.emit('executed', self)
+        self._invalidate_result_cache()
+        if notify and threaded:
+            call_in_main_loop(self.finish)
+        elif notify:
+            self.finish()
         if do_close:
             logging.debug('Closing connection')
             gobject.idle_add(self.connection.close)
+
+    def finish(self):
+        """Cache the result and emit "finished".
+
+        This method is called by :meth:`execute` unless *notify* is
+        ``False``. It must be called in the main loop.
+        """
+        if self.cached_at is not None:
+            self.emit("finished")
+            return
+        self._cache_result()
+        self.emit("finished")
+        self.connection.datasource.emit('executed', self)
+
+    def _open_virtual_result(self, dbapi_cur, scrollable):
+        """Read the first page of rows from a server-side cursor."""
+        backend = self.connection.datasource.backend
+        estimate = None
+        try:
+            estimate = backend.estimate_rowcount(self.connection,
+                                                 self.statement)
+        except:
+            logging.exception('Failed to estimate number of rows:')
+        executor = None
+        manager = self.connection.datasource.manager
+        if manager is not None and self.connection.threadsafety >= 2:
+            executor = manager.app.executor
+        self.rows = VirtualResult(dbapi_cur, scrollable, estimate,
+                                  executor, self.connection,
+                                  self.memory_limit)
+        start = time.time()
+        try:
+            self.rows.load(0)
+        except:
+            logging.exception('Failed to fetch rows:')
+            self.failed = True
+            self.errors.append(str(sys.exc_info()[1]))
+            self.rows.close()
+            return
+        self.add_timing('fetch', time.time() - start)
+        # Named cursors provide a description after the first fetch.
+        self.description = dbapi_cur.description
+        if self.rows.total is not None:
+            self.rowcount = self.rows.total
+        else:
+            self.rowcount = -1
+
+    def _fetch_batches(self, dbapi_cur, threaded):
+        """Fetch rows with fetchmany().
+
+        In streaming mode "rows-fetched" is emitted for each batch,
+        otherwise the rows are just added to :attr:`rows`.
+        """
+        fetch_size = self.fetch_size or FETCH_BATCH_SIZE
+        num_rows = 0
+        while True:
+            if self.cancelled:
+                self.failed = True
+                self.errors.append(_(u'Query cancelled'))
+                break
+            start = time.time()
+            try:
+                rows = dbapi_cur.fetchmany(fetch_size)
+                self.add_timing('fetch', time.time() - start)
+            except:
+                logging.exception('Failed to fetch rows:')
+                self.failed = True
+                self.errors.append(str(sys.exc_info()[1]))
+                break
+            if not rows:
+                break
+            num_rows += len(rows)
+            if not self.fetch_size:
+                start = time.time()
+                self.rows.extend(rows)
+                self.add_timing('decode', time.time() - start)
+            elif threaded:
+                call_in_main_loop(self.emit, 'rows-fetched', rows)
+            else:
+                self.emit('rows-fetched', rows)
+        if self.rowcount is None or self.rowcount < 0:
+            self.rowcount = num_rows
@@ -56,6 +56,32 @@ DEFAULT_OPTIONS = (
               widget=GUIOption.WIDGET_PASSWORD),
     )
 
+# Maximum number of values in an IN list used by refresh_many().
+MAX_IN_LIST = 500
+
+
+def group_by_typeid(objs):
+    """Returns a dictionary mapping typeids to lists of *objs*."""
+    groups = {}
+    for obj in objs:
+        groups.setdefault(obj.typeid, []).append(obj)
+    return groups
+
+
+def in_lists(values, size=MAX_IN_LIST):
+    """Yields comma separated lists of at most *size* SQL literals.
+
+    Strings are quoted, other values are converted with :func:`str`.
+    """
+    values = list(values)
+    for idx in xrange(0, len(values), size):
+        literals = []
+        for value in values[idx:idx+size]:
+            if isinstance(value, basestring):
+                value = "'%s'" % value.replace("'", "''")
+            literals.append(str(value))
+        yield ', '.join(literals)
+
 
 class Generic(object):
 
@@ -175,6 +201,82 @@ class Generic(object):
         """Refresh child objects for parent."""
         pass
 
+    def refresh_many(self, parents, meta, connection):
+        """Refresh child objects for several parents.
+
+        This method is used to load children in the background, e.g. the
+        columns of all tables used in a statement or the columns, indexes
+        and constraints of all tables in a schema. Backend
+        implementations should overwrite this method if the children of
+        many parents can be read with a single set-based query. The
+        helpers :func:`group_by_typeid` and :func:`in_lists` are useful
+        for that.
+
+        The default implementation calls :meth:`refresh` for each parent.
+        """
+        for parent in parents:
+            self.refresh(parent, meta, connection)
+
+    def get_server_cursor(self, connection):
+        """Return a cursor that keeps the result on the server.
+
+        Results of statements executed on this cursor are read on demand
+        (see :class:`~cf.db.virtual.VirtualResult`). Backend
+        implementations should return a 2-tuple (cursor, scrollable)
+        where *scrollable* is ``True`` if the cursor supports
+        ``scroll(value, mode='absolute')``.
+
+        The cursor may hold resources on the server (e.g. a materialized
+        result) until it's closed, callers have to close it when the
+        result isn't needed anymore.
+
+        The default implementation returns ``None``, i.e. results are
+        always read completely.
+        """
+        return None
+
+    def estimate_rowcount(self, connection, statement):
+        """Return the estimated number of rows returned by *statement*.
+
+        The estimate is used to size the grid before all rows are read
+        from a server-side cursor. The default implementation returns
+        ``None``.
+        """
+        return None
+
+    def cancel(self, connection):
+        """Cancel the statement currently running on *connection*.
+
+        This method is called from a different thread than the one
+        executing the statement. Backend implementations should overwrite
+        this method if the DB-API2 module provides a way to interrupt a
+        running statement. Return ``True`` if the request was sent.
+
+        The default implementation does nothing and returns ``False``.
+        """
+        return False
+
+    def ping(self, connection):
+        """Check if the connection is still usable.
+
+        The default implementation executes a trivial statement. An
+        exception is raised if the connection is broken.
+        """
+        connection.execute('select 1')
+
+    def get_catalog_version(self, connection):
+        """Return a value identifying the state of the system catalog.
+
+        The value is compared with the one stored in the schema cache
+        to decide if the database structure needs to be read again. It
+        should change whenever objects are created, altered or dropped
+        and it should be cheap to compute.
+
+        The default implementation returns ``None`` which disables the
+        schema cache for this backend.
+        """
+        return None
+
     def get_transaction_state(self, connection):
         """Determine transaction state for connection.
 
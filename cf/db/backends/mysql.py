@@ -22,6 +22,7 @@ import re
 
 from cf.db import objects
 from cf.db.backends import Generic, DEFAULT_OPTIONS
+from cf.db.backends import group_by_typeid, in_lists
 
 P_ERROR_MESSAGES = {
     1064: re.compile(r"near '(?P<pattern>.*)' at line (?P<lineno>\d+)$",
@@ -160,33 +161,64 @@ class MySQL(Generic):
     def _query(self, connection, sql):
         return connection.execute_raw(sql)
 
+    def cancel(self, connection):
+        # The connection is busy, so KILL QUERY is sent over a second
+        # connection.
+        thread_id = connection.get_dbapi_connection().thread_id()
+        side_conn = self.get_connection(connection.datasource.url)
+        try:
+            side_conn.cursor().execute('KILL QUERY %d' % thread_id)
+        finally:
+            side_conn.close()
+        return True
+
+    def get_catalog_version(self, connection):
+        return self._query(connection, CATALOG_VERSION_SQL)[0][0]
+
     def refresh(self, obj, meta, connection):
         if obj.typeid == 'users':
             self._refresh_users(obj, meta, connection)
         elif obj.typeid == 'constraints':
             self._refresh_constraints(obj, meta, connection)
 
+    def refresh_many(self, parents, meta, connection):
+        # Columns are read by initialize().
+        groups = group_by_typeid(parents)
+        if 'constraints' in groups:
+            self._refresh_constraints_many(groups.pop('constraints'), meta,
+                                           connection)
+        for objs in groups.itervalues():
+            Generic.refresh_many(self, objs, meta, connection)
+
     def _refresh_constraints(self, coll, meta, connection):
-        sql = ("select lower(concat(table_schema, '.', table_name)) as parent,"
-               "lower(concat(table_schema, '.', table_name, '.',"
-               " constraint_name)) as id,"
-               " case when constraint_type = 'PRIMARY KEY'"
-               " then constraint_type"
-               " else concat(constraint_type, ' (', constraint_name, ')')"
-               " end as name"
-               " from information_schema.table_constraints"
-               " where lower(table_name) = '%s'"
-               "  and lower(table_schema) = '%s'"
-               % (coll.parent.name.lower(),
-                  coll.parent.parent.parent.name.lower()))
-        for item in self._query(connection, sql):
-            con = meta.find_exact(oid=item['id'],
-                                  parent=coll.parent.constraints)
-            if con is None:
-                con = objects.Constraint(meta, parent=coll.parent.constraints,
-                                         oid=item['id'])
-                meta.set_object(con)
-            con.name = item['name']
+        self._refresh_constraints_many([coll], meta, connection)
+
+    def _refresh_constraints_many(self, colls, meta, connection):
+        by_parent = dict(("%s.%s" % (coll.parent.parent.parent.name.lower(),
+                                     coll.parent.name.lower()), coll)
+                         for coll in colls)
+        for parents in in_lists(by_parent):
+            sql = ("select lower(concat(table_schema, '.', table_name))"
+                   " as parent,"
+                   "lower(concat(table_schema, '.', table_name, '.',"
+                   " constraint_name)) as id,"
+                   " case when constraint_type = 'PRIMARY KEY'"
+                   " then constraint_type"
+                   " else concat(constraint_type, ' (', constraint_name, ')')"
+                   " end as name"
+                   " from information_schema.table_constraints"
+                   " where lower(concat(table_schema, '.', table_name))"
+                   " in (%s)" % parents)
+            for item in self._query(connection, sql):
+                coll = by_parent[item['parent']]
+                con = meta.find_exact(oid=item['id'],
+                                      parent=coll.parent.constraints)
+                if con is None:
+                    con = objects.Constraint(meta,
+                                             parent=coll.parent.constraints,
+                                             oid=item['id'])
+                    meta.set_object(con)
+                con.name = item['name']
 
     def _refresh_users(self, coll, meta, connection):
         sql = "select concat(user, '@', host) as name from mysql.user"
@@ -216,3 +248,9 @@ lower(concat(table_schema, '.', table_name)) as parent, 3 as pos
 from information_schema.columns
 ) x order by pos asc
 """
+
+CATALOG_VERSION_SQL = """select concat(count(*), '/',
+ifnull(max(create_time), ''), '/',
+(select count(*) from information_schema.columns)) as version
+from information_schema.tables
+"""
@@ -22,6 +22,7 @@ from gettext import gettext as _
 
 from cf.db import objects
 from cf.db.backends import Generic, GUIOption
+from cf.db.backends import group_by_typeid, in_lists
 
 
 class Oracle(Generic):
@@ -182,6 +183,16 @@ class Oracle(Generic):
                 meta.set_object(col)
 
 
+    def cancel(self, connection):
+        connection.get_dbapi_connection().cancel()
+        return True
+
+    def ping(self, connection):
+        connection.execute('select 1 from dual')
+
+    def get_catalog_version(self, connection):
+        return self._query(connection, CATALOG_VERSION_SQL)[0][0]
+
     def refresh(self, obj, meta, connection):
         if obj.typeid == 'users':
             self._refresh_users(obj, meta, connection)
@@ -205,49 +216,55 @@ class Oracle(Generic):
                 meta.set_object(u)
                 u.props.has_children = False
 
+    def refresh_many(self, parents, meta, connection):
+        # Columns are read by initialize().
+        groups = group_by_typeid(parents)
+        for typeid, objs in groups.iteritems():
+            spec = self._CHILD_QUERIES.get(typeid)
+            if spec is None:
+                Generic.refresh_many(self, objs, meta, connection)
+            else:
+                self._refresh_children_many(objs, meta, connection, *spec)
+
+    # typeid -> (child class, catalog view, name column)
+    _CHILD_QUERIES = {
+        'constraints': (objects.Constraint, 'sys.all_constraints',
+                        'constraint_name'),
+        'indexes': (objects.Index, 'sys.all_indexes', 'index_name'),
+        'triggers': (objects.Trigger, 'sys.all_triggers', 'trigger_name'),
+    }
+
+    def _refresh_children_many(self, colls, meta, connection,
+                               cls, view, name_column):
+        by_parent = dict((coll.parent.oid, coll) for coll in colls)
+        for parents in in_lists(by_parent):
+            sql = ("select lower(owner||'.'||table_name) as parent,"
+                   " lower(owner||'.'||%(name)s) as id,"
+                   " %(name)s as name"
+                   " from %(view)s"
+                   " where lower(owner||'.'||table_name) in (%(parents)s)"
+                   % {'name': name_column, 'view': view,
+                      'parents': parents})
+            for item in self._query(connection, sql):
+                coll = by_parent[item['PARENT']]
+                obj = meta.find_exact(parent=coll, oid=item['ID'])
+                if obj is None:
+                    obj = cls(meta, parent=coll, oid=item['ID'])
+                    meta.set_object(obj)
+                obj.name = item['NAME']
+                obj.props.has_children = False
+
     def _refresh_constraints(self, coll, meta, connection):
-        sql = ("select lower(owner||'.'||constraint_name) as id,"
-               " constraint_name as name"
-               " from sys.all_constraints"
-               " where lower(owner||'.'||table_name) = '%s'"
-               % coll.parent.oid)
-        for item in self._query(connection, sql):
-            con = meta.find_exact(parent=coll, oid=item['ID'])
-            if con is None:
-                con = objects.Constraint(meta, parent=coll,
-                                         oid=item['ID'])
-                meta.set_object(con)
-            con.name = item['NAME']
-            con.pros.has_children = False
+        self._refresh_children_many([coll], meta, connection,
+                                    *self._CHILD_QUERIES['constraints'])
 
     def _refresh_indexes(self, coll, meta, connection):
-        sql = ("select lower(owner||'.'||index_name) as id,"
-               " index_name as name from sys.all_indexes"
-               " where lower(owner||'.'||table_name) = '%s'"
-               % coll.parent.oid)
-        for item in self._query(connection, sql):
-            con = meta.find_exact(parent=coll, oid=item['ID'])
-            if con is None:
-                con = objects.Index(meta, parent=coll,
-                                    oid=item['ID'])
-                meta.set_object(con)
-            con.name = item['NAME']
-            con.props.has_children = False
+        self._refresh_children_many([coll], meta, connection,
+                                    *self._CHILD_QUERIES['indexes'])
 
     def _refresh_triggers(self, coll, meta, connection):
-        sql = ("select lower(owner||'.'||trigger_name) as id,"
-               " trigger_name as name"
-               " from sys.all_triggers"
-               " where lower(owner||'.'||table_name) = '%s'"
-               % coll.parent.oid)
-        for item in self._query(connection, sql):
-            con = meta.find_exact(parent=coll, oid=item['ID'])
-            if con is None:
-                con = objects.Trigger(meta, parent=coll,
-                                      oid=item['ID'])
-                meta.set_object(con)
-            con.name = item['NAME']
-            con.props.has_children = False
+        self._refresh_children_many([coll], meta, connection,
+                                    *self._CHILD_QUERIES['triggers'])
 
     def _refresh_sequences(self, coll, meta, connection):
         sql = ("select lower(sequence_owner||'.'||sequence_name) as id,"
@@ -263,7 +280,6 @@ class Oracle(Generic):
             seq.name = item['NAME']
             seq.props.has_children = False
 
-
 DRIVER = Oracle
 
 
@@ -303,3 +319,7 @@ from sys.all_tab_columns t
 left join sys.all_col_comments c on c.owner = t.owner
 and c.table_name = t.table_name and c.column_name = t.column_name
 ) x order by pos, name"""
+
+CATALOG_VERSION_SQL = """select count(*)||'/'||
+to_char(max(last_ddl_time), 'YYYYMMDDHH24MISS') as version
+from sys.all_objects"""
@@ -18,6 +18,7 @@
 
 """PostgreSQL backend."""
 
+import itertools
 import re
 from gettext import gettext as _
 
@@ -25,6 +26,7 @@ from cf.db import TRANSACTION_IDLE
 from cf.db import TRANSACTION_COMMIT_ENABLED
 from cf.db import TRANSACTION_ROLLBACK_ENABLED
 from cf.db.backends import Generic, DEFAULT_OPTIONS, GUIOption
+from cf.db.backends import group_by_typeid, in_lists
 from cf.db import objects
 
 
@@ -35,6 +37,9 @@ class Postgres(Generic):
 
     drivername = 'postgres'
 
+    # Names of server-side cursors.
+    _cursor_ids = itertools.count(1)
+
     @classmethod
     def get_options(cls):
         return DEFAULT_OPTIONS + (
@@ -184,6 +189,38 @@ class Postgres(Generic):
                                     parent=users)
                 meta.set_object(user)
 
+    def cancel(self, connection):
+        dbapi_conn = connection.get_dbapi_connection()
+        if not hasattr(dbapi_conn, 'cancel'):  # requires psycopg2 >= 2.3
+            return False
+        dbapi_conn.cancel()
+        return True
+
+    def get_catalog_version(self, connection):
+        return self._query(connection, PG_CATALOG_VERSION_SQL)[0][0]
+
+    def get_server_cursor(self, connection):
+        dbapi_conn = connection.get_dbapi_connection()
+        name = 'cf_cursor_%d' % self._cursor_ids.next()
+        try:
+            # WITH HOLD, connections are in autocommit mode. Note that the
+            # server builds the whole result when the statement's implicit
+            # transaction commits, before the first page can be read. The
+            # result is kept in temporary space until the cursor is closed.
+            # A non-holdable cursor would need an open transaction, which
+            # would also enclose the statements executed after it.
+            cursor = dbapi_conn.cursor(name, withhold=True, scrollable=True)
+        except TypeError:  # requires psycopg2 >= 2.5
+            return None
+        return cursor, True
+
+    def estimate_rowcount(self, connection, statement):
+        plan = self._query(connection, 'explain %s' % statement)
+        match = re.search(r'rows=(\d+)', plan[0][0])
+        if match is None:
+            return None
+        return int(match.group(1))
+
     def refresh(self, obj, meta, connection):
         if obj.typeid == 'columns':
             self._refresh_columns(obj, meta, connection)
@@ -197,53 +234,89 @@ class Postgres(Generic):
             self._refresh_constraints(obj, meta, connection)
         # View definitions: select pg_get_viewdef(%(oid)s, true)
 
+    def refresh_many(self, parents, meta, connection):
+        groups = group_by_typeid(parents)
+        if 'columns' in groups:
+            self._refresh_columns_many(groups.pop('columns'), meta,
+                                       connection)
+        if 'constraints' in groups:
+            self._refresh_constraints_many(groups.pop('constraints'), meta,
+                                           connection)
+        if 'indexes' in groups:
+            self._refresh_indexes_many(groups.pop('indexes'), meta,
+                                       connection)
+        for objs in groups.itervalues():
+            Generic.refresh_many(self, objs, meta, connection)
+
     def _refresh_columns(self, coll, meta, connection):
-        table = coll.parent
-        sql = ("select att.attnum, att.attname, dsc.description"
-               " from pg_attribute att"
-               " left join pg_description dsc on dsc.objoid = %(tableoid)s"
-               "  and dsc.objsubid = att.attnum"
-               " where att.attrelid = %(tableoid)s"
-               " and att.attnum >= 1"
-               % {"tableoid" : table.get_data("oid")})
+        self._refresh_columns_many([coll], meta, connection)
+
+    def _refresh_columns_many(self, colls, meta, connection):
+        by_oid = dict((coll.parent.get_data("oid"), coll) for coll in colls)
         known_columns = {}
-        [known_columns.setdefault(k.name, k)
-         for k in meta.find(parent=coll, cls=objects.Column)]
-        for item in self._query(connection, sql):
-            col = known_columns.get(item['attname'], None)
-            if col is None:
-                col = objects.Column(meta, parent=coll)
-            col.name = item['attname']
-            col.pos = item['attnum']
-            col.comment = item['description']
-            meta.set_object(col)
+        for coll in colls:
+            for col in meta.find(parent=coll, cls=objects.Column):
+                known_columns.setdefault((coll, col.name), col)
+        for oids in in_lists(by_oid):
+            sql = ("select att.attrelid, att.attnum, att.attname,"
+                   " dsc.description"
+                   " from pg_attribute att"
+                   " left join pg_description dsc"
+                   "  on dsc.objoid = att.attrelid"
+                   "  and dsc.objsubid = att.attnum"
+                   " where att.attrelid in (%s)"
+                   " and att.attnum >= 1" % oids)
+            for item in self._query(connection, sql):
+                coll = by_oid[item['attrelid']]
+                col = known_columns.get((coll, item['attname']), None)
+                if col is None:
+                    col = objects.Column(meta, parent=coll)
+                col.name = item['attname']
+                col.pos = item['attnum']
+                col.comment = item['description']
+                meta.set_object(col)
 
     def _refresh_constraints(self, coll, meta, connection):
-        sql = ("select con.oid, con.conname, dsc.description"
-               " from pg_constraint con"
-               " left join pg_description dsc on dsc.objoid = con.oid"
-               " where con.conrelid = %d" % coll.parent.oid)
-        for item in self._query(connection, sql):
-            con = meta.find_exact(parent=coll, oid=item['oid'])
-            if con is None:
-                con = objects.Constraint(meta, parent=coll, oid=item['oid'])
-                meta.set_object(con)
-            con.name = item['conname']
-            con.comment = item['description']
+        self._refresh_constraints_many([coll], meta, connection)
+
+    def _refresh_constraints_many(self, colls, meta, connection):
+        by_oid = dict((coll.parent.oid, coll) for coll in colls)
+        for oids in in_lists(by_oid):
+            sql = ("select con.conrelid, con.oid, con.conname,"
+                   " dsc.description"
+                   " from pg_constraint con"
+                   " left join pg_description dsc on dsc.objoid = con.oid"
+                   " where con.conrelid in (%s)" % oids)
+            for item in self._query(connection, sql):
+                coll = by_oid[item['conrelid']]
+                con = meta.find_exact(parent=coll, oid=item['oid'])
+                if con is None:
+                    con = objects.Constraint(meta, parent=coll,
+                                             oid=item['oid'])
+                    meta.set_object(con)
+                con.name = item['conname']
+                con.comment = item['description']
 
     def _refresh_indexes(self, coll, meta, connection):
-        sql = ("select rel.oid, rel.relname, dsc.description"
-               " from pg_index ind, pg_class rel"
-               " left join pg_description dsc on dsc.objoid = rel.oid"
-               " where ind.indexrelid = rel.oid"
-               " and ind.indrelid = %d" % coll.parent.oid)
-        for item in self._query(connection, sql):
-            idx = meta.find_exact(parent=coll, oid=item['oid'])
-            if idx is None:
-                idx = objects.Index(meta, parent=coll, oid=item['oid'])
-                meta.set_object(idx)
-            idx.name = item['relname']
-            idx.comment = item['description']
+        self._refresh_indexes_many([coll], meta, connection)
+
+    def _refresh_indexes_many(self, colls, meta, connection):
+        by_oid = dict((coll.parent.oid, coll) for coll in colls)
+        for oids in in_lists(by_oid):
+            sql = ("select ind.indrelid, rel.oid, rel.relname,"
+                   " dsc.description"
+                   " from pg_index ind, pg_class rel"
+                   " left join pg_description dsc on dsc.objoid = rel.oid"
+                   " where ind.indexrelid = rel.oid"
+                   " and ind.indrelid in (%s)" % oids)
+            for item in self._query(connection, sql):
+                coll = by_oid[item['indrelid']]
+                idx = meta.find_exact(parent=coll, oid=item['oid'])
+                if idx is None:
+                    idx = objects.Index(meta, parent=coll, oid=item['oid'])
+                    meta.set_object(idx)
+                idx.name = item['relname']
+                idx.comment = item['description']
 
     def _refresh_languages(self, coll, meta, connection):
         sql = ("select lan.oid, lan.lanname, dsc.description"
@@ -340,3 +413,18 @@ from pg_proc pro
 left join pg_namespace nsp on nsp.oid = pro.pronamespace
 left join pg_description des on des.objoid = pro.oid
 """
+
+
+# Changes whenever rows in the catalog tables used by the browser are
+# inserted, updated or deleted (xmin is the id of the inserting
+# transaction of a row version).
+PG_CATALOG_VERSION_SQL = """
+SELECT array_to_string(ARRAY[
+  (SELECT count(*) || '.' || max(xmin::text::bigint) FROM pg_class),
+  (SELECT count(*) || '.' || max(xmin::text::bigint) FROM pg_namespace),
+  (SELECT count(*) || '.' || max(xmin::text::bigint) FROM pg_attribute),
+  (SELECT count(*) || '.' || max(xmin::text::bigint) FROM pg_proc),
+  (SELECT count(*) || '.' || max(xmin::text::bigint) FROM pg_description),
+  (SELECT count(*)::text FROM pg_user)
+], '/') AS version
+"""
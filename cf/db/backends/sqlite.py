@@ -28,6 +28,7 @@ import functools
 from cf.db import TRANSACTION_IDLE, TRANSACTION_ACTIVE
 from cf.db import objects
 from cf.db.backends import Generic, GUIOption
+from cf.db.backends import group_by_typeid, in_lists
 
 
 P_ERROR_MESSAGES = set([
@@ -120,27 +121,63 @@ class SQLite(Generic):
                                      createstmt=item[3])
                 meta.set_object(views)
 
+    def cancel(self, connection):
+        connection.get_dbapi_connection().interrupt()
+        return True
+
+    def get_catalog_version(self, connection):
+        return connection.execute('pragma schema_version')[0][0]
+
     def refresh(self, obj, meta, connection):
         if obj.typeid == 'columns':
             self._refresh_columns(obj, meta, connection)
 
-    def _refresh_columns(self, obj, meta, connection):
-        table = obj.parent
+    def refresh_many(self, parents, meta, connection):
+        groups = group_by_typeid(parents)
+        # pragma_table_info() is available since SQLite 3.16.
+        if ('columns' in groups
+            and self.dbapi().sqlite_version_info >= (3, 16, 0)):
+            self._refresh_columns_many(groups.pop('columns'), meta,
+                                       connection)
+        for objs in groups.itervalues():
+            Generic.refresh_many(self, objs, meta, connection)
+
+    def _get_known_columns(self, coll, meta):
         known_columns = {}
         [known_columns.setdefault(k.cid, k)
-         for k in meta.find(cls=objects.Column, parent=obj)]
+         for k in meta.find(cls=objects.Column, parent=coll)]
+        return known_columns
+
+    def _set_column(self, coll, known_columns, meta, item):
+        # item is: cid, name, type, notnull, dflt_value, pk
+        col = known_columns.get(item[0], None)
+        if col is None:
+            col = objects.Column(meta, parent=coll, cid=item[0])
+        col.name = item[1]
+        col.type = item[2]
+        col.notnull = item[3]
+        col.default = item[4]
+        col.pk = item[5]
+        meta.set_object(col)
+
+    def _refresh_columns(self, obj, meta, connection):
+        table = obj.parent
+        known_columns = self._get_known_columns(obj, meta)
         sql = "pragma table_info('%s')" % table.name  # somehow ? doesn't work
         for item in connection.execute(sql):
-            # item is: cid, name, type, notnull, dflt_value, pk
-            col = known_columns.get(item[0], None)
-            if col is None:
-                col = objects.Column(meta, parent=obj, cid=item[0])
-            col.name = item[1]
-            col.type = item[2]
-            col.notnull = item[3]
-            col.default = item[4]
-            col.pk = item[5]
-            meta.set_object(col)
-
+            self._set_column(obj, known_columns, meta, item)
+
+    def _refresh_columns_many(self, colls, meta, connection):
+        by_name = dict((coll.parent.name, coll) for coll in colls)
+        known_columns = dict((coll, self._get_known_columns(coll, meta))
+                             for coll in colls)
+        for names in in_lists(by_name):
+            sql = ('select m.name, p.cid, p.name, p.type, p."notnull",'
+                   ' p.dflt_value, p.pk'
+                   ' from sqlite_master m, pragma_table_info(m.name) p'
+                   ' where m.name in (%s)' % names)
+            for item in connection.execute(sql):
+                coll = by_name[item[0]]
+                self._set_column(coll, known_columns[coll], meta, item[1:])
 
 DRIVER = SQLite
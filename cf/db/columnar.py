@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Column oriented storage for query results.
+
+A :class:`ColumnarResult` stores each column of a result separately.
+Integers, floats, dates and timestamps are kept in :mod:`array` arrays,
+strings are dictionary-encoded and NULL values are tracked in a bitmap
+per column. Columns with other or mixed value types fall back to a plain
+list.
+
+The result behaves like a list of row tuples, but single values should
+be read with :meth:`ColumnarResult.get_value` and whole columns with
+:meth:`ColumnarResult.get_column` to avoid building row tuples.
+"""
+
+import array
+import datetime
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _datetime_to_int(value):
+    if value.tzinfo is not None:
+        raise TypeError('timezone aware timestamp')
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _int_to_datetime(value):
+    return _EPOCH + datetime.timedelta(microseconds=value)
+
+
+class _ArrayColumn(object):
+    """Column of fixed-size values stored in an array."""
+
+    def __init__(self, typecode, types, encode=None, decode=None):
+        self.data = array.array(typecode)
+        self.types = types
+        self.encode = encode
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        """Append *value*, returns ``False`` if it's not supported."""
+        if type(value) not in self.types:
+            return False
+        try:
+            if self.encode is not None:
+                value = self.encode(value)
+            self.data.append(value)
+        except (OverflowError, TypeError):
+            return False
+        return True
+
+    def append_null(self):
+        self.data.append(0)
+
+    def get(self, idx):
+        value = self.data[idx]
+        if self.decode is not None:
+            value = self.decode(value)
+        return value
+
+
+class _DictColumn(object):
+    """Dictionary-encoded column for strings."""
+
+    types = (str, unicode)
+
+    def __init__(self):
+        self.data = array.array('l')
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        if type(value) not in self.types:
+            return False
+        # Keep str and unicode apart, 'a' and u'a' compare equal.
+        key = (type(value), value)
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[key] = code
+        self.data.append(code)
+        return True
+
+    def append_null(self):
+        self.data.append(-1)
+
+    def get(self, idx):
+        return self.values[self.data[idx]]
+
+
+class _ObjectColumn(object):
+    """Column that stores Python objects in a list."""
+
+    def __init__(self, values=None):
+        self.data = values or []
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        self.data.append(value)
+        return True
+
+    def append_null(self):
+        self.data.append(None)
+
+    def get(self, idx):
+        return self.data[idx]
+
+
+def _create_column(value):
+    """Returns a new column suitable for *value*."""
+    vtype = type(value)
+    if vtype in (int, long):
+        return _ArrayColumn('l', (int, long))
+    elif vtype is float:
+        return _ArrayColumn('d', (float,))
+    elif vtype is datetime.date:
+        return _ArrayColumn('l', (datetime.date,),
+                            datetime.date.toordinal,
+                            datetime.date.fromordinal)
+    elif vtype is datetime.datetime and value.tzinfo is None:
+        return _ArrayColumn('l', (datetime.datetime,),
+                            _datetime_to_int, _int_to_datetime)
+    elif vtype in _DictColumn.types:
+        return _DictColumn()
+    return _ObjectColumn()
+
+
+class ColumnarResult(object):
+    """Column oriented, list-like storage for result rows.
+
+    :param description: DB-API2 cursor description.
+    :param rows: Optional sequence of rows to add.
+    """
+
+    def __init__(self, description, rows=None):
+        self.description = description
+        num_cols = len(description)
+        self._columns = [None] * num_cols
+        self._nulls = [bytearray() for i in xrange(num_cols)]
+        self._len = 0
+        if rows:
+            self.extend(rows)
+
+    def __len__(self):
+        return self._len
+
+    def __nonzero__(self):
+        return self._len > 0
+
+    def __iter__(self):
+        for idx in xrange(self._len):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(self._len))]
+        if idx < 0:
+            idx += self._len
+        if idx < 0 or idx >= self._len:
+            raise IndexError('row index out of range')
+        return tuple(self.get_value(idx, col)
+                     for col in xrange(len(self._columns)))
+
+    def _set_null(self, col, idx):
+        bitmap = self._nulls[col]
+        byte = idx >> 3
+        while len(bitmap) <= byte:
+            bitmap.append(0)
+        bitmap[byte] |= 1 << (idx & 7)
+
+    def is_null(self, idx, col):
+        """Returns ``True`` if the value at *idx*, *col* is NULL."""
+        bitmap = self._nulls[col]
+        byte = idx >> 3
+        return byte < len(bitmap) and bool(bitmap[byte] & (1 << (idx & 7)))
+
+    def _append_value(self, col, value):
+        column = self._columns[col]
+        if value is None:
+            self._set_null(col, self._len)
+            if column is not None:
+                column.append_null()
+            return
+        if column is None:
+            column = self._columns[col] = _create_column(value)
+            for i in xrange(self._len):
+                column.append_null()
+        if not column.append(value):
+            # Mixed types, fall back to a plain list.
+            values = [self.get_value(i, col) for i in xrange(len(column))]
+            column = self._columns[col] = _ObjectColumn(values)
+            column.append(value)
+
+    def append(self, row):
+        for col, value in enumerate(row):
+            self._append_value(col, value)
+        self._len += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def get_value(self, idx, col):
+        """Returns the value at row *idx*, column *col*."""
+        if self.is_null(idx, col):
+            return None
+        return self._columns[col].get(idx)
+
+    def get_column(self, col):
+        """Returns a list of all values of column *col*."""
+        column = self._columns[col]
+        if column is None:
+            return [None] * self._len
+        if not self._nulls[col]:
+            return [column.get(idx) for idx in xrange(self._len)]
+        return [self.get_value(idx, col) for idx in xrange(self._len)]
+
+    def get_column_type(self, col):
+        """Returns the storage of column *col*.
+
+        The result is ``'array'``, ``'dict'`` or ``'object'``, or ``None``
+        if the column contains only NULL values.
+        """
+        column = self._columns[col]
+        if column is None:
+            return None
+        elif isinstance(column, _ArrayColumn):
+            return 'array'
+        elif isinstance(column, _DictColumn):
+            return 'dict'
+        return 'object'
+
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index for autocompletion.
+
+A :class:`CompletionIndex` holds completions (2-tuples of completion and
+description) and finds all completions containing a fragment without
+scanning all entries. Entries are kept in a bigram index for substring
+lookups and in a sorted list for prefix lookups. The sorted list is
+rebuilt on the first prefix lookup after changes, so that adding many
+entries stays cheap.
+
+Each :class:`~cf.db.meta.DatabaseMeta` instance has an index of object
+names that's updated when objects are added or renamed. SQL keywords
+are in a shared index returned by :func:`get_keyword_index`. Indexes
+can be read from worker threads while they're updated in the main
+thread.
+
+:func:`fuzzy_score` and :func:`rank` implement fuzzy matching of
+completions, similar to what fzf does: the characters of a fragment
+must appear in order and matches at word boundaries (start, after an
+underscore or dot, camel case humps) and consecutive matches are
+preferred.
+"""
+
+import bisect
+import heapq
+import math
+import re
+import threading
+from gettext import gettext as _
+
+import sqlparse.keywords
+
+
+# Characters that start a new word in an identifier.
+WORD_SEPARATORS = '_.$ '
+
+# Scores used by fuzzy_score().
+SCORE_MATCH = 16
+SCORE_CONSECUTIVE = 16
+SCORE_BOUNDARY = 24
+SCORE_START = 32
+SCORE_EXACT = 64
+PENALTY_GAP = 2
+PENALTY_LEADING = 1
+
+# Score added for log(1+n) uses of an identifier, see rank().
+SCORE_USAGE = 24
+
+
+def _subsequence(fragment):
+    """Returns a regex matching strings containing *fragment* in order."""
+    return re.compile('.*?'.join(re.escape(char) for char in fragment),
+                      re.I | re.U)
+
+
+def _bigrams(value):
+    return set(value[i:i+2] for i in xrange(len(value)-1))
+
+
+def _is_boundary(value, idx):
+    if idx == 0:
+        return True
+    prev = value[idx-1]
+    return (prev in WORD_SEPARATORS
+            or (value[idx].isupper() and prev.islower()))
+
+
+def _initials(value):
+    """Returns the lower-cased characters at word boundaries."""
+    return set(value[idx].lower() for idx in xrange(len(value))
+               if _is_boundary(value, idx))
+
+
+def _align(candidate, lower, fragment, boundaries):
+    """Returns positions of the characters of *fragment* or ``None``.
+
+    If *boundaries* is true, characters that don't continue the previous
+    match are taken from the next word boundary if possible.
+    """
+    positions = []
+    pos = 0
+    for char in fragment:
+        found = -1
+        if boundaries and not (positions and pos < len(lower)
+                               and lower[pos] == char):
+            found = lower.find(char, pos)
+            while found != -1 and not _is_boundary(candidate, found):
+                found = lower.find(char, found+1)
+        if found == -1:
+            found = lower.find(char, pos)
+            if found == -1:
+                return None
+        positions.append(found)
+        pos = found + 1
+    return positions
+
+
+def _score_positions(candidate, positions):
+    score = 0
+    prev = None
+    for pos in positions:
+        score += SCORE_MATCH
+        if pos == 0:
+            score += SCORE_START
+        elif _is_boundary(candidate, pos):
+            score += SCORE_BOUNDARY
+        if prev is not None:
+            if pos == prev + 1:
+                score += SCORE_CONSECUTIVE
+            else:
+                score -= PENALTY_GAP * min(pos - prev - 1, 8)
+        prev = pos
+    return score - PENALTY_LEADING * min(positions[0], 8)
+
+
+def fuzzy_score(candidate, fragment):
+    """Score *candidate* for *fragment*.
+
+    Returns a 2-tuple (score, positions) where *positions* are the indexes
+    of the matched characters in *candidate*. Higher scores are better.
+    (None, None) is returned if *candidate* doesn't contain the characters
+    of *fragment* in order.
+    """
+    if not fragment:
+        return 0, []
+    lower = candidate.lower()
+    fragment = fragment.lower()
+    alignments = []
+    start = lower.find(fragment)
+    if start != -1:
+        # Prefer a substring match at a word boundary.
+        pos = start
+        while pos != -1 and not _is_boundary(candidate, pos):
+            pos = lower.find(fragment, pos+1)
+        if pos != -1:
+            start = pos
+        alignments.append(range(start, start+len(fragment)))
+    for boundaries in (True, False):
+        positions = _align(candidate, lower, fragment, boundaries)
+        if positions is None:
+            return None, None
+        alignments.append(positions)
+    score, positions = max((_score_positions(candidate, positions), positions)
+                           for positions in alignments)
+    if lower == fragment:
+        score += SCORE_EXACT
+    # Prefer shorter candidates.
+    score -= (len(lower) - len(fragment)) // 4
+    return score, positions
+
+
+def rank(completions, fragment, usage=None, limit=None):
+    """Rank completions by their fuzzy score for *fragment*.
+
+    :param completions: Sequence of 2-tuples (completion, description).
+    :param fragment: The fragment to complete.
+    :param usage: Optional dictionary mapping lower-cased identifiers to
+      the number of times they were used. Frequently used identifiers
+      are ranked higher.
+    :param limit: Maximum number of results (default: all).
+    :returns: List of 3-tuples (score, positions, completion) with the
+      best match first, *completion* is the 2-tuple from *completions*.
+    """
+    ranked = []
+    # Cheap check to skip most candidates that don't match at all.
+    matches = _subsequence(fragment).search
+    for completion in completions:
+        if not matches(completion[0]):
+            continue
+        score, positions = fuzzy_score(completion[0], fragment)
+        if score is None:
+            continue
+        if usage:
+            name = completion[0].lower()
+            count = usage.get(name) or usage.get(name.rsplit('.', 1)[-1])
+            if count:
+                score += int(SCORE_USAGE * math.log(1 + count))
+        ranked.append((score, positions, completion))
+    key = lambda item: (-item[0], item[2][0])
+    if limit is not None:
+        return heapq.nsmallest(limit, ranked, key=key)
+    ranked.sort(key=key)
+    return ranked
+
+
+class CompletionIndex(object):
+    """Index for completions.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._keys = {}
+        self._sorted = None
+        self._grams = {}
+        self._initials = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, completion, description, key=None):
+        """Add a completion.
+
+        :param completion: The completion string.
+        :param description: Description of the completion.
+        :param key: Optional key, e.g. the database object. An entry
+          previously added with the same key is replaced.
+        """
+        self._lock.acquire()
+        try:
+            self._add(completion, description, key)
+        finally:
+            self._lock.release()
+
+    def _add(self, completion, description, key):
+        if key is not None and key in self._keys:
+            self._remove(key)
+        entry_id = self._next_id
+        self._next_id += 1
+        lower = completion.lower()
+        self._entries[entry_id] = (lower, (completion, description))
+        if key is not None:
+            self._keys[key] = entry_id
+        self._sorted = None
+        for gram in _bigrams(lower):
+            self._grams.setdefault(gram, set()).add(entry_id)
+        for char in _initials(completion):
+            self._initials.setdefault(char, set()).add(entry_id)
+
+    def remove(self, key):
+        """Remove the entry added with *key*."""
+        self._lock.acquire()
+        try:
+            self._remove(key)
+        finally:
+            self._lock.release()
+
+    def _remove(self, key):
+        entry_id = self._keys.pop(key, None)
+        if entry_id is None:
+            return
+        lower, (completion, description) = self._entries.pop(entry_id)
+        self._sorted = None
+        for gram in _bigrams(lower):
+            ids = self._grams[gram]
+            ids.discard(entry_id)
+            if not ids:
+                del self._grams[gram]
+        for char in _initials(completion):
+            ids = self._initials[char]
+            ids.discard(entry_id)
+            if not ids:
+                del self._initials[char]
+
+    def find_prefix(self, prefix):
+        """Returns completions starting with *prefix* (case-insensitive).
+
+        The returned list is sorted by completion.
+        """
+        prefix = prefix.lower()
+        self._lock.acquire()
+        try:
+            if self._sorted is None:
+                self._sorted = sorted((entry[0], entry_id)
+                                      for entry_id, entry
+                                      in self._entries.iteritems())
+            idx = bisect.bisect_left(self._sorted, (prefix,))
+            ret = []
+            while idx < len(self._sorted):
+                lower, entry_id = self._sorted[idx]
+                if not lower.startswith(prefix):
+                    break
+                ret.append(self._entries[entry_id][1])
+                idx += 1
+        finally:
+            self._lock.release()
+        return ret
+
+    def _find_ids(self, fragment):
+        fragment = fragment.lower()
+        if len(fragment) < 2:
+            return set(entry_id
+                       for entry_id, entry in self._entries.iteritems()
+                       if fragment in entry[0])
+        candidates = []
+        for gram in _bigrams(fragment):
+            ids = self._grams.get(gram)
+            if not ids:
+                return set()
+            candidates.append(ids)
+        candidates.sort(key=len)
+        ids = candidates[0].intersection(*candidates[1:])
+        return set(entry_id for entry_id in ids
+                   if fragment in self._entries[entry_id][0])
+
+    def find(self, fragment):
+        """Returns completions containing *fragment* (case-insensitive)."""
+        self._lock.acquire()
+        try:
+            return [self._entries[entry_id][1]
+                    for entry_id in self._find_ids(fragment)]
+        finally:
+            self._lock.release()
+
+    def find_fuzzy(self, fragment):
+        """Returns candidates for fuzzy matching of *fragment*.
+
+        The result contains all completions containing *fragment* and
+        all completions with a word starting with the first character of
+        *fragment*. Use :func:`rank` to score and filter them, e.g. in
+        a worker thread since it's slow for many candidates.
+        """
+        self._lock.acquire()
+        try:
+            ids = self._find_ids(fragment)
+            if fragment:
+                ids.update(self._initials.get(fragment[0].lower(), ()))
+            return [self._entries[entry_id][1] for entry_id in ids]
+        finally:
+            self._lock.release()
+
+
+_keyword_index = None
+_keyword_lock = threading.Lock()
+
+
+def get_keyword_index():
+    """Returns the index of SQL keywords."""
+    global _keyword_index
+    _keyword_lock.acquire()
+    try:
+        if _keyword_index is None:
+            index = CompletionIndex()
+            keywords = set(sqlparse.keywords.KEYWORDS_COMMON)
+            keywords.update(sqlparse.keywords.KEYWORDS)
+            for kwd in keywords:
+                index.add(kwd, _(u'Keyword'))
+            _keyword_index = index
+    finally:
+        _keyword_lock.release()
+    return _keyword_index
@@ -21,25 +21,70 @@
 from gettext import gettext as _
 
 import logging
-import thread
 
 import gobject
-import gtk
 
+from cf.db import objects
+from cf.db import schemacache
+from cf.db.completion import CompletionIndex
+from cf.executor import Future
 
 
+# Objects offered by autocompletion.
+COMPLETION_CLASSES = (objects.Table, objects.View, objects.Sequence,
+                      objects.Schema)
+
+
+def _on_object_notify(obj, pspec):
+    obj.meta._reindex(obj, pspec.name)
+
 
 class DatabaseMeta(object):
+    """Object store for database objects.
+
+    Objects are kept in hash indexes by class and by the values of
+    :attr:`INDEXED_KEYS`, so that lookups like
+    ``find_exact(cls=Table, parent=coll, oid=1234)`` don't need to scan
+    all known objects.
+
+    Names of tables, views, sequences and schemas are kept in
+    :attr:`completions`, a :class:`~cf.db.completion.CompletionIndex`.
+
+    If the schema cache is enabled (``db.schema_cache``), the objects are
+    read from the cache file of the data source on instance creation.
+    :meth:`initialize` then only reads the database structure again if
+    the catalog version reported by the backend has changed.
+
+    Children of collections (e.g. the columns of a table) are read when
+    they're first needed. :meth:`prefetch` reads them in the background
+    before that happens.
+    """
+
+    INDEXED_KEYS = ('name', 'parent', 'oid')
 
     def __init__(self, datasource):
         self.datasource = datasource
         self.app = datasource.manager.app
         self.conn = self.datasource.internal_connection
+        self._track_changes = True
+        self._prefetching = set()
+        self._prefetch_future = None
+        self._reset()
+        self._catalog_version = None
+        if self._use_cache():
+            self._load_cache()
+        # True if objects were added or changed since the schema cache
+        # was read or written.
+        self._cache_dirty = False
+        self.initialize()
+
+    def _reset(self):
         self._items = set()
-        if self.conn.threadsafety >= 2:
-            thread.start_new_thread(self.initialize, (True,))
-        else:
-            self.initialize()
+        self._by_class = {}
+        self._index = dict((key, {}) for key in self.INDEXED_KEYS)
+        self._unhashable = dict((key, set()) for key in self.INDEXED_KEYS)
+        self._indexed_values = {}
+        self.completions = CompletionIndex()
 
     @property
     def backend(self):
@@ -48,30 +93,198 @@ class DatabaseMeta(object):
     def get_server_info(self):
         return self.backend.get_server_info(self.conn)
 
-    def initialize(self, threaded=False):
-        """Called after instance creation to prepare intial data."""
-        if threaded:
-            gtk.gdk.threads_enter()
-        self.app.set_status_message(_(u'Loading database structure...'), 100)
-        if threaded:
-            gtk.gdk.threads_leave()
+    def _use_cache(self):
+        return (self.datasource.id is not None
+                and self.app.config.get('db.schema_cache', True))
+
+    def _load_cache(self):
+        cached = schemacache.load(self.datasource)
+        if cached is None:
+            return
+        version, records = cached
+        try:
+            objs = schemacache.deserialize(self, records)
+        except:
+            logging.exception('Failed to restore schema cache:')
+            return
+        for obj in objs:
+            self.set_object(obj)
+        self._catalog_version = version
+
+    def save_cache_later(self):
+        """Writes the objects to the schema cache in a worker thread.
+
+        Nothing is written if the objects didn't change since the cache
+        was read or written. Writes for the same data source run one
+        after another.
+
+        Returns the :class:`~cf.executor.Future` of the job or ``None``.
+        """
+        if (not self._cache_dirty or not self._use_cache()
+            or self._catalog_version is None):
+            return None
+        self._cache_dirty = False
+        return self.app.executor.submit_for(self.datasource, self.save_cache,
+                                            list(self._items))
+
+    def save_cache(self, objs=None):
+        """Writes the current objects to the schema cache.
+
+        This method may run in a worker thread, see
+        :meth:`save_cache_later`.
+
+        :param objs: Objects to write (default: all known objects).
+        """
+        if not self._use_cache() or self._catalog_version is None:
+            return
+        if objs is None:
+            objs = list(self._items)
+        try:
+            schemacache.save(self.datasource, objs, self._catalog_version)
+        except:
+            logging.exception('Failed to write schema cache:')
+
+    def _get_catalog_version(self):
+        try:
+            return self.backend.get_catalog_version(self.conn)
+        except:
+            logging.exception('Failed to get catalog version:')
+            return None
+
+    def _read_structure(self):
+        """Returns a 2-tuple (version, store).
+
+        *store* is a new :class:`DatabaseMeta` instance holding the current
+        database structure or ``None`` if the cached objects are up to
+        date. This method may run in a worker thread.
+        """
+        version = None
+        if self._use_cache():
+            version = self._get_catalog_version()
+            if version is not None and version == self._catalog_version:
+                return version, None
+        store = self._create_store()
+        self.backend.initialize(store, self.conn)
+        return version, store
+
+    def _create_store(self, track_changes=True):
+        """Returns an empty store for objects read in a worker thread.
+
+        If *track_changes* is ``False``, the store doesn't update its
+        indexes when objects are changed after they were added.
+        """
+        store = DatabaseMeta.__new__(DatabaseMeta)
+        store.datasource = self.datasource
+        store.app = self.app
+        store.conn = self.conn
+        store._track_changes = track_changes
+        store._prefetching = set()
+        store._reset()
+        return store
+
+    def _structure_read(self, future):
+        self.app.pop_status_message(100)
         try:
-            self.backend.initialize(self, self.conn)
+            version, store = future.result()
         except:
             msg = 'DatabaseMeta.initialize failed (driver: %s):'
             msg = msg % self.backend.drivername
             logging.exception(msg)
-        if threaded:
-            gtk.gdk.threads_enter()
-        self.app.pop_status_message(100)
-        if threaded:
-            gtk.gdk.threads_leave()
+            return
+        if store is None:
+            logging.debug('Schema cache for %s is up to date',
+                          self.datasource.get_label())
+            return
+        replaced = bool(self._items)
+        for obj in store._items:
+            obj.meta = self
+        self._items = store._items
+        self._by_class = store._by_class
+        self._index = store._index
+        self._unhashable = store._unhashable
+        self._indexed_values = store._indexed_values
+        self.completions = store.completions
+        self._catalog_version = version
+        if replaced:
+            # Objects from an outdated cache were replaced.
+            self.datasource.manager.emit('datasource-changed',
+                                         self.datasource)
+        self._cache_dirty = True
+        self.save_cache_later()
+
+    def initialize(self):
+        """Reads the database structure.
+
+        The structure is read in a worker thread if the connection is
+        thread-safe. If objects were loaded from the schema cache they're
+        only replaced if the catalog version has changed.
+        """
+        self.app.set_status_message(_(u'Loading database structure...'), 100)
+        if self.conn.threadsafety >= 2:
+            future = self.app.executor.submit_for(self.conn,
+                                                  self._read_structure)
+            future.add_done_callback(self._structure_read)
+        else:
+            future = Future()
+            future.run(self._read_structure)
+            self._structure_read(future)
+
+    def _get_value(self, obj, key):
+        """Returns the value of *key* as seen by property_matches()."""
+        if key in obj._data:
+            return obj._data[key]
+        return obj.get_data(key)
+
+    def _index_key(self, obj, key):
+        value = self._get_value(obj, key)
+        try:
+            self._index[key].setdefault(value, set()).add(obj)
+        except TypeError:  # unhashable value, always a candidate
+            self._unhashable[key].add(obj)
+        self._indexed_values[obj][key] = value
+
+    def _unindex_key(self, obj, key):
+        value = self._indexed_values[obj].pop(key)
+        self._unhashable[key].discard(obj)
+        try:
+            bucket = self._index[key].get(value)
+        except TypeError:
+            return
+        if bucket is not None:
+            bucket.discard(obj)
+            if not bucket:
+                del self._index[key][value]
+
+    def _reindex(self, obj, key):
+        self._cache_dirty = True
+        if key in self.INDEXED_KEYS and obj in self._indexed_values:
+            self._unindex_key(obj, key)
+            self._index_key(obj, key)
+            self._index_completion(obj)
+
+    def _index_completion(self, obj):
+        if isinstance(obj, COMPLETION_CLASSES) and obj.name:
+            self.completions.add(obj.get_full_name(), obj.typestr, obj)
 
     def set_object(self, obj):
-        """Adds or replaces an object."""
+        """Adds or replaces an object.
+
+        Calling this method for a known object updates the indexes, e.g.
+        when an attribute that isn't a property has changed.
+        """
         if obj in self._items:
-            self._items.remove(obj)
-        self._items.add(obj)
+            for key in self.INDEXED_KEYS:
+                self._unindex_key(obj, key)
+        else:
+            self._items.add(obj)
+            self._by_class.setdefault(obj.__class__, set()).add(obj)
+            self._indexed_values[obj] = {}
+            if self._track_changes:
+                obj.connect('notify', _on_object_notify)
+        for key in self.INDEXED_KEYS:
+            self._index_key(obj, key)
+        self._index_completion(obj)
+        self._cache_dirty = True
 
     def get_children(self, parent=None):
         """Get child objects for parent."""
@@ -80,12 +293,103 @@ class DatabaseMeta(object):
             parent.props.refresh_required = False
         return self.find(parent=parent)
 
+    def prefetch(self, collections):
+        """Reads the children of *collections* in the background.
+
+        Collections that are already loaded or are being loaded are
+        skipped. The remaining collections are passed to the backend's
+        :meth:`~cf.db.backends.Generic.refresh_many` in a worker thread,
+        so that backends can read them with a single catalog query. The
+        children are added in the main loop.
+
+        Connections that aren't thread-safe (e.g. SQLite) are read
+        immediately in the main thread instead, still with a single call
+        of :meth:`~cf.db.backends.Generic.refresh_many`.
+
+        Returns a :class:`~cf.executor.Future` whose done callbacks are
+        called after the children of all *collections* were added, or
+        ``None`` if there's nothing to load (anymore).
+        """
+        missing = [coll for coll in collections
+                   if coll.props.refresh_required]
+        if self.conn.threadsafety < 2:
+            if missing:
+                try:
+                    store = self._read_children(missing)
+                except:
+                    logging.exception('Failed to prefetch child objects:')
+                else:
+                    self._add_children(store, missing)
+            return None
+        pending = [coll for coll in missing
+                   if coll not in self._prefetching]
+        if pending:
+            self._prefetching.update(pending)
+            # Jobs for the same connection run in order, so this job
+            # finishes after the ones already running.
+            self._prefetch_future = self.app.executor.submit_for(
+                self.conn, self._read_children, pending)
+            self._prefetch_future.add_done_callback(
+                lambda f: self._children_read(f, pending))
+        elif not missing:
+            return None
+        return self._prefetch_future
+
+    def _read_children(self, collections):
+        store = self._create_store(track_changes=False)
+        self.backend.refresh_many(collections, store, self.conn)
+        return store
+
+    def _children_read(self, future, collections):
+        self._prefetching.difference_update(collections)
+        if future.cancelled():
+            return
+        try:
+            store = future.result()
+        except:
+            logging.exception('Failed to prefetch child objects:')
+            return
+        self._add_children(store, collections)
+
+    def _add_children(self, store, collections):
+        # Collections refreshed in the meantime already have children.
+        loaded = set(coll for coll in collections
+                     if coll.props.refresh_required)
+        for obj in store._items:
+            if obj.parent in loaded:
+                obj.meta = self
+                self.set_object(obj)
+        for coll in loaded:
+            coll.props.refresh_required = False
+
+    def _find_candidates(self, key, value):
+        try:
+            res = self._index[key].get(value, set())
+        except TypeError:
+            return set(obj for obj in self._items
+                       if obj.property_matches(key, value))
+        if self._unhashable[key]:
+            res = res.union(self._unhashable[key])
+        return res
+
     def find(self, **kwds):
         """Find an object using searchterm."""
-        res = list(self._items)
-        if 'cls' in kwds:
-            objcls = kwds.pop('cls')
-            res = filter(lambda x: isinstance(x, objcls), res)
+        objcls = kwds.pop('cls', None)
+        candidates = [self._find_candidates(key, kwds.pop(key))
+                      for key in self.INDEXED_KEYS if key in kwds]
+        if candidates:
+            candidates.sort(key=len)
+            res = candidates[0].intersection(*candidates[1:])
+            if objcls is not None:
+                res = [obj for obj in res if isinstance(obj, objcls)]
+        elif objcls is not None:
+            res = []
+            for klass, objs in self._by_class.items():
+                if issubclass(klass, objcls):
+                    res.extend(objs)
+        else:
+            res = self._items
+        res = list(res)
         for key, value in kwds.iteritems():
             res = filter(lambda x: x.property_matches(key, value), res)
         return res
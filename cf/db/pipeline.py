@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Execution of a sequence of statements.
+
+An :class:`ExecutionPipeline` executes statements one after another on a
+connection. The statements are taken from an iterable, usually
+:func:`iter_text_statements` which splits a text while the statements
+are executed. Statements are executed in a worker thread if the
+connection allows it.
+
+Executed queries are handed back to the main loop in batches and not one
+by one, so that scripts with many small statements aren't slowed down by
+updates of the user interface. Pending queries are delivered every
+:data:`BATCH_INTERVAL` seconds.
+"""
+
+import logging
+import threading
+import time
+
+import gobject
+
+from cf.db import Query
+from cf.db.splitter import iter_statements
+
+
+# Time in seconds between two deliveries of executed queries.
+BATCH_INTERVAL = 0.1
+
+
+def iter_text_statements(text, start_line=1, split=True):
+    """Yields the statements in *text*.
+
+    :param text: SQL text.
+    :param start_line: Line number of the first line of *text*.
+    :param split: If ``False``, the whole text is a single statement.
+    :returns: Generator of 2-tuples (statement, line) where *line* is
+      the number of the line the statement starts at.
+    """
+    if not split:
+        if text.strip():
+            yield text, start_line
+        return
+    line = start_line
+    pos = 0
+    for start, end, unused in iter_statements(text):
+        line += text.count('\n', pos, start)
+        pos = start
+        yield text[start:end], line
+
+
+class ExecutionPipeline(gobject.GObject):
+    """Executes statements one after another.
+
+    :Signals:
+
+    queries-executed
+      ``def callback(pipeline, queries)``
+
+      Emitted with a list of executed :class:`~cf.db.Query` instances.
+      :meth:`~cf.db.Query.finish` was already called for each of them.
+
+    finished
+      ``def callback(pipeline)``
+
+      Emitted when all statements were executed or execution stopped
+      because a statement failed or the pipeline was cancelled.
+
+    All signals are emitted in the main loop.
+
+    :param connection: The :class:`~cf.db.Connection` to use.
+    :param statements: Iterable of 2-tuples (statement, line).
+    :param setup_query: Optional callable, called with each
+      :class:`~cf.db.Query` and the line of its statement before the
+      query is executed. It may be called in a worker thread.
+    :param stop_on_error: If ``True``, the remaining statements are
+      skipped when a statement fails.
+    """
+
+    __gsignals__ = {
+        'queries-executed': (gobject.SIGNAL_RUN_LAST,
+                             gobject.TYPE_NONE,
+                             (gobject.TYPE_PYOBJECT,)),
+        'finished': (gobject.SIGNAL_RUN_LAST,
+                     gobject.TYPE_NONE,
+                     tuple()),
+    }
+
+    def __init__(self, connection, statements, setup_query=None,
+                 stop_on_error=True):
+        self.__gobject_init__()
+        self.connection = connection
+        self.statements = statements
+        self.setup_query = setup_query
+        self.stop_on_error = stop_on_error
+        # The query that's currently executed and the line its statement
+        # starts at.
+        self.current = None
+        self.line = None
+        self.executed = 0
+        self.failed = 0
+        self.cancelled = False
+        self.finished = False
+        self.elapsed = 0
+        self._start = None
+        self._timer = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def run(self, executor=None):
+        """Starts executing the statements.
+
+        If *executor* is given and the connection can be used from a
+        different thread, the statements are executed in a worker thread.
+        Otherwise this method blocks until all statements are executed.
+        """
+        self._start = time.time()
+        if executor is not None and self.connection.threadsafety >= 2:
+            self._timer = gobject.timeout_add(int(BATCH_INTERVAL * 1000),
+                                              self._on_timer)
+            future = executor.submit_for(self.connection, self._run, True)
+            future.add_done_callback(self._on_done)
+        else:
+            self._run(False)
+            self._deliver()
+            self._emit_finished()
+
+    def _on_timer(self):
+        self._deliver()
+        return True
+
+    def _on_done(self, future):
+        if future.exception() is not None:
+            logging.error('Failed to execute statements: %s',
+                          future.exception())
+        gobject.source_remove(self._timer)
+        self._timer = None
+        self._deliver()
+        self._emit_finished()
+
+    def _run(self, threaded):
+        """Executes the statements.
+
+        In threaded mode, executed queries are delivered by a timer in
+        the main loop. Otherwise they're delivered from time to time
+        while the statements are executed.
+        """
+        last_delivery = time.time()
+        try:
+            for statement, line in self.statements:
+                query = Query(statement, self.connection)
+                if self.setup_query is not None:
+                    self.setup_query(query, line)
+                self._lock.acquire()
+                try:
+                    if self.cancelled:
+                        break
+                    self.current = query
+                    self.line = line
+                finally:
+                    self._lock.release()
+                query.execute(threaded, notify=False)
+                self._lock.acquire()
+                try:
+                    self.current = None
+                    self._pending.append(query)
+                finally:
+                    self._lock.release()
+                self.executed += 1
+                if query.failed:
+                    self.failed += 1
+                now = time.time()
+                self.elapsed = now - self._start
+                if not threaded and (query.failed or query.description
+                                     or now - last_delivery
+                                     >= BATCH_INTERVAL):
+                    self._deliver()
+                    last_delivery = now
+                if query.failed and (self.stop_on_error or query.cancelled):
+                    break
+        except:
+            logging.exception('Failed to execute statements:')
+        self.elapsed = time.time() - self._start
+
+    def _deliver(self):
+        """Emits "queries-executed" for the pending queries."""
+        self._lock.acquire()
+        try:
+            queries = self._pending
+            self._pending = []
+        finally:
+            self._lock.release()
+        if not queries:
+            return
+        for query in queries:
+            try:
+                query.finish()
+            except:
+                logging.exception('Failed to finish query:')
+        self.emit('queries-executed', queries)
+
+    def _emit_finished(self):
+        self.finished = True
+        self.emit('finished')
+
+    def cancel(self):
+        """Cancels the running statement and skips the remaining ones.
+
+        This method can be called from any thread.
+        """
+        self._lock.acquire()
+        try:
+            self.cancelled = True
+            if self.current is not None:
+                self.current.cancel()
+        finally:
+            self._lock.release()
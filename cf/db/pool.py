@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Connection pooling.
+
+Each :class:`~cf.db.Datasource` has a :class:`ConnectionPool` that keeps
+track of the objects (usually editors) using its connections. Unused
+connections are handed out again by :meth:`ConnectionPool.acquire`
+instead of opening a new connection and they're closed after a
+configurable idle time.
+
+A connection is considered unused if it's not checked out by an editor,
+not in a transaction and it's not the internal connection of the data
+source (the internal connection is used to read the database structure).
+"""
+
+import logging
+import sys
+import time
+from gettext import gettext as _
+
+import gobject
+
+from cf.db import TRANSACTION_IDLE
+from cf.ui import dialogs
+
+
+# Interval in seconds to look for idle connections.
+REAP_INTERVAL = 30
+
+
+class ConnectionPool(object):
+    """Connection pool for a data source.
+
+    :param datasource: A :class:`~cf.db.Datasource` instance.
+    :param min_size: Number of connections that are kept open even if
+      they are unused (default: 1).
+    :param max_size: Maximum number of connections :meth:`acquire` opens,
+      0 means no limit (default: 0).
+    :param idle_timeout: Seconds after an unused connection is closed,
+      0 disables closing of idle connections (default: 600).
+    """
+
+    def __init__(self, datasource, min_size=1, max_size=0,
+                 idle_timeout=600):
+        self.datasource = datasource
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._users = {}
+        self._reaper = None
+
+    def add(self, conn):
+        """Start tracking *conn*."""
+        self._users[conn] = set()
+        conn.last_used = time.time()
+        conn.connect('closed', self.on_connection_closed)
+        if self.idle_timeout and self._reaper is None:
+            self._reaper = gobject.timeout_add_seconds(REAP_INTERVAL,
+                                                       self.on_reap)
+
+    def on_connection_closed(self, conn):
+        if conn in self._users:
+            del self._users[conn]
+        if not self._users and self._reaper is not None:
+            gobject.source_remove(self._reaper)
+            self._reaper = None
+
+    def on_reap(self):
+        self.reap()
+        return True
+
+    def checkout(self, conn, user):
+        """Mark *conn* as used by *user*."""
+        if conn in self._users:
+            self._users[conn].add(user)
+            conn.last_used = time.time()
+
+    def checkin(self, conn, user):
+        """Release *conn* previously checked out by *user*."""
+        if conn in self._users:
+            self._users[conn].discard(user)
+            conn.last_used = time.time()
+
+    def get_users(self, conn):
+        """Return a list of objects that use *conn*."""
+        return list(self._users.get(conn, []))
+
+    def is_unused(self, conn):
+        """Returns ``True`` if *conn* is neither checked out nor busy."""
+        if self._users.get(conn):
+            return False
+        if conn is self.datasource.internal_connection:
+            return False
+        state = conn.get_property('transaction-state')
+        return state == TRANSACTION_IDLE
+
+    def ping(self, conn):
+        """Returns ``True`` if *conn* is still usable.
+
+        Broken connections are closed.
+        """
+        try:
+            self.datasource.backend.ping(conn)
+            return True
+        except:
+            logging.info('Closing broken connection %s: %s',
+                         conn.get_label(), sys.exc_info()[1])
+            conn.close()
+            return False
+
+    def acquire(self):
+        """Return an unused connection.
+
+        An unused and healthy connection is returned if available.
+        Otherwise a new connection is opened using
+        :meth:`~cf.db.Datasource.dbconnect`. ``None`` is returned if the
+        connection fails or *max_size* connections are already open.
+        """
+        for conn in sorted(self._users, key=lambda c: c.num):
+            if self.is_unused(conn) and self.ping(conn):
+                conn.last_used = time.time()
+                return conn
+        if self.max_size and len(self._users) >= self.max_size:
+            msg = _(u'Could not connect to %(name)s: Connection limit '
+                    u'(%(num)d) reached.')
+            msg = msg % {'name': self.datasource.get_label(),
+                         'num': self.max_size}
+            dialogs.error(_(u'Failed'), msg)
+            return None
+        return self.datasource.dbconnect()
+
+    def reap(self):
+        """Close connections that were unused for *idle_timeout* seconds.
+
+        Returns the number of closed connections.
+        """
+        if not self.idle_timeout:
+            return 0
+        deadline = time.time() - self.idle_timeout
+        candidates = [conn for conn in self._users
+                      if self.is_unused(conn) and conn.last_used < deadline]
+        candidates.sort(key=lambda c: c.last_used)
+        num_closed = 0
+        for conn in candidates:
+            if len(self._users) <= self.min_size:
+                break
+            logging.debug('Closing idle connection %s', conn.get_label())
+            conn.close()
+            num_closed += 1
+        return num_closed
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache for results of SELECT statements.
+
+Results are keyed by data source and normalized statement. The cache is
+bounded by the estimated size of the cached rows and entries expire after
+a configurable time. :class:`~cf.db.Query` invalidates all entries of a
+data source when a statement other than SELECT is executed on it.
+
+The cache is disabled by default (``db.result_cache.enabled``).
+"""
+
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+
+from cf.db.columnar import ColumnarResult
+from cf.db.resultstore import estimate_row_size
+from cf.utils import normalize_sql
+
+
+class CacheEntry(object):
+    """A cached query result.
+
+    :param query: A executed :class:`~cf.db.Query` instance.
+    """
+
+    def __init__(self, query):
+        self.description = query.description
+        if isinstance(query.rows, ColumnarResult):
+            self.rows = query.rows
+        else:
+            self.rows = list(query.rows)
+        self.rowcount = query.rowcount
+        self.messages = list(query.messages)
+        self.coding_hint = query.coding_hint
+        self.timestamp = time.time()
+        self.size = estimate_size(self.rows)
+
+    def apply(self, query):
+        """Copy the cached result to *query*."""
+        query.description = self.description
+        if isinstance(self.rows, ColumnarResult):
+            # Not modified after the query has finished, no need to copy.
+            query.rows = self.rows
+        else:
+            query.rows = list(self.rows)
+        query.rowcount = self.rowcount
+        query.messages = list(self.messages)
+        query.coding_hint = self.coding_hint
+        query.cached_at = self.timestamp
+
+
+def estimate_size(rows):
+    """Returns the estimated memory size of *rows* in bytes."""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += estimate_row_size(row)
+    return size
+
+
+def get_datasource_key(datasource):
+    """Returns the cache key for *datasource*."""
+    if datasource.id is not None:
+        return datasource.id
+    return id(datasource)
+
+
+class ResultCache(object):
+    """LRU cache for query results.
+
+    All methods are thread-safe.
+
+    :param max_size: Maximum size of all cached results in bytes.
+    :param ttl: Seconds after an entry expires, 0 means never.
+    """
+
+    def __init__(self, max_size=10*1024*1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, datasource, statement):
+        return (get_datasource_key(datasource),
+                normalize_sql(statement).strip())
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, datasource, statement):
+        """Returns a :class:`CacheEntry` or ``None``."""
+        key = self._key(datasource, statement)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._remove(key)
+            if self.ttl and time.time() - entry.timestamp > self.ttl:
+                return None
+            # Re-insert to mark it as most recently used.
+            self._entries[key] = entry
+            self.size += entry.size
+            return entry
+        finally:
+            self._lock.release()
+
+    def put(self, datasource, query):
+        """Add the result of *query* to the cache.
+
+        Results larger than the cache or results written to disk are not
+        added. Least recently used entries are removed until the result
+        fits into the cache.
+        """
+        if getattr(query.rows, 'spilled', False):
+            return None
+        entry = CacheEntry(query)
+        if entry.size > self.max_size:
+            return None
+        key = self._key(datasource, query.statement)
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.size + entry.size > self.max_size:
+                self._remove(iter(self._entries).next())
+            self._entries[key] = entry
+            self.size += entry.size
+        finally:
+            self._lock.release()
+        return entry
+
+    def has_entries(self, datasource):
+        """Returns ``True`` if there are cached results for *datasource*."""
+        ds_key = get_datasource_key(datasource)
+        self._lock.acquire()
+        try:
+            for key in self._entries:
+                if key[0] == ds_key:
+                    return True
+            return False
+        finally:
+            self._lock.release()
+
+    def invalidate(self, datasource, statement=None):
+        """Remove cached results.
+
+        :param datasource: A :class:`~cf.db.Datasource` instance.
+        :param statement: If given, only the result of this statement is
+          removed. Otherwise all results of *datasource* are removed.
+        """
+        self._lock.acquire()
+        try:
+            if statement is not None:
+                key = self._key(datasource, statement)
+                if key in self._entries:
+                    self._remove(key)
+                return
+            ds_key = get_datasource_key(datasource)
+            for key in [k for k in self._entries if k[0] == ds_key]:
+                self._remove(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Remove all cached results."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Storage for query results that don't fit into memory.
+
+A :class:`ResultStore` behaves like a read-only list of rows that can be
+extended. The first rows are kept in memory. When their estimated size
+exceeds a limit, further rows are pickled to a temporary file and read
+back by row index when they're accessed.
+"""
+
+import array
+import cPickle
+import logging
+import sys
+import tempfile
+import threading
+
+
+# Number of rows read from the temporary file that are kept in memory.
+READ_CACHE_SIZE = 512
+
+
+def estimate_row_size(row):
+    """Returns the estimated memory size of *row* in bytes."""
+    size = sys.getsizeof(row)
+    for value in row:
+        size += sys.getsizeof(value)
+    return size
+
+
+class _Buffer(str):
+    """Marks a buffer object in a pickled row."""
+
+
+def _encode_row(row):
+    # Buffers (e.g. BLOBs in SQLite) can't be pickled.
+    if any(isinstance(value, buffer) for value in row):
+        row = row.__class__(isinstance(value, buffer)
+                            and _Buffer(value) or value
+                            for value in row)
+    return row
+
+
+def _decode_row(row):
+    if any(isinstance(value, _Buffer) for value in row):
+        row = row.__class__(isinstance(value, _Buffer)
+                            and buffer(str(value)) or value
+                            for value in row)
+    return row
+
+
+class ResultStore(object):
+    """List-like storage for result rows.
+
+    All methods are thread-safe.
+
+    :param memory_limit: Estimated size in bytes of the rows kept in
+      memory. Rows beyond this limit are written to a temporary file.
+    """
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.memory_size = 0
+        self._rows = []
+        self._file = None
+        self._offsets = array.array('L')
+        # Rows that failed to pickle, by index.
+        self._unpicklable = {}
+        self._read_cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def spilled(self):
+        """``True`` if rows were written to the temporary file."""
+        return self._file is not None
+
+    def __len__(self):
+        return len(self._rows) + len(self._offsets)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('row index out of range')
+        if idx < len(self._rows):
+            return self._rows[idx]
+        self._lock.acquire()
+        try:
+            return self._read(idx - len(self._rows))
+        finally:
+            self._lock.release()
+
+    def _read(self, num):
+        if num in self._unpicklable:
+            return self._unpicklable[num]
+        row = self._read_cache.get(num)
+        if row is not None:
+            return row
+        start = self._offsets[num]
+        if num + 1 < len(self._offsets):
+            end = self._offsets[num + 1]
+        else:
+            end = self._end
+        self._file.seek(start)
+        row = _decode_row(cPickle.loads(self._file.read(end - start)))
+        if len(self._read_cache) >= READ_CACHE_SIZE:
+            self._read_cache.clear()
+        self._read_cache[num] = row
+        return row
+
+    def _spill(self, row):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='crunchyfrog-')
+            self._end = 0
+        num = len(self._offsets)
+        try:
+            data = cPickle.dumps(_encode_row(row), cPickle.HIGHEST_PROTOCOL)
+        except:
+            logging.debug('Keeping unpicklable row %d in memory: %s',
+                          num, sys.exc_info()[1])
+            self._unpicklable[num] = row
+            data = ''
+        self._file.seek(self._end)
+        self._file.write(data)
+        self._offsets.append(self._end)
+        self._end += len(data)
+
+    def append(self, row):
+        self.extend([row])
+
+    def extend(self, rows):
+        self._lock.acquire()
+        try:
+            for row in rows:
+                if self._file is None:
+                    size = estimate_row_size(row)
+                    if self.memory_size + size <= self.memory_limit:
+                        self._rows.append(row)
+                        self.memory_size += size
+                        continue
+                    logging.debug('Result exceeds %d bytes, writing rows '
+                                  'to temporary file', self.memory_limit)
+                self._spill(row)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Removes the temporary file and all rows."""
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._rows = []
+            self._offsets = array.array('L')
+            self._unpicklable = {}
+            self._read_cache = {}
+            self.memory_size = 0
+        finally:
+            self._lock.release()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent cache for database meta information.
+
+The objects of a :class:`~cf.db.meta.DatabaseMeta` instance are written
+to a per-datasource file in ``USER_CONFIG_DIR/schemacache``. Together with
+the objects a catalog version as returned by the backend's
+``get_catalog_version()`` method is stored. It's up to the caller to
+compare this version with the current state of the database.
+"""
+
+import cPickle
+import logging
+import os
+import tempfile
+
+import cf
+from cf.db.objects import GObjectBase
+
+
+CACHE_DIR = os.path.join(cf.USER_CONFIG_DIR, 'schemacache')
+
+# Increase this number when the file format changes.
+CACHE_FORMAT = 1
+
+# Instance attributes that are never written to the cache.
+_SKIP_ATTRS = ('meta', '_data')
+
+
+class _Ref(int):
+    """Reference to another cached object (index into the object list)."""
+
+
+def get_filename(datasource):
+    """Returns the cache file name for *datasource*."""
+    return os.path.join(CACHE_DIR, datasource.id)
+
+
+def _encode(value, ids):
+    if isinstance(value, GObjectBase):
+        return _Ref(ids[value])
+    elif isinstance(value, (list, tuple)):
+        return value.__class__(_encode(x, ids) for x in value)
+    elif isinstance(value, dict):
+        return dict((k, _encode(v, ids)) for k, v in value.iteritems())
+    return value
+
+
+def _decode(value, objs):
+    if isinstance(value, _Ref):
+        return objs[value]
+    elif isinstance(value, (list, tuple)):
+        return value.__class__(_decode(x, objs) for x in value)
+    elif isinstance(value, dict):
+        return dict((k, _decode(v, objs)) for k, v in value.iteritems())
+    return value
+
+
+def serialize(objs):
+    """Converts a sequence of database objects into picklable records.
+
+    References between the objects are replaced by their position in
+    *objs*. A :exc:`KeyError` is raised if an object references an
+    object not in *objs*.
+    """
+    ids = dict((obj, idx) for idx, obj in enumerate(objs))
+    records = []
+    for obj in objs:
+        cls = obj.__class__
+        attrs = dict((key, _encode(value, ids))
+                     for key, value in obj.__dict__.iteritems()
+                     if key not in _SKIP_ATTRS)
+        records.append(('%s.%s' % (cls.__module__, cls.__name__),
+                        _encode(obj._data, ids), attrs))
+    return records
+
+
+def deserialize(meta, records):
+    """Re-creates database objects from records.
+
+    The objects are created without calling the constructors of their
+    classes, so no additional objects are created on the fly.
+    """
+    objs = []
+    for clsname, data, attrs in records:
+        modname, name = clsname.rsplit('.', 1)
+        mod = __import__(modname, fromlist=[name])
+        cls = getattr(mod, name)
+        obj = cls.__new__(cls)
+        GObjectBase.__init__(obj)
+        objs.append(obj)
+    for obj, (clsname, data, attrs) in zip(objs, records):
+        obj.meta = meta
+        for key, value in data.iteritems():
+            if key in obj._data:
+                obj._data[key] = _decode(value, objs)
+        # Same as GObjectBase.apply_data() for non-property keys.
+        for key, value in attrs.iteritems():
+            value = _decode(value, objs)
+            obj.set_data(key, value)
+            setattr(obj, key, value)
+    return objs
+
+
+def save(datasource, objs, version):
+    """Writes objects to the cache file of *datasource*."""
+    data = {'format': CACHE_FORMAT,
+            'url': datasource.public_url,
+            'version': version,
+            'objects': serialize(objs)}
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    fname = get_filename(datasource)
+    # Each writer uses its own temporary file, the last rename wins.
+    fd, tmp_name = tempfile.mkstemp(prefix='%s.' % datasource.id,
+                                    suffix='.tmp', dir=CACHE_DIR)
+    try:
+        fp = os.fdopen(fd, 'wb')
+        try:
+            cPickle.dump(data, fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp_name, fname)
+    except:
+        os.remove(tmp_name)
+        raise
+
+
+def load(datasource):
+    """Reads the cache file of *datasource*.
+
+    Returns a 2-tuple (version, records) or ``None`` if there's no usable
+    cache file. Pass *records* to :func:`deserialize` to get the objects.
+    """
+    fname = get_filename(datasource)
+    if not os.path.isfile(fname):
+        return None
+    try:
+        fp = open(fname, 'rb')
+        try:
+            data = cPickle.load(fp)
+        finally:
+            fp.close()
+    except:
+        logging.exception('Failed to read schema cache %s:', fname)
+        return None
+    if (data.get('format') != CACHE_FORMAT
+        or data.get('url') != datasource.public_url):
+        return None
+    return data['version'], data['objects']
+
+
+def remove(datasource):
+    """Removes the cache file of *datasource*."""
+    fname = get_filename(datasource)
+    if os.path.isfile(fname):
+        os.remove(fname)
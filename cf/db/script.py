@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Execution of SQL script files.
+
+:func:`iter_file_statements` reads a file in chunks and yields the
+statements it contains, so that scripts of any size can be executed
+without reading them into memory (or into an editor) first. The
+statements are found with :func:`~cf.db.splitter.iter_statements`.
+
+A :class:`ScriptRunner` executes the statements of a file one by one
+on a connection and reports its progress. Cached results of the data
+source are removed when a script that changed data is done.
+"""
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import gobject
+
+from cf.db.splitter import iter_statements
+from cf.executor import call_in_main_loop
+
+
+# Number of bytes read at once.
+CHUNK_SIZE = 1024*1024
+
+# Minimum time in seconds between two "progress" signals.
+PROGRESS_INTERVAL = 0.2
+
+# Maximum time in seconds to execute statements in the main loop before
+# control is returned to it, see ScriptRunner.run().
+SLICE_TIME = 0.05
+
+# Statements that don't change data, leading comments are skipped.
+_SELECT = re.compile(r'(?:\s+|--[^\n]*|/\*.*?\*/)*select\b',
+                     re.IGNORECASE | re.DOTALL)
+
+
+def iter_file_statements(fileobj, chunk_size=CHUNK_SIZE):
+    """Yields the statements in a file.
+
+    The file is read in chunks of *chunk_size* bytes. A statement is
+    yielded as soon as the text following it was read, only the
+    unfinished statement at the end of a chunk is kept in memory.
+
+    :param fileobj: A file-like object opened for reading.
+    :param chunk_size: Number of bytes read at once.
+    :returns: Generator of 3-tuples (statement, line, bytes_read) where
+      *line* is the (1-based) line the statement starts at and
+      *bytes_read* is the number of bytes read from the file so far.
+    """
+    text = ''
+    bytes_read = 0
+    # Line number at the beginning of text.
+    line = 1
+    want = chunk_size
+    eof = False
+    while not eof:
+        while len(text) < want:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                eof = True
+                break
+            bytes_read += len(chunk)
+            text += chunk
+        length = len(text)
+        consumed = 0
+        for start, end, split in iter_statements(text):
+            if split >= length and not eof:
+                # The statement may continue in the next chunk.
+                break
+            line += text.count('\n', consumed, start)
+            yield text[start:end], line, bytes_read
+            line += text.count('\n', start, split)
+            consumed = split
+        if consumed:
+            text = text[consumed:]
+            want = chunk_size
+        else:
+            # Read until the statement ends instead of scanning it again
+            # after each chunk.
+            want = max(chunk_size, 2 * length)
+
+
+class ScriptRunner(gobject.GObject):
+    """Executes the statements of a script file.
+
+    :Signals:
+
+    progress
+      ``def callback(runner)``
+
+      Emitted from time to time while statements are executed. Use the
+      ``bytes_read``, ``statements`` and ``errors`` attributes to display
+      the progress.
+
+    statement-failed
+      ``def callback(runner, statement, line, message)``
+
+      Emitted when the statement starting at *line* failed.
+
+    finished
+      ``def callback(runner)``
+
+      Emitted when all statements were executed, the runner was
+      cancelled or stopped after an error. ``read_error`` is set if the
+      file couldn't be read, ``error`` is set if executing the script
+      failed for another reason, e.g. because the connection was lost.
+
+    All signals are emitted in the main loop.
+
+    :param connection: The :class:`~cf.db.Connection` to use.
+    :param filename: Path of the script file.
+    :param stop_on_error: If ``True``, the remaining statements are
+      skipped when a statement fails.
+    """
+
+    __gsignals__ = {
+        'progress': (gobject.SIGNAL_RUN_LAST,
+                     gobject.TYPE_NONE,
+                     tuple()),
+        'statement-failed': (gobject.SIGNAL_RUN_LAST,
+                             gobject.TYPE_NONE,
+                             (str, int, str)),
+        'finished': (gobject.SIGNAL_RUN_LAST,
+                     gobject.TYPE_NONE,
+                     tuple()),
+    }
+
+    def __init__(self, connection, filename, stop_on_error=True):
+        self.__gobject_init__()
+        self.connection = connection
+        self.filename = filename
+        self.stop_on_error = stop_on_error
+        self.size = 0
+        self.bytes_read = 0
+        self.statements = 0
+        self.errors = 0
+        self.elapsed = 0
+        self.read_error = None
+        self.error = None
+        self.cancelled = False
+        self.running = False
+        self.finished = False
+        self._start = None
+        self._executing = False
+        # True if a statement that may change data was executed.
+        self._modified = False
+        self._lock = threading.Lock()
+
+    @property
+    def fraction(self):
+        """Fraction of the file that was read (0.0 to 1.0)."""
+        if not self.size:
+            return 0.0
+        return min(1.0, float(self.bytes_read) / self.size)
+
+    @property
+    def throughput(self):
+        """Number of statements per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.statements / self.elapsed
+
+    def run(self, executor=None):
+        """Starts executing the script.
+
+        If *executor* is given and the connection can be used from a
+        different thread, the statements are executed in a worker thread.
+        If the connection isn't thread-safe, the statements are executed
+        in the main loop in slices of up to :data:`SLICE_TIME` seconds,
+        so that progress is painted and the runner can be cancelled.
+        Without *executor* this method blocks until the script is done.
+        """
+        self._start = time.time()
+        self.running = True
+        if executor is None:
+            for dummy in self._run(False):
+                pass
+        elif self.connection.threadsafety >= 2:
+            future = executor.submit_for(self.connection, self._run_all)
+            future.add_done_callback(self._on_done)
+        else:
+            gobject.idle_add(self._run_slice, self._run(False))
+
+    def _run_all(self):
+        for dummy in self._run(True):
+            pass
+
+    def _run_slice(self, steps):
+        deadline = time.time() + SLICE_TIME
+        for dummy in steps:
+            if time.time() >= deadline:
+                return True
+        return False
+
+    def _on_done(self, future):
+        if future.exception() is not None:
+            logging.error('Failed to execute script: %s', future.exception())
+
+    def _emit(self, threaded, *args):
+        if threaded:
+            call_in_main_loop(self.emit, *args)
+        else:
+            self.emit(*args)
+
+    def _run(self, threaded):
+        """Executes the statements, yields after each statement."""
+        last_progress = 0
+        try:
+            self.size = os.path.getsize(self.filename)
+            fileobj = open(self.filename)
+        except (IOError, OSError), err:
+            self.read_error = str(err)
+            fileobj = None
+        if fileobj is not None:
+            try:
+                cursor = self.connection.get_dbapi_connection().cursor()
+                for statement, line, bytes_read in iter_file_statements(
+                    fileobj):
+                    self.bytes_read = bytes_read
+                    self.connection.last_used = time.time()
+                    self._lock.acquire()
+                    try:
+                        # Checked with the lock held, so that cancel()
+                        # either sees the running statement or this
+                        # statement isn't executed.
+                        if self.cancelled:
+                            break
+                        self._executing = True
+                    finally:
+                        self._lock.release()
+                    if not self._modified and not _SELECT.match(statement):
+                        self._modified = True
+                    try:
+                        cursor.execute(statement)
+                        failed = None
+                    except:
+                        failed = str(sys.exc_info()[1])
+                    self._lock.acquire()
+                    self._executing = False
+                    self._lock.release()
+                    self.statements += 1
+                    self.elapsed = time.time() - self._start
+                    if failed is not None:
+                        self.errors += 1
+                        self._emit(threaded, 'statement-failed', statement,
+                                   line, failed)
+                        if self.stop_on_error:
+                            break
+                    if self.elapsed - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = self.elapsed
+                        self._emit(threaded, 'progress')
+                    yield None
+                cursor.close()
+            except IOError, err:
+                self.read_error = str(err)
+            except:
+                logging.exception('Failed to execute script:')
+                self.error = str(sys.exc_info()[1])
+            fileobj.close()
+        if self._modified:
+            self._invalidate_result_cache()
+        self.running = False
+        self.finished = True
+        self.elapsed = time.time() - self._start
+        self.connection.update_transaction_state()
+        self._emit(threaded, 'progress')
+        self._emit(threaded, 'finished')
+
+    def _invalidate_result_cache(self):
+        """Removes cached results of the data source."""
+        datasource = self.connection.datasource
+        if datasource is None or datasource.manager is None:
+            return
+        try:
+            datasource.manager.result_cache.invalidate(datasource)
+        except:
+            logging.exception('Failed to invalidate result cache:')
+
+    def cancel(self):
+        """Stops executing the script.
+
+        The running statement is cancelled if the backend supports it.
+        This method can be called from any thread.
+        """
+        self.cancelled = True
+        self._lock.acquire()
+        try:
+            if not self._executing:
+                return
+            backend = self.connection.datasource.backend
+            try:
+                backend.cancel(self.connection)
+            except:
+                logging.exception('Failed to cancel statement:')
+        finally:
+            self._lock.release()
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Statement boundaries as character offsets.
+
+:func:`iter_statements` finds SQL statements in a text without building a
+parse tree. It follows the rules of :func:`sqlparse.split`: statements
+end at a semicolon outside of strings, comments and parentheses, and
+bodies of ``CREATE FUNCTION`` and similar statements are kept together
+by counting ``BEGIN`` / ``END`` blocks. Most statements don't need any
+of these rules and are matched by a single regular expression.
+
+A :class:`StatementIndex` keeps the boundaries of all statements in a
+text. When the text is edited, :meth:`StatementIndex.update` scans from
+the statement before the edit until the boundaries match the previous
+ones again, so that the cost depends on the size of the edited
+statements and not on the size of the text. The index can also be built
+lazily with :meth:`StatementIndex.extend`, only the beginning of a large
+text is scanned until statements further down are needed.
+"""
+
+import bisect
+import re
+
+
+_TOKENS = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:''|\\.|[^'\\])*(?:'|\Z))
+  | (?P<quoted>"(?:""|[^"])*(?:"|\Z)|`(?:``|[^`])*(?:`|\Z))
+  | (?P<dollar>\$(?:[A-Za-z_]\w*)?\$)
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<punct>[;()])
+  | (?P<other>[^\s;()'"`$\w/#-]+|.)
+""", re.VERBOSE | re.DOTALL | re.UNICODE)
+
+# Parts of a statement that don't affect the split level if the
+# statement doesn't start with CREATE. Each alternative matches as much
+# as possible, so that there's only one way to match a text.
+_ATOM = r"""
+    \s+(?!\s)
+  | [^\s;()'"`$/#\w-]
+  | (?!end\b)[A-Za-z_][\w$]*(?![\w$])
+  | \d+(?!\d)
+  | '(?:''|\\.|[^'\\])*'(?!')
+  | "(?:""|[^"])*"(?!")
+  | `(?:``|[^`])*`(?!`)
+  | -(?!-)
+  | /(?!\*)
+"""
+
+# A complete statement made of atoms and parentheses nested up to two
+# levels. Other statements are split token by token.
+_SIMPLE = re.compile(r"""
+    \s*(?!\s)
+    (?P<statement>
+      (?!create\b)
+      (?: %(atom)s
+        | \( (?: %(atom)s | \( (?: %(atom)s )* \) )* \)
+      )+
+      ;
+    )
+""" % {'atom': _ATOM}, re.VERBOSE | re.IGNORECASE | re.DOTALL | re.UNICODE)
+
+# A run of atoms in any statement that doesn't start with CREATE.
+_PLAIN = re.compile(r'(?:%s)+' % _ATOM,
+                    re.VERBOSE | re.IGNORECASE | re.DOTALL | re.UNICODE)
+
+# Second word of END IF, END FOR, ... (closes a block, not a BEGIN).
+_END_BLOCKS = frozenset(['IF', 'FOR', 'WHILE', 'LOOP'])
+
+
+def iter_statements(text, pos=0):
+    """Yields statements in *text*, starting at offset *pos*.
+
+    *pos* must be the beginning of the text or the end of a statement.
+    Yields 3-tuples (start, end, split) of offsets. *start* and *end*
+    enclose the statement without surrounding whitespace, *split* is the
+    offset after the terminating semicolon (or the end of the text).
+    Segments containing only whitespace and comments are skipped.
+    """
+    length = len(text)
+    match = _TOKENS.match
+    start = end = None
+    has_code = False
+    level = 0
+    is_create = in_declare = False
+    begin_depth = 0
+    simple = _SIMPLE.match
+    plain = _PLAIN.match
+    while pos < length:
+        if start is None:
+            mo = simple(text, pos)
+            if mo is not None:
+                pos = mo.end()
+                yield mo.start('statement'), pos, pos
+                continue
+        elif has_code and not is_create:
+            mo = plain(text, pos)
+            if mo is not None:
+                pos = run_end = mo.end()
+                while run_end > mo.start() and text[run_end-1].isspace():
+                    run_end -= 1
+                if run_end > mo.start():
+                    end = run_end
+                if pos >= length:
+                    break
+        mo = match(text, pos)
+        kind = mo.lastgroup
+        value = mo.group()
+        pos = mo.end()
+        if kind == 'ws':
+            continue
+        if start is None:
+            start = mo.start()
+        end = pos
+        if kind == 'comment':
+            continue
+        if kind == 'dollar':
+            closing = text.find(value, pos)
+            if closing == -1:
+                pos = end = length
+            else:
+                pos = end = closing + len(value)
+        elif kind == 'word':
+            word = value.upper()
+            if word == 'CREATE' and not has_code:
+                is_create = True
+            elif word == 'DECLARE' and is_create and begin_depth == 0:
+                in_declare = True
+                level += 1
+            elif word == 'BEGIN':
+                begin_depth += 1
+                if in_declare or is_create:
+                    level += 1
+            elif word == 'END':
+                follow = match(text, pos)
+                if follow is not None and follow.lastgroup == 'ws':
+                    follow = match(text, follow.end())
+                if (follow is not None and follow.lastgroup == 'word'
+                    and follow.group().upper() in _END_BLOCKS):
+                    pos = end = follow.end()
+                else:
+                    begin_depth = max(0, begin_depth - 1)
+                level -= 1
+            elif (word in ('IF', 'FOR', 'WHILE') and is_create
+                  and begin_depth > 0):
+                level += 1
+        elif kind == 'punct':
+            if value == '(':
+                level += 1
+            elif value == ')':
+                level -= 1
+            elif level <= 0:
+                if has_code:
+                    yield start, end, pos
+                start = end = None
+                has_code = False
+                level = 0
+                is_create = in_declare = False
+                begin_depth = 0
+                continue
+        has_code = True
+    if has_code:
+        yield start, end, length
+
+
+class StatementIndex(object):
+    """Sorted boundaries of the statements in a text.
+
+    ``starts`` and ``ends`` are sorted lists with the start and end
+    offsets of each statement as returned by :func:`iter_statements`.
+
+    The text up to offset ``scanned`` is indexed. ``complete`` is
+    ``True`` if the whole text was scanned, otherwise further statements
+    are added with :meth:`extend`.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def clear(self):
+        """Removes all statements, nothing of the text is scanned."""
+        self.starts = []
+        self.ends = []
+        self._splits = []
+        self.scanned = 0
+        self.complete = False
+
+    def reset(self, text):
+        """Finds all statements in *text*."""
+        self.clear()
+        self.extend(text)
+
+    def extend(self, text, offset=0, eof=True):
+        """Adds the statements following the scanned part of the text.
+
+        :param text: Part of the text starting at the end of the scanned
+          part (``scanned``).
+        :param offset: Offset of *text*, must be equal to ``scanned``.
+        :param eof: ``False`` if the text continues after *text*. The
+          last statement in *text* is left for the next call then, as it
+          may continue too.
+        :returns: Number of statements added.
+        """
+        assert offset == self.scanned
+        length = len(text)
+        count = 0
+        for start, end, split in iter_statements(text):
+            if split >= length and not eof:
+                return count
+            self.starts.append(start + offset)
+            self.ends.append(end + offset)
+            self._splits.append(split + offset)
+            self.scanned = split + offset
+            count += 1
+        if eof:
+            self.scanned = offset + length
+            self.complete = True
+        return count
+
+    def scan_start(self, pos):
+        """Returns the offset where :meth:`update` starts scanning.
+
+        That's the end of the last statement ending before an edit at
+        *pos*. The text before it isn't needed to update the index.
+        """
+        first = bisect.bisect_left(self._splits, pos)
+        if first > 0:
+            return self._splits[first - 1]
+        return 0
+
+    def update(self, text, pos, removed, inserted, offset=0, eof=True):
+        """Updates the boundaries after the text was edited.
+
+        If the index isn't complete, scanning stops at the end of the
+        scanned part and edits after it are ignored.
+
+        :param text: The text after the edit or a part of it starting at
+          *offset*.
+        :param pos: Offset of the edit.
+        :param removed: Number of characters removed at *pos*.
+        :param inserted: Number of characters inserted at *pos*.
+        :param offset: Offset of *text*, must not be greater than
+          :meth:`scan_start` for *pos*.
+        :param eof: ``False`` if the text continues after *text*.
+        :returns: A 3-tuple (index, old_count, new_count): *old_count*
+          statements starting at *index* were replaced by *new_count*
+          statements. Statements after them were only moved. ``None``
+          is returned and the index is unchanged if *text* ended before
+          the changed statements; call it again with more text then.
+        """
+        delta = inserted - removed
+        count = len(self._splits)
+        if not self.complete:
+            if pos >= self.scanned:
+                return count, 0, 0
+            frontier = max(self.scanned + delta, pos + inserted)
+        else:
+            frontier = None
+        # Statements ending before the edit are unchanged and scanning
+        # can start at the end of the last of them.
+        first = bisect.bisect_left(self._splits, pos)
+        scan_start = self.scan_start(pos)
+        assert offset <= scan_start
+        # Old statements ending after the edit, a new statement ending at
+        # the same (moved) offset is followed by the same statements.
+        lo = bisect.bisect_right(self._splits, pos + removed)
+        starts = []
+        ends = []
+        splits = []
+        last = count - 1
+        length = len(text)
+        scanned = offset + length
+        for start, end, split in iter_statements(text, scan_start - offset):
+            if split >= length and not eof:
+                # The statement may continue after text.
+                return None
+            start += offset
+            end += offset
+            split += offset
+            starts.append(start)
+            ends.append(end)
+            splits.append(split)
+            if split > pos + inserted:
+                idx = bisect.bisect_left(self._splits, split - delta, lo)
+                if idx < count and self._splits[idx] == split - delta:
+                    last = idx
+                    scanned = self.scanned + delta
+                    break
+            if frontier is not None and split >= frontier:
+                scanned = split
+                break
+        else:
+            if not eof:
+                return None
+            self.complete = True
+        self.scanned = scanned
+        old_count = last + 1 - first
+        tail = slice(last + 1, None)
+        self.starts[first:] = starts + [x + delta for x in self.starts[tail]]
+        self.ends[first:] = ends + [x + delta for x in self.ends[tail]]
+        self._splits[first:] = splits + [x + delta
+                                         for x in self._splits[tail]]
+        return first, old_count, len(starts)
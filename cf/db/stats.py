@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Aggregate statistics of result values.
+
+:func:`compute_stats` calculates count, distinct count, number of NULL
+values, sum, average, minimum and maximum of a sequence of values, e.g.
+the selected cells of a grid. Values are processed in chunks so that a
+computation running in a worker thread can be cancelled between chunks.
+
+Sum and average only include numeric values. Integers and decimals are
+summed exactly, floats with :func:`math.fsum`.
+"""
+
+import decimal
+import itertools
+import math
+from gettext import gettext as _
+
+
+# Number of values processed at once.
+CHUNK_SIZE = 10000
+
+_EXACT_TYPES = (int, long, decimal.Decimal)
+
+
+class Stats(object):
+    """Statistics returned by :func:`compute_stats`.
+
+    ``sum``, ``avg``, ``min`` and ``max`` are ``None`` if there were no
+    (numeric) values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.distinct = 0
+        self.nulls = 0
+        self.numeric = 0
+        self.sum = None
+        self.avg = None
+        self.min = None
+        self.max = None
+
+    def format(self):
+        """Returns a short description for the status bar."""
+        parts = [_(u'Count: %d') % self.count,
+                 _(u'Distinct: %d') % self.distinct,
+                 _(u'NULL: %d') % self.nulls]
+        if self.numeric:
+            parts.append(_(u'Sum: %s') % _format_number(self.sum))
+            parts.append(_(u'Avg: %s') % _format_number(self.avg))
+        if self.min is not None:
+            parts.append(_(u'Min: %s') % _format_value(self.min))
+            parts.append(_(u'Max: %s') % _format_value(self.max))
+        return u'   '.join(parts)
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return u'%.6g' % value
+    return unicode(value)
+
+
+def _format_value(value, max_length=30):
+    if isinstance(value, float):
+        return _format_number(value)
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    else:
+        value = unicode(value)
+    if len(value) > max_length:
+        value = value[:max_length] + u'...'
+    return value
+
+
+def compute_stats(values, cancelled=None):
+    """Returns a :class:`Stats` instance for *values*.
+
+    :param values: Iterable of values, ``None`` is a NULL value.
+    :param cancelled: Optional :class:`threading.Event`. If it's set,
+      the computation stops and ``None`` is returned.
+    """
+    stats = Stats()
+    distinct = set()
+    non_null = 0
+    exact_sum = 0
+    float_sums = []
+    values = iter(values)
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            return None
+        chunk = list(itertools.islice(values, CHUNK_SIZE))
+        if not chunk:
+            break
+        stats.count += len(chunk)
+        chunk = [value for value in chunk if value is not None]
+        if not chunk:
+            continue
+        non_null += len(chunk)
+        try:
+            distinct.update(chunk)
+        except TypeError:  # unhashable values
+            for value in chunk:
+                try:
+                    distinct.add(value)
+                except TypeError:
+                    distinct.add(repr(value))
+        exact = [value for value in chunk if type(value) in _EXACT_TYPES]
+        floats = [value for value in chunk if type(value) is float]
+        if exact:
+            exact_sum += sum(exact)
+        if floats:
+            float_sums.append(math.fsum(floats))
+        stats.numeric += len(exact) + len(floats)
+        try:
+            low, high = min(chunk), max(chunk)
+            if stats.min is None or low < stats.min:
+                stats.min = low
+            if stats.max is None or high > stats.max:
+                stats.max = high
+        except (TypeError, UnicodeDecodeError):
+            # Values of different types that can't be compared.
+            pass
+    stats.distinct = len(distinct)
+    stats.nulls = stats.count - non_null
+    if stats.numeric:
+        if float_sums:
+            stats.sum = float(exact_sum) + math.fsum(float_sums)
+        else:
+            stats.sum = exact_sum
+        if isinstance(stats.sum, float):
+            stats.avg = stats.sum / stats.numeric
+        else:
+            stats.avg = decimal.Decimal(stats.sum) / stats.numeric
+    return stats
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Results that are read from a server-side cursor on demand.
+
+A :class:`VirtualResult` is used instead of a list of rows if
+:attr:`~cf.db.Query.virtual` is set and the backend provides a
+server-side cursor (see :meth:`~cf.db.backends.Generic.get_server_cursor`).
+Rows are read in pages when they're first needed. Pages requested with
+:meth:`VirtualResult.request` are read in a worker thread and
+"rows-loaded" is emitted in the main loop when they're available.
+
+If the cursor is scrollable, only the most recently used pages are kept
+in memory and other pages are read again when needed. Otherwise all rows
+read so far are kept, in a :class:`~cf.db.resultstore.ResultStore` if a
+memory limit is given.
+
+The number of rows is unknown until the cursor is exhausted. ``len()``
+returns an estimate that's refined while pages are read and
+"length-changed" is emitted when it changes.
+"""
+
+import logging
+import threading
+
+from collections import OrderedDict
+
+import gobject
+
+from cf.db.resultstore import ResultStore
+from cf.executor import call_in_main_loop
+
+
+# Number of rows read at once.
+PAGE_SIZE = 500
+
+# Number of pages kept in memory for scrollable cursors.
+MAX_PAGES = 20
+
+
+class VirtualResult(gobject.GObject):
+    """List-like result that reads rows from a cursor on demand.
+
+    :Signals:
+
+    rows-loaded
+      ``def callback(result, start, end)``
+
+      Emitted in the main loop when rows *start* to *end* (exclusive)
+      were read.
+
+    length-changed
+      ``def callback(result)``
+
+      Emitted in the main loop when the (estimated) number of rows has
+      changed.
+
+    :param cursor: A DB-API2 cursor the statement was executed on.
+    :param scrollable: ``True`` if the cursor supports ``scroll()``.
+    :param estimate: Estimated number of rows or ``None``.
+    :param executor: An :class:`~cf.executor.Executor` to read pages in
+      the background. If ``None``, pages are read when requested.
+    :param key: Jobs are submitted with this key (see
+      :meth:`~cf.executor.Executor.submit_for`), usually the connection.
+    :param memory_limit: Rows of cursors that aren't scrollable beyond
+      this estimated size in bytes are written to a temporary file.
+    :param page_size: Number of rows read at once.
+    """
+
+    __gsignals__ = {
+        'rows-loaded': (gobject.SIGNAL_RUN_LAST,
+                        gobject.TYPE_NONE,
+                        (gobject.TYPE_INT, gobject.TYPE_INT)),
+        'length-changed': (gobject.SIGNAL_RUN_LAST,
+                           gobject.TYPE_NONE,
+                           tuple()),
+    }
+
+    def __init__(self, cursor, scrollable=False, estimate=None,
+                 executor=None, key=None, memory_limit=None,
+                 page_size=PAGE_SIZE):
+        self.__gobject_init__()
+        self.cursor = cursor
+        self.scrollable = scrollable
+        self.executor = executor
+        self.key = key
+        self.page_size = page_size
+        self.exhausted = False
+        self.closed = False
+        self._estimate = estimate or 0
+        # Number of rows known to exist.
+        self._known = 0
+        self._position = 0
+        self._pending = set()
+        self._lock = threading.RLock()
+        self._length = None
+        if scrollable:
+            self._pages = OrderedDict()
+        elif memory_limit:
+            self._rows = ResultStore(memory_limit)
+        else:
+            self._rows = []
+        self._length = len(self)
+
+    def __len__(self):
+        if self.exhausted:
+            return self._known
+        return max(self._estimate, self._known + self.page_size)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        idx = 0
+        while True:
+            try:
+                yield self[idx]
+            except IndexError:
+                break
+            idx += 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            ret = []
+            for i in xrange(*idx.indices(len(self))):
+                try:
+                    ret.append(self[i])
+                except IndexError:
+                    break
+            return ret
+        if idx < 0:
+            idx += len(self)
+        if idx < 0:
+            raise IndexError('row index out of range')
+        self._lock.acquire()
+        try:
+            if not self.is_loaded(idx):
+                loaded = self._load(idx // self.page_size)
+                if loaded is not None:
+                    call_in_main_loop(self._emit_loaded, loaded)
+            return self._get_row(idx)
+        finally:
+            self._lock.release()
+
+    def _get_row(self, idx):
+        if not self.scrollable:
+            return self._rows[idx]
+        page = self._pages.get(idx // self.page_size)
+        if page is None:
+            raise IndexError('row index out of range')
+        return page[idx % self.page_size]
+
+    @property
+    def total(self):
+        """The number of rows or ``None`` if it's not known yet."""
+        if self.exhausted:
+            return self._known
+        return None
+
+    def is_loaded(self, idx):
+        """Returns ``True`` if row *idx* can be read without a query."""
+        if self.scrollable:
+            page = self._pages.get(idx // self.page_size)
+            return page is not None and idx % self.page_size < len(page)
+        return idx < len(self._rows)
+
+    def _fetch(self, start, count):
+        if start != self._position:
+            self.cursor.scroll(start, mode='absolute')
+            self._position = start
+        rows = self.cursor.fetchmany(count)
+        self._position += len(rows)
+        return rows
+
+    def _load(self, page):
+        """Reads *page* from the cursor.
+
+        For cursors that aren't scrollable all pages before *page* are
+        read too. Returns a 2-tuple (start, end) of the rows read or
+        ``None``. This method may run in a worker thread.
+        """
+        self._lock.acquire()
+        try:
+            if self.closed:
+                return None
+            start = page * self.page_size
+            if self.scrollable:
+                if page in self._pages or (self.exhausted
+                                           and start >= self._known):
+                    return None
+                rows = self._fetch(start, self.page_size)
+                if not rows and start > self._known:
+                    # The estimate was too large. The real end is
+                    # somewhere in between.
+                    self._estimate = (self._known + start) // 2
+                    return start, start
+                self._pages[page] = rows
+                while len(self._pages) > MAX_PAGES:
+                    self._pages.popitem(last=False)
+                end = start + len(rows)
+                if len(rows) < self.page_size:
+                    self.exhausted = True
+                    self._known = end
+            else:
+                start = len(self._rows)
+                end = (page + 1) * self.page_size
+                while not self.exhausted and len(self._rows) < end:
+                    rows = self._fetch(len(self._rows), self.page_size)
+                    self._rows.extend(rows)
+                    if len(rows) < self.page_size:
+                        self.exhausted = True
+                end = len(self._rows)
+            self._known = max(self._known, end)
+            return start, end
+        finally:
+            self._lock.release()
+
+    def load(self, idx):
+        """Reads the page with row *idx* in the current thread."""
+        self._load(idx // self.page_size)
+        self._length = len(self)
+
+    def request(self, idx):
+        """Reads the page with row *idx* in the background.
+
+        Nothing happens if the page is already loaded or requested.
+        """
+        page = idx // self.page_size
+        if self.closed or self.is_loaded(idx) or page in self._pending:
+            return
+        if self.executor is None:
+            loaded = self._load(page)
+            if loaded is not None:
+                self._emit_loaded(loaded)
+            return
+        self._pending.add(page)
+        future = self.executor.submit_for(self.key, self._load, page)
+        future.add_done_callback(lambda f: self._page_loaded(f, page))
+
+    def _page_loaded(self, future, page):
+        self._pending.discard(page)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.error('Failed to read rows: %s', future.exception())
+            return
+        loaded = future.result()
+        if loaded is not None:
+            self._emit_loaded(loaded)
+
+    def _emit_loaded(self, loaded):
+        start, end = loaded
+        if end > start:
+            self.emit('rows-loaded', start, end)
+        length = len(self)
+        if length != self._length:
+            self._length = length
+            self.emit('length-changed')
+
+    def close(self):
+        """Closes the cursor and removes all rows."""
+        self._lock.acquire()
+        try:
+            if self.closed:
+                return
+            self.closed = True
+            if self.scrollable:
+                self._pages.clear()
+            elif isinstance(self._rows, ResultStore):
+                self._rows.close()
+            else:
+                self._rows = []
+        finally:
+            self._lock.release()
+        if self.executor is not None:
+            self.executor.submit_for(self.key, self._close_cursor)
+        else:
+            self._close_cursor()
+
+    def _close_cursor(self):
+        try:
+            self.cursor.close()
+        except:
+            logging.exception('Failed to close cursor:')
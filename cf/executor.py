@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+# crunchyfrog - a database schema browser and query tool
+# Copyright (C) 2009 Andi Albrecht <albrecht.andi@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Worker threads for long running tasks.
+
+The application has a single :class:`Executor` instance available as
+``app.executor``. Jobs are submitted with :meth:`Executor.submit` and
+executed by a fixed number of worker threads. Jobs submitted with
+:meth:`Executor.submit_for` are serialized by a key, e.g. a database
+connection that must not be used by two threads at the same time.
+
+Each job is represented by a :class:`Future`. Callbacks added with
+:meth:`Future.add_done_callback` are always called in the GTK main loop
+with the GDK lock held, so they're free to update the user interface.
+
+Example::
+
+    def on_done(future):
+        rows = future.result()
+        ...
+
+    future = app.executor.submit_for(conn, conn.execute, sql)
+    future.add_done_callback(on_done)
+"""
+
+import logging
+import Queue
+import sys
+import threading
+
+import gobject
+import gtk
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+CANCELLED = 'cancelled'
+FINISHED = 'finished'
+
+
+class CancelledError(Exception):
+    """Raised by :meth:`Future.result` if the job was cancelled."""
+
+
+def call_in_main_loop(func, *args):
+    """Call *func* with *args* in the main loop, holding the GDK lock.
+
+    This function can be called from any thread.
+    """
+    def _call():
+        gtk.gdk.threads_enter()
+        try:
+            try:
+                func(*args)
+            except:
+                logging.exception('Callback %r failed:', func)
+        finally:
+            gtk.gdk.threads_leave()
+        return False
+    gobject.idle_add(_call, priority=gobject.PRIORITY_HIGH)
+
+
+class Future(object):
+    """Result of a job submitted to an :class:`Executor`."""
+
+    def __init__(self):
+        self._state = PENDING
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def _set_state(self, state):
+        self._lock.acquire()
+        try:
+            self._state = state
+            if state in (CANCELLED, FINISHED):
+                callbacks = self._callbacks
+                self._callbacks = []
+                self._event.set()
+            else:
+                callbacks = []
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            call_in_main_loop(callback, self)
+
+    def run(self, func, *args, **kwds):
+        """Run *func* in the current thread and store its result."""
+        self._lock.acquire()
+        try:
+            if self._state != PENDING:
+                return
+            self._state = RUNNING
+        finally:
+            self._lock.release()
+        try:
+            self._result = func(*args, **kwds)
+        except:
+            self._exc_info = sys.exc_info()
+        self._set_state(FINISHED)
+
+    def cancel(self):
+        """Cancel the job if it's not running yet.
+
+        Returns ``True`` if the job was cancelled.
+        """
+        self._lock.acquire()
+        try:
+            if self._state != PENDING:
+                return self._state == CANCELLED
+        finally:
+            self._lock.release()
+        self._set_state(CANCELLED)
+        return True
+
+    def cancelled(self):
+        return self._state == CANCELLED
+
+    def running(self):
+        return self._state == RUNNING
+
+    def done(self):
+        return self._state in (CANCELLED, FINISHED)
+
+    def result(self, timeout=None):
+        """Return the result of the job.
+
+        Waits up to *timeout* seconds if the job isn't done yet (forever if
+        *timeout* is ``None``). Exceptions raised by the job are re-raised.
+        """
+        self._event.wait(timeout)
+        if self._state == CANCELLED:
+            raise CancelledError()
+        elif self._state != FINISHED:
+            raise RuntimeError('Job not finished')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        """Return the exception raised by the job or ``None``."""
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        """Call *callback* with this future when the job is done.
+
+        The callback is called in the main loop, even if the job is
+        already done.
+        """
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        call_in_main_loop(callback, self)
+
+
+class Executor(object):
+    """Runs jobs in a bounded number of worker threads.
+
+    :param num_workers: Maximum number of worker threads (default: 4).
+    """
+
+    def __init__(self, num_workers=4):
+        self.num_workers = max(1, num_workers)
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._waiting = {}
+        self._shutdown = False
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            future, key, func, args, kwds = job
+            future.run(func, *args, **kwds)
+            if key is not None:
+                self._release_key(key)
+
+    def _release_key(self, key):
+        self._lock.acquire()
+        try:
+            waiting = self._waiting[key]
+            if waiting:
+                self._queue.put(waiting.pop(0))
+            else:
+                del self._waiting[key]
+        finally:
+            self._lock.release()
+
+    def _submit(self, key, func, args, kwds):
+        if self._shutdown:
+            raise RuntimeError('Executor is shut down')
+        future = Future()
+        job = (future, key, func, args, kwds)
+        self._lock.acquire()
+        try:
+            if len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+                self._workers.append(worker)
+            if key is not None:
+                if key in self._waiting:
+                    self._waiting[key].append(job)
+                    return future
+                self._waiting[key] = []
+            self._queue.put(job)
+        finally:
+            self._lock.release()
+        return future
+
+    def submit(self, func, *args, **kwds):
+        """Run ``func(*args, **kwds)`` in a worker thread.
+
+        Returns a :class:`Future`.
+        """
+        return self._submit(None, func, args, kwds)
+
+    def submit_for(self, key, func, *args, **kwds):
+        """Like :meth:`submit`, but serialized by *key*.
+
+        Jobs with the same *key* run one after another in the order they
+        were submitted, but never at the same time.
+        """
+        return self._submit(key, func, args, kwds)
+
+    def shutdown(self, wait=True):
+        """Stop all worker threads after pending jobs are done.
+
+        If *wait* is ``True``, this method blocks until the workers have
+        finished.
+        """
+        self._shutdown = True
+        for worker in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
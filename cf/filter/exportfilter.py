@@ -76,9 +76,9 @@ class OOCalcExportFilter(ExportPlugin):
         for i in range(len(description)):
             doc.set_cell_value(i+1, 1, "string", description[i][0])
         doc.set_cell_property('bold', False)
-        for i in range(len(rows)):
-            for j in range(len(rows[i])):
-                value = rows[i][j]
+        for i, row in enumerate(rows):
+            for j in range(len(row)):
+                value = row[j]
                 if value == None:
                     continue
                 if type(value) == types.FloatType:
@@ -116,9 +116,9 @@ class XlsExportFilter(ExportPlugin):
         for i in range(len(description)):
             sheet.write(0, i, description[i][0], header_format)
         date_format = easyxf(num_format_str='YYYY-MM-DD')
-        for i in range(len(rows)):
-            for j in range(len(rows[i])):
-               value = rows[i][j]
+        for i, row in enumerate(rows):
+            for j in range(len(row)):
+               value = row[j]
 	       if isinstance(value, datetime.datetime):
 		   sheet.row(i+1).set_cell_date(j, value, date_format)
 	       else:
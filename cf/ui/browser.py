@@ -19,6 +19,7 @@
 """Object browser"""
 
 import logging
+import re
 from gettext import gettext as _
 
 import gtk
@@ -34,7 +35,10 @@ from cf.db import Datasource, objects
 from cf.ui.editor import SQLView
 from cf.ui import pane, dialogs
 
-import sqlparse.tokens
+
+# Statements changing the database structure. Matching the first word
+# is enough and much cheaper than parsing each executed statement.
+_DDL = re.compile(r'\s*(create|alter|drop)\b', re.IGNORECASE)
 
 
 class DummyNode(object):
@@ -305,7 +309,7 @@ class Browser(gtk.ScrolledWindow, pane.PaneItem):
     def on_query_executed(self, datasource, query):
         if query.failed:
             return
-        if query.parsed.tokens[0].ttype is sqlparse.tokens.Keyword.DDL:
+        if _DDL.match(query.statement):
             # FIXME: implement refresh tree
             #   Only already expanded items should be refreshed.
             #   This must happen after the datasource has updated it's
@@ -359,7 +363,8 @@ class Browser(gtk.ScrolledWindow, pane.PaneItem):
                 icon = self.app.load_icon(gtk.STOCK_OPEN,
                                           gtk.ICON_SIZE_MENU,
                                           gtk.ICON_LOOKUP_FORCE_SVG)
-                for child in datasource_info.meta.get_children(obj):
+                children = datasource_info.meta.get_children(obj)
+                for child in children:
                     citer = model.append(iter)
                     model.set(citer,
                               0, child,
@@ -372,8 +377,19 @@ class Browser(gtk.ScrolledWindow, pane.PaneItem):
                         cciter = model.append(citer)
                         model.set(cciter, 0, DummyNode(), 7, False)
                 treeview.expand_row(model.get_path(iter), False)
+                self._prefetch_details(datasource_info.meta, children)
                 return
 
+    def _prefetch_details(self, meta, objs):
+        """Loads columns, indexes etc. of tables and views in *objs*."""
+        collections = []
+        for obj in objs:
+            if isinstance(obj, (objects.Table, objects.View)):
+                collections.extend(child for child in meta.find(parent=obj)
+                                   if isinstance(child, objects.Collection))
+        if collections:
+            meta.prefetch(collections)
+
     def on_show_details(self, menuitem, object, model, iter):
         # FIXME(andi): Rewrite this part when main notebook allows different
         #  views.
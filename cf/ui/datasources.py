@@ -247,8 +247,10 @@ class DatasourceEditDialog(object):
         self.dlg.set_transient_for(parent)
         self.datasource = None
         self.widget_startup_commands = None
+        self.widget_statement_timeout = None
         self.populate_dbtype()
         self.setup_startup_commands()
+        self.setup_statement_timeout()
         if datasource:
             self.set_datasource(datasource)
 
@@ -288,6 +290,21 @@ class DatasourceEditDialog(object):
         editor.show()
         self.widget_startup_commands = editor
 
+    def setup_statement_timeout(self):
+        box = gtk.HBox()
+        box.set_spacing(7)
+        box.set_border_width(5)
+        lbl = gtk.Label(_(u'Statement _timeout (seconds, 0 = none):'))
+        lbl.set_use_underline(True)
+        box.pack_start(lbl, False, False)
+        adj = gtk.Adjustment(0, 0, 86400, 1, 60)
+        spin = gtk.SpinButton(adj)
+        lbl.set_mnemonic_widget(spin)
+        box.pack_start(spin, False, False)
+        box.show_all()
+        self.builder.get_object('vbox2').pack_start(box, False, False)
+        self.widget_statement_timeout = spin
+
     def set_datasource(self, datasource):
         combo = self.builder.get_object('combo_dbtype')
         model = combo.get_model()
@@ -333,6 +350,8 @@ class DatasourceEditDialog(object):
                 child.set_active(data['ask_for_password'])
         buffer_ = self.widget_startup_commands.get_buffer()
         buffer_.set_text(datasource.startup_commands or '')
+        spin = self.widget_statement_timeout
+        spin.set_value(datasource.statement_timeout or 0)
         check = self.builder.get_object('check_color')
         check.set_active(datasource.color is not None)
         if datasource.color is not None:
@@ -472,6 +491,7 @@ class DatasourceEditDialog(object):
             ds.color = None
         buffer_ = self.widget_startup_commands.get_buffer()
         ds.startup_commands = buffer_.get_text(*buffer_.get_bounds()) or None
+        ds.statement_timeout = self.widget_statement_timeout.get_value_as_int()
         return ds
 
     def clean_data(self):
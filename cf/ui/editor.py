@@ -19,11 +19,12 @@
 """SQL editor and results view"""
 
 from gettext import gettext as _
+import codecs
 import logging
 import os
 import re
 import string
-import thread
+import threading
 import time
 import urlparse
 
@@ -33,18 +34,39 @@ import gtksourceview2
 import pango
 
 from cf.db import Query
+from cf.db.pipeline import ExecutionPipeline, iter_text_statements
+from cf.db.script import ScriptRunner
+from cf.db.stats import compute_stats
+from cf.db.virtual import VirtualResult
 from cf.plugins.core import PLUGIN_TYPE_EXPORT
 from cf.ui import dialogs
 from cf.ui.confirmsave import ConfirmSaveDialog
 from cf.ui.pane import PaneItem
 from cf.ui.widgets import DataExportDialog
-from cf.ui.widgets.grid import Grid
+from cf.ui.widgets.grid import Grid, GridModel, VirtualGridModel
 from cf.ui.widgets.sqlview import SQLView
 from cf.utils import to_uri
 
 import sqlparse
 
 
+# Milliseconds to wait after typing before the result filter is applied.
+FILTER_DELAY = 300
+
+# Status bar context for statistics of selected cells.
+STATUSBAR_CONTEXT_STATS = 2
+
+# Status bar context for the progress of loading a file.
+STATUSBAR_CONTEXT_LOAD = 3
+
+# Files larger than this (in bytes) are loaded in chunks of this size,
+# the window stays responsive while they're loaded.
+LOAD_CHUNK_SIZE = 512*1024
+
+# Number of executed statements shown with their results, further
+# statements that neither failed nor returned rows are only counted.
+MAX_DETAILED_QUERIES = 20
+
 FORMATTER_DEFAULT_OPTIONS = {
     'reindent': True,
     'n_indents': 4,
@@ -96,8 +118,14 @@ class Editor(gobject.GObject, PaneItem):
         self._buffer_dirty = False
         self.__conn_close_tag = None
         self._query_timer = None
+        self._pipeline = None
+        self._queries_shown = 0
+        self._query_summary = None
+        self._last_query_msg = None
+        self._script_runner = None
         self._filename = None
         self._filecontent_read = ""
+        self._load_cb = None
         self.builder = gtk.Builder()
         self.builder.set_translation_domain('crunchyfrog')
         self.builder.add_from_file(self.app.get_glade_file('editor.glade'))
@@ -108,6 +136,8 @@ class Editor(gobject.GObject, PaneItem):
         self.on_messages_clear = self.results.on_messages_clear
         self.on_copy_data = self.results.on_copy_data
         self.on_export_data = self.results.on_export_data
+        self.on_filter_changed = self.results.grid.on_filter_changed
+        self.on_refresh_data = lambda *a: self.refresh_results()
         self.builder.connect_signals(self)
         self.set_data("win", None)
         self.win.emit('editor-created', self)
@@ -151,6 +181,7 @@ class Editor(gobject.GObject, PaneItem):
 
     def _setup_resultsgrid(self):
         self.results = ResultsView(self.win, self.builder)
+        self.results.grid.on_first_paint = self.on_results_painted
 
     def _setup_connections(self):
         self.textview.connect("populate-popup", self.on_populate_popup)
@@ -158,6 +189,8 @@ class Editor(gobject.GObject, PaneItem):
     # Callbacks
 
     def on_buffer_changed(self, buffer):
+        if self._load_cb is not None:
+            return
         self.props.buffer_dirty = self.contents_changed()
         iter1 = buffer.get_iter_at_mark(buffer.get_insert())
         iter1.set_line_offset(0)
@@ -187,32 +220,39 @@ class Editor(gobject.GObject, PaneItem):
                                                   x.get_active()))
         item.show()
         popup.append(item)
+        item = gtk.CheckMenuItem(_(u"Stop on error"))
+        item.set_active(cfg.get("editor.stop_on_error", True))
+        item.connect("toggled", lambda x: cfg.set("editor.stop_on_error",
+                                                  x.get_active()))
+        item.show()
+        popup.append(item)
         item = gtk.ImageMenuItem("gtk-close")
         item.show()
         item.connect("activate", self.on_close)
         popup.append(item)
 
-    def on_query_started(self, query):
-        start = time.time()
-        # Note: The higher the time out value, the longer the query takes.
-        #    50 is a reasonable value anyway.
-        #    The start time is for the UI only. The real execution time
-        #    is calculated in the Query class.
-        self.win.statusbar.pop(1)
-        if self._query_timer is not None:
-            gobject.source_remove(self._query_timer)
+    def on_query_rows_fetched(self, query, rows):
+        self.results.append_rows(query)
+
+    def on_queries_executed(self, pipeline, queries):
+        for query in queries:
+            if (query.failed or query.description
+                or self._queries_shown < MAX_DETAILED_QUERIES):
+                self._show_query(query)
+            else:
+                self._add_to_summary(query)
+
+    def _show_query(self, query):
+        """Show statement, result and messages of an executed query."""
+        self._queries_shown += 1
+        self._query_summary = None
         self.results.add_separator()
         self.results.add_message(query.statement, type_='query')
-        query.path_status = self.results.add_message("")
-        self._query_timer = gobject.timeout_add(50, self.update_exectime,
-                                                start, query)
-
-    def on_query_finished(self, query, tag_notice):
-        if self._query_timer:
-            gobject.source_remove(self._query_timer)
-            self._query_timer = None
-        self.results.set_query(query)
-        if query.failed:
+        if query.cancelled and query.failed:
+            msg = _(u'Query cancelled (%(sec).3f seconds)')
+            msg = msg % {"sec": query.execution_time}
+            type_ = 'error'
+        elif query.failed:
             msg = _(u'Query failed (%(sec).3f seconds)')
             msg = msg % {"sec": query.execution_time}
             type_ = 'error'
@@ -220,6 +260,18 @@ class Editor(gobject.GObject, PaneItem):
                 line, offset = query.error_position
                 line += query.get_data('editor_start_line')
                 self._mark_error(line, offset)
+        elif query.cached_at is not None:
+            msg = (_(u"Cached result from %(time)s (%(num)d rows)")
+                   % {"time": time.strftime('%X',
+                                            time.localtime(query.cached_at)),
+                      "num": query.rowcount})
+            type_ = 'info'
+        elif (isinstance(query.rows, VirtualResult)
+              and query.rows.total is None):
+            msg = (_(u"Query finished (%(sec).3f seconds, "
+                     u"rows are read while scrolling)")
+                   % {"sec": query.execution_time})
+            type_ = 'info'
         elif query.description:
             msg = (_(u"Query finished (%(sec).3f seconds, %(num)d rows)")
                    % {"sec": query.execution_time,
@@ -231,12 +283,71 @@ class Editor(gobject.GObject, PaneItem):
             msg = msg % {"sec": query.execution_time,
                          "num": query.rowcount}
             type_ = 'info'
-        self.results.add_message(msg, type_, query.path_status)
+        self.results.add_message(msg, type_)
+        self.results.set_query(query)
+        if self.app.config.get('editor.results.show_timings', True):
+            query.path_timings = self.results.add_message(
+                query.format_timings())
+        else:
+            query.path_timings = None
+        query.set_data('editor_finished', True)
+        query.log_timings()
+        self._last_query_msg = msg
+
+    def _add_to_summary(self, query):
+        """Count a query in a single message instead of showing it."""
+        summary = self._query_summary
+        if summary is None:
+            self.results.add_separator()
+            summary = {'path': self.results.add_message(''),
+                       'num': 0, 'rows': 0, 'sec': 0}
+            self._query_summary = summary
+        summary['num'] += 1
+        summary['rows'] += max(query.rowcount, 0)
+        summary['sec'] += query.execution_time or 0
+        msg = _(u'%(num)d further statements executed (%(sec).3f seconds, '
+                u'%(rows)d affected rows)') % summary
+        self.results.add_message(msg, 'info', summary['path'])
+        self._last_query_msg = msg
+
+    def on_pipeline_finished(self, pipeline, tag_notice):
+        if self._pipeline is pipeline:
+            self._pipeline = None
+            if self._query_timer is not None:
+                gobject.source_remove(self._query_timer)
+                self._query_timer = None
+            self.win.update_stop_action()
+        if pipeline.executed == 1 and self._last_query_msg:
+            msg = self._last_query_msg
+        elif pipeline.cancelled:
+            msg = (_(u'Execution cancelled after %(num)d statements '
+                     u'(%(sec).3f seconds)')
+                   % {'num': pipeline.executed, 'sec': pipeline.elapsed})
+        else:
+            msg = (_(u'%(num)d statements executed, %(failed)d failed '
+                     u'(%(sec).3f seconds)')
+                   % {'num': pipeline.executed, 'failed': pipeline.failed,
+                      'sec': pipeline.elapsed})
+        self.win.statusbar.pop(1)
         self.win.statusbar.push(1, msg)
-        if self.connection.handler_is_connected(tag_notice):
-            self.connection.disconnect(tag_notice)
+        if pipeline.connection.handler_is_connected(tag_notice):
+            pipeline.connection.disconnect(tag_notice)
         self.textview.grab_focus()
 
+    def on_results_painted(self, query):
+        """Add the paint phase to the timings shown and logged.
+
+        Results fetched in streaming mode may be painted before the
+        query has finished. Then the paint phase is already included
+        when the timings are reported first.
+        """
+        if not query.get_data('editor_finished'):
+            return
+        if query.path_timings is not None:
+            self.results.add_message(query.format_timings(),
+                                     path=query.path_timings)
+        query.log_timings(('paint',))
+
     def on_show_in_main_window(self, *args):
         gobject.idle_add(self.show_in_main_window)
 
@@ -298,6 +409,13 @@ class Editor(gobject.GObject, PaneItem):
         else:
             ret = True
         if ret:
+            self._stop_loading()
+            # Releases a server-side cursor before the connection is
+            # returned to the pool.
+            self.results.grid.reset()
+            if self.connection is not None:
+                self.connection.datasource.pool.checkin(self.connection,
+                                                        self)
             if self.get_data("win"):
                 self.get_data("win").destroy()
             else:
@@ -325,49 +443,13 @@ class Editor(gobject.GObject, PaneItem):
         self.results.add_message('BEGIN TRANSACTION', 'info')
 
     def execute_query(self, statement_at_cursor=False):
-        # TODO(andi): This method needs some refactoring:
-        #   - the actual execution code is doubled
-        #   - that affects offset counting too
+        """Execute statements.
+
+        :param statement_at_cursor: If ``True``, the statement at the
+          cursor is executed. Otherwise the selected statements or all
+          statements in the editor are executed.
+        """
         self.results.assure_visible()
-        def exec_threaded(statement, start_line):
-            if self.app.config.get("sqlparse.enabled", True):
-                stmts = sqlparse.split(statement)
-            else:
-                stmts = [statement]
-            for stmt in stmts:
-                add_offset = len(stmt.splitlines())
-                if not stmt.strip():
-                    start_line += add_offset
-                    continue
-                query = Query(stmt, self.connection)
-#                query.coding_hint = self.connection.coding_hint
-                gtk.gdk.threads_enter()
-                query.set_data('editor_start_line', start_line)
-                query.connect("started", self.on_query_started)
-                query.connect("finished",
-                              self.on_query_finished,
-                              tag_notice)
-                gtk.gdk.threads_leave()
-                query.execute(True)
-                start_line += add_offset
-                if query.failed:
-                    # hmpf, doesn't work that way... so just return here...
-                    return
-#                    gtk.gdk.threads_enter()
-#                    dlg = gtk.MessageDialog(None,
-#                                            gtk.DIALOG_MODAL|
-#                                            gtk.DIALOG_DESTROY_WITH_PARENT,
-#                                            gtk.MESSAGE_ERROR,
-#                                            gtk.BUTTONS_YES_NO,
-#                                            _(u"An error occurred. Continue?"))
-#                    if dlg.run() == gtk.RESPONSE_NO:
-#                        leave = True
-#                    else:
-#                        leave = False
-#                    dlg.destroy()
-#                    gtk.gdk.threads_leave()
-#                    if leave:
-#                        return
         buffer = self.textview.get_buffer()
         self.results.reset()
         if not statement_at_cursor:
@@ -392,31 +474,163 @@ class Editor(gobject.GObject, PaneItem):
                 dlg.destroy()
                 if not statement:
                     return
-        def foo(connection, msg):
+        statements = iter_text_statements(
+            statement, bounds[0].get_line()+1,
+            self.app.config.get("sqlparse.enabled", True))
+        self._execute(statements)
+
+    def _execute(self, statements):
+        """Execute *statements* in an :class:`ExecutionPipeline`.
+
+        :param statements: Iterable of 2-tuples (statement, line).
+        """
+        if self._script_runner is not None:
+            # The file's statements may run in the main loop, don't
+            # interleave them with other statements.
+            return
+        def on_notice(connection, msg):
             self.results.add_message(msg)
-        tag_notice = self.connection.connect("notice", foo)
-        if self.connection.threadsafety >= 2:
-            start_line = bounds[0].get_line()+1
-            thread.start_new_thread(exec_threaded, (statement, start_line))
+        tag_notice = self.connection.connect("notice", on_notice)
+        config = self.app.config
+        fetch_size = config.get("editor.results.fetch_size", 0)
+        memory_limit = config.get("editor.results.memory_limit", 0)
+        columnar = config.get("editor.results.columnar", False)
+        virtual = config.get("editor.results.virtual", False)
+        use_cache = config.get("db.result_cache.enabled", False)
+        def setup_query(query, line):
+            query.fetch_size = fetch_size
+            query.memory_limit = memory_limit * 1024 * 1024
+            query.columnar = columnar
+            query.virtual = virtual
+            query.use_cache = use_cache
+            query.set_data('editor_start_line', line)
+            query.connect("rows-fetched", self.on_query_rows_fetched)
+        pipeline = ExecutionPipeline(
+            self.connection, statements, setup_query,
+            config.get("editor.stop_on_error", True))
+        pipeline.connect("queries-executed", self.on_queries_executed)
+        pipeline.connect("finished", self.on_pipeline_finished, tag_notice)
+        self._pipeline = pipeline
+        self._queries_shown = 0
+        self._query_summary = None
+        self._last_query_msg = None
+        self.win.statusbar.pop(1)
+        if self._query_timer is not None:
+            gobject.source_remove(self._query_timer)
+        # Note: The higher the time out value, the longer the query takes.
+        #    50 is a reasonable value anyway.
+        #    The start time is for the UI only. The real execution time
+        #    is calculated in the Query class.
+        self._query_timer = gobject.timeout_add(50, self.update_exectime,
+                                                time.time(), pipeline)
+        self.win.update_stop_action()
+        pipeline.run(self.app.executor)
+
+    def refresh_results(self):
+        """Execute the statement of the displayed result again.
+
+        The cached result of the statement is discarded before.
+        """
+        query = self.results.grid.query
+        if query is None or self.connection is None:
+            return
+        datasource = self.connection.datasource
+        datasource.manager.result_cache.invalidate(datasource,
+                                                   query.statement)
+        self.results.reset()
+        self._execute([(query.statement,
+                        query.get_data('editor_start_line'))])
+
+    def run_file(self, filename, stop_on_error=True):
+        """Execute the statements in a file.
+
+        The file is read in chunks while its statements are executed, it
+        isn't loaded into the editor.
+
+        :param filename: Path of the SQL file.
+        :param stop_on_error: If ``True``, stop at the first failing
+          statement.
+        """
+        if not self.connection or self._script_runner is not None:
+            return
+        self.results.reset()
+        self.results.add_separator()
+        msg = _(u'Running file %(name)s') % {'name': filename}
+        self.results.add_message(msg, 'info')
+        runner = ScriptRunner(self.connection, filename, stop_on_error)
+        runner.set_data('path_status', self.results.add_message(''))
+        runner.connect('progress', self.on_script_progress)
+        runner.connect('statement-failed', self.on_script_statement_failed)
+        runner.connect('finished', self.on_script_finished)
+        self._script_runner = runner
+        self.win.update_stop_action()
+        runner.run(self.app.executor)
+
+    def on_script_progress(self, runner):
+        msg = (_(u'%(num)d statements, %(errors)d errors, '
+                 u'%(read).1f of %(size).1f MB (%(percent)d%%), '
+                 u'%(rate).1f statements/second')
+               % {'num': runner.statements, 'errors': runner.errors,
+                  'read': runner.bytes_read / 1048576.0,
+                  'size': runner.size / 1048576.0,
+                  'percent': int(runner.fraction * 100),
+                  'rate': runner.throughput})
+        self.results.add_message(msg, path=runner.get_data('path_status'))
+
+    def on_script_statement_failed(self, runner, statement, line, message):
+        if len(statement) > 200:
+            statement = statement[:200] + '...'
+        msg = (_(u'Line %(line)d: %(error)s')
+               % {'line': line, 'error': message.strip()})
+        self.results.add_error(msg)
+        self.results.add_message(statement, type_='query')
+
+    def on_script_finished(self, runner):
+        if self._script_runner is runner:
+            self._script_runner = None
+            self.win.update_stop_action()
+        if runner.read_error:
+            msg = _(u'Failed to read file: %(error)s') % {'error':
+                                                         runner.read_error}
+            type_ = 'error'
+        elif runner.error:
+            msg = _(u'Failed to execute file: %(error)s') % {'error':
+                                                            runner.error}
+            type_ = 'error'
+        elif runner.cancelled:
+            msg = _(u'Cancelled after %(sec).3f seconds')
+            msg = msg % {'sec': runner.elapsed}
+            type_ = 'error'
+        elif runner.errors and runner.stop_on_error:
+            msg = _(u'Stopped after an error (%(sec).3f seconds)')
+            msg = msg % {'sec': runner.elapsed}
+            type_ = 'error'
         else:
-            start_line = bounds[0].get_line()+1
-            line_offset = start_line
-            if self.app.config.get("sqlparse.enabled", True):
-                stmts = sqlparse.split(statement)
-            else:
-                stmts = [statement]
-            for stmt in stmts:
-                add_offset = len(stmt.splitlines())
-                if not stmt.strip():
-                    line_offset += add_offset
-                    continue
-                query = Query(stmt, self.connection)
-                query.set_data('editor_start_line', line_offset)
-#                query.coding_hint = self.connection.coding_hint
-                query.connect("started", self.on_query_started)
-                query.connect("finished", self.on_query_finished, tag_notice)
-                query.execute()
-                line_offset += add_offset
+            msg = _(u'File executed (%(sec).3f seconds)')
+            msg = msg % {'sec': runner.elapsed}
+            type_ = 'info'
+        self.results.add_message(msg, type_)
+
+    def cancel_query(self):
+        """Cancel the running statement and skip remaining statements."""
+        if self._pipeline is not None:
+            self._pipeline.cancel()
+        if self._script_runner is not None:
+            self._script_runner.cancel()
+
+    def get_running_query(self):
+        """Returns the currently running query or ``None``."""
+        if self._pipeline is None:
+            return None
+        return self._pipeline.current
+
+    def get_pipeline(self):
+        """Returns the pipeline executing statements or ``None``."""
+        return self._pipeline
+
+    def get_script_runner(self):
+        """Returns the script runner executing a file or ``None``."""
+        return self._script_runner
 
     def explain(self):
         self.results.assure_visible()
@@ -451,8 +665,13 @@ class Editor(gobject.GObject, PaneItem):
             if self.connection.handler_is_connected(self.__conn_close_tag):
                 self.connection.disconnect(self.__conn_close_tag)
             self.__conn_close_tag = None
+        if self.connection is not None and self.connection is not conn:
+            self.results.grid.reset()
+        if self.connection is not None:
+            self.connection.datasource.pool.checkin(self.connection, self)
         self.connection = conn
         if conn:
+            conn.datasource.pool.checkout(conn, self)
             self.__conn_close_tag = self.connection.connect("closed",
                                                             self.on_connection_closed)
         else:
@@ -477,18 +696,79 @@ class Editor(gobject.GObject, PaneItem):
         if msg is not None:
             dialogs.error(_(u"Failed to open file"), msg % {'name': filename})
             return False
+        self._stop_loading()
         self._filename = filename
-        if filename:
-            f = open(self._filename)
-            a = f.read()
-            f.close()
+        if os.path.getsize(filename) > LOAD_CHUNK_SIZE:
+            self._load_file(filename)
         else:
-            a = ""
-        self._filecontent_read = a
-        self.set_text(a)
+            if filename:
+                f = open(self._filename)
+                a = f.read()
+                f.close()
+            else:
+                a = ""
+            self._filecontent_read = a
+            self.set_text(a)
         self.app.recent_manager.add_item(to_uri(filename))
         return True
 
+    def _load_file(self, filename):
+        """Loads a large file in chunks.
+
+        The chunks are appended to the buffer from an idle handler. The
+        editor is read-only until the file is loaded, syntax highlighting
+        and marking of statements start afterwards.
+        """
+        fileobj = open(filename)
+        size = os.path.getsize(filename)
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        buffer_ = self.textview.buffer
+        self.textview.freeze_statements()
+        self.textview.set_editable(False)
+        buffer_.begin_not_undoable_action()
+        buffer_.set_highlight_syntax(False)
+        self._load_cb = gobject.idle_add(self._load_chunk, fileobj, size,
+                                         decoder, [])
+        buffer_.set_text('')
+
+    def _load_chunk(self, fileobj, size, decoder, chunks):
+        buffer_ = self.textview.buffer
+        data = fileobj.read(LOAD_CHUNK_SIZE)
+        chunks.append(data)
+        text = decoder.decode(data, not data)
+        if text:
+            buffer_.insert(buffer_.get_end_iter(), text.encode('utf-8'))
+        if data:
+            msg = (_(u'Loading %(name)s... %(percent)d%%')
+                   % {'name': os.path.basename(self._filename),
+                      'percent': int(fileobj.tell() * 100.0 / size)})
+            self.win.statusbar.pop(STATUSBAR_CONTEXT_LOAD)
+            self.win.statusbar.push(STATUSBAR_CONTEXT_LOAD, msg)
+            return True
+        fileobj.close()
+        self._load_cb = None
+        self._filecontent_read = ''.join(chunks)
+        self._end_loading()
+        buffer_.place_cursor(buffer_.get_start_iter())
+        self.props.buffer_dirty = self.contents_changed()
+        return False
+
+    def _end_loading(self):
+        buffer_ = self.textview.buffer
+        buffer_.set_highlight_syntax(True)
+        buffer_.end_not_undoable_action()
+        self.textview.set_editable(True)
+        self.textview.thaw_statements()
+        self.win.statusbar.pop(STATUSBAR_CONTEXT_LOAD)
+
+    def _stop_loading(self):
+        """Stops loading a file, if any."""
+        if self._load_cb is None:
+            return
+        gobject.source_remove(self._load_cb)
+        self._load_cb = None
+        self._end_loading()
+
     def get_filename(self):
         return self._filename
 
@@ -499,6 +779,9 @@ class Editor(gobject.GObject, PaneItem):
         return False
 
     def contents_changed(self):
+        if self._load_cb is not None:
+            # The file isn't completely loaded, but nothing was changed.
+            return False
         if self._filename:
             return self.file_contents_changed()
         elif len(self.get_text()) == 0:
@@ -512,6 +795,9 @@ class Editor(gobject.GObject, PaneItem):
         return True
 
     def save_file(self, parent=None, default_name=None):
+        if self._load_cb is not None:
+            # Don't overwrite the file with a part of it.
+            return False
         if not self._filename:
             return self.save_file_as(parent=parent, default_name=default_name)
         buffer = self.get_buffer()
@@ -583,16 +869,14 @@ class Editor(gobject.GObject, PaneItem):
             win.destroy()
         self.set_data("win", None)
 
-    def update_exectime(self, start, query):
-        lbl = _("Query running... (%.3f seconds)" % (time.time()-start))
-        self.results.add_message(lbl, path=query.path_status)
-        if query.executed:
-            if self._query_timer is not None:
-                gobject.source_remove(self._query_timer)
-            self._query_timer = None
+    def update_exectime(self, start, pipeline):
+        if pipeline.finished:
             return False
-        else:
-            return True
+        lbl = (_(u"Query running... (statement %(num)d, %(sec).3f seconds)")
+               % {"num": pipeline.executed + 1, "sec": time.time()-start})
+        self.win.statusbar.pop(1)
+        self.win.statusbar.push(1, lbl)
+        return True
 
     # Printing
 
@@ -782,6 +1066,8 @@ class ResultsView(object):
         self.app = win.app
         self.widget = builder.get_object('editor_results')
         self.builder = builder
+        # (future, cancelled event) of the running statistics job.
+        self._stats_job = None
         self._setup_widget()
         self._setup_connections()
 
@@ -877,6 +1163,44 @@ class ResultsView(object):
 
     def on_grid_selection_changed(self, grid, selected_cells):
         self.builder.get_object("editor_copy_data").set_sensitive(bool(selected_cells))
+        self.update_selection_stats(selected_cells)
+
+    def update_selection_stats(self, selected_cells):
+        """Show statistics of the selected cells in the status bar.
+
+        Statistics are computed in a worker thread. A computation that
+        is still running for a previous selection is cancelled.
+        """
+        if self._stats_job is not None:
+            future, cancelled = self._stats_job
+            cancelled.set()
+            future.cancel()
+            self._stats_job = None
+        self.instance.statusbar.pop(STATUSBAR_CONTEXT_STATS)
+        model = self.grid.grid.get_model()
+        # Reading cells of a virtual result may run queries.
+        if (not selected_cells or not isinstance(model, GridModel)
+            or isinstance(model, VirtualGridModel)):
+            return
+        cancelled = threading.Event()
+        future = self.app.executor.submit(
+            compute_stats, model.iter_values(selected_cells), cancelled)
+        future.add_done_callback(
+            lambda f: self._on_stats_computed(f, cancelled))
+        self._stats_job = future, cancelled
+
+    def _on_stats_computed(self, future, cancelled):
+        if cancelled.is_set() or future.cancelled():
+            return
+        self._stats_job = None
+        if future.exception() is not None:
+            logging.error('Failed to compute statistics: %s',
+                          future.exception())
+            return
+        stats = future.result()
+        if stats is not None:
+            self.instance.statusbar.push(STATUSBAR_CONTEXT_STATS,
+                                         stats.format())
 
     def assure_visible(self):
         """Make sure that the result pane is visible."""
@@ -890,16 +1214,13 @@ class ResultsView(object):
         Columns are terminated by \t, rows by \n.
         If *clipboard* is ``None``, the default clipboard will be used.
         """
-        rows = {}
-        for cell in self.grid.grid.get_selected_cells():
-            value = self.grid.grid.get_cell_data(cell, repr=True)
-            if rows.has_key(cell[0]):
-                rows[cell[0]] += "\t%s" % value
-            else:
-                rows[cell[0]] = "%s" % value
-        rownums = rows.keys()
-        rownums.sort()
-        txt = "\n".join(rows.get(rownum) for rownum in rownums)
+        grid = self.grid.grid
+        lines = []
+        for row, columns in grid.get_selected_cells().iter_rows():
+            lines.append("\t".join(
+                "%s" % grid.get_cell_data((row, col), repr=True)
+                for col in columns))
+        txt = "\n".join(lines)
         if clipboard is None:
             display = gtk.gdk.display_manager_get().get_default_display()
             clipboard = gtk.Clipboard(display, "CLIPBOARD")
@@ -926,6 +1247,8 @@ class ResultsView(object):
         self.copy_data(clipboard)
 
     def reset(self):
+        # Results
+        self.grid.reset()
         # Explain
         self.explain_results.reset()
         # Messages
@@ -947,6 +1270,7 @@ class ResultsView(object):
 
     def set_query(self, query):
         self.assure_visible()
+        self.update_selection_stats(None)
         self.grid.set_query(query)
         model = self.messages.get_model()
         for err in query.errors:
@@ -960,8 +1284,34 @@ class ResultsView(object):
         else:
             curr_page = 2
         self._update_btn_export_state()
+        self._update_cached_marker()
         gobject.idle_add(self.widget.set_current_page, curr_page)
 
+    def _update_cached_marker(self):
+        """Show when the displayed result was cached."""
+        query = self.grid.query
+        lbl = self.builder.get_object('editor_cached_label')
+        item = self.builder.get_object('editor_cached_item')
+        btn = self.builder.get_object('editor_refresh_data')
+        if query is not None and query.cached_at is not None:
+            cached_at = time.strftime('%X', time.localtime(query.cached_at))
+            lbl.set_text(_(u'Cached at %(time)s') % {'time': cached_at})
+            item.show_all()
+            btn.show()
+        else:
+            item.hide()
+            btn.hide()
+
+    def append_rows(self, query):
+        """Display rows fetched so far while *query* is running."""
+        first_batch = self.grid.query is not query
+        self.grid.append_rows(query)
+        if first_batch:
+            self.assure_visible()
+            self.widget.set_current_page(0)
+            self._update_btn_export_state()
+            self._update_cached_marker()
+
     def add_message(self, msg, type_=None, path=None, monospaced=False):
         """Add a message.
 
@@ -1046,14 +1396,59 @@ class ResultList(object):
         self.widget = self.builder.get_object('editor_results_data')
         self._setup_widget()
         self.instance = win
+        # Sort and filter large results in the background.
+        self.grid.executor = win.app.executor
         self.query = None
+        # Called with the query when its results are painted first.
+        self.on_first_paint = None
+        self._paint_tag = None
+        self._filter_timer = None
 
     def _setup_widget(self):
         self.grid = Grid()
         self.builder.get_object("sw_grid").add(self.grid)
+        self.filter_entry = self.builder.get_object("editor_filter_entry")
+
+    def on_filter_changed(self, entry):
+        if self._filter_timer is not None:
+            gobject.source_remove(self._filter_timer)
+        # Wait until typing pauses, filtering large results takes a
+        # moment.
+        self._filter_timer = gobject.timeout_add(FILTER_DELAY,
+                                                 self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_timer = None
+        self.grid.set_filter(self.filter_entry.get_text().decode('utf-8'))
+        return False
+
+    def _reset_filter(self):
+        self.filter_entry.set_text('')
+        if self._filter_timer is not None:
+            gobject.source_remove(self._filter_timer)
+            self._filter_timer = None
+
+    def append_rows(self, query):
+        """Add rows fetched in streaming mode to the grid.
+
+        The grid is set up on the first batch of *query*, subsequent
+        batches just announce the new rows.
+        """
+        if self.query is not query:
+            self.set_query(query)
+        else:
+            self.grid.rows_appended()
 
     def set_query(self, query):
+        if self.query is query and query.fetch_size:
+            # Results were already displayed while fetching.
+            self.grid.rows_appended()
+            return
+        self._close_virtual_result()
         self.query = query
+        self._unwatch_first_paint()
+        start = time.time()
+        self._reset_filter()
         self.grid.reset()
         if self.query.description:
             try:
@@ -1062,6 +1457,41 @@ class ResultList(object):
             except Exception, err:
                 logging.exception('Failed to display query results')
                 dialogs.error(_(u'Failed to display results'), str(err))
+                return
+            query.add_timing('grid', time.time() - start)
+            self._watch_first_paint(query)
+
+    def reset(self):
+        """Removes the displayed result.
+
+        A server-side cursor of the result is closed.
+        """
+        self._close_virtual_result()
+        self.query = None
+        self._unwatch_first_paint()
+        self._reset_filter()
+        self.grid.reset()
+
+    def _close_virtual_result(self):
+        if (self.query is not None
+            and isinstance(self.query.rows, VirtualResult)):
+            # Releases the server-side cursor.
+            self.query.rows.close()
+
+    def _watch_first_paint(self, query):
+        """Record the time until the grid is painted for *query*."""
+        start = time.time()
+        def on_expose(grid, event):
+            self._unwatch_first_paint()
+            query.add_timing('paint', time.time() - start)
+            if self.on_first_paint is not None:
+                self.on_first_paint(query)
+        self._paint_tag = self.grid.connect_after('expose-event', on_expose)
+
+    def _unwatch_first_paint(self):
+        if self._paint_tag is not None:
+            self.grid.disconnect(self._paint_tag)
+            self._paint_tag = None
 
 
 
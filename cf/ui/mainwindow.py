@@ -253,6 +253,13 @@ class MainWindow(gtk.Window):
              _(u'Exec_ute Current Statement'), '<control>F5',
              _(u'Executes statement at cursor'),
              self.on_query_execute_current),
+            ('query-run-file', None,
+             _(u'Run _File...'), None,
+             _(u'Executes the statements of a file without opening it'),
+             self.on_query_run_file),
+            ('query-stop', gtk.STOCK_STOP,
+             None, '<shift>Escape', _(u'Cancel running statement'),
+             self.on_query_stop),
             ('query-begin', gtk.STOCK_INDENT,
              _(u'Transaction'), 'F6',
              _(u'Begin transaction on current connection'),
@@ -267,6 +274,7 @@ class MainWindow(gtk.Window):
              self.on_rollback),
         )
         group.add_actions(entries)
+        group.get_action('query-stop').set_sensitive(False)
         group.set_sensitive(False)
         self.ui.insert_action_group(group, -1)
         self.add_accel_group(self.ui.get_accel_group())
@@ -609,6 +617,47 @@ class MainWindow(gtk.Window):
     def on_query_execute_current(self, action):
         self.get_active_editor().execute_query(True)
 
+    def on_query_run_file(self, action):
+        editor = self.get_active_editor()
+        if editor is None:
+            return
+        dlg = gtk.FileChooserDialog(_(u"Run file"),
+                            self,
+                            gtk.FILE_CHOOSER_ACTION_OPEN,
+                            (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                             gtk.STOCK_EXECUTE, gtk.RESPONSE_OK))
+        dlg.set_current_folder(self.app.config.get("editor.recent_folder", ""))
+        filter = gtk.FileFilter()
+        filter.set_name(_(u"All files (*)"))
+        filter.add_pattern("*")
+        dlg.add_filter(filter)
+        filter = gtk.FileFilter()
+        filter.set_name(_(u"SQL files (*.sql)"))
+        filter.add_pattern("*.sql")
+        dlg.add_filter(filter)
+        dlg.set_filter(filter)
+        stop_on_error = gtk.CheckButton(_(u"_Stop on first error"))
+        stop_on_error.set_active(
+            self.app.config.get("editor.run_file.stop_on_error", True))
+        dlg.set_extra_widget(stop_on_error)
+        stop_on_error.show()
+        filename = None
+        if dlg.run() == gtk.RESPONSE_OK:
+            filename = dlg.get_filename()
+            stop_on_error = stop_on_error.get_active()
+            self.app.config.set("editor.run_file.stop_on_error",
+                                stop_on_error)
+            self.app.config.set("editor.recent_folder",
+                                dlg.get_current_folder())
+        dlg.destroy()
+        if filename:
+            editor.run_file(filename, stop_on_error)
+
+    def on_query_stop(self, action):
+        editor = self.get_active_editor()
+        if editor is not None:
+            editor.cancel_query()
+
     def on_query_menu_activate(self, menuitem):
         self._rebuild_activate_editor_actions()
 
@@ -826,11 +875,20 @@ class MainWindow(gtk.Window):
         action = self._get_action('file-save-as')
         action.set_sensitive(sensitive)
         self.tb_conn_chooser.set_editor(editor)
+        self.update_stop_action()
         self.app.plugins.editor_notify(editor, self)
         self.emit('active-editor-changed', editor)
         if editor is not None and isinstance(editor, Editor):
             editor.textview.grab_focus()
 
+    def update_stop_action(self):
+        """Enable the stop action if the active editor runs a query."""
+        editor = self.get_active_editor()
+        running = bool(editor is not None
+                       and (editor.get_pipeline() is not None
+                            or editor.get_script_runner() is not None))
+        self._get_action('query-stop').set_sensitive(running)
+
     def set_transaction_state(self, value, connection):
         """Adjusts the transactions state in the UI."""
         # A regression: If value is None that means we have no connection,
@@ -929,6 +987,8 @@ UI = '''
       <separator />
       <menuitem name="Execute" action="query-execute" />
       <menuitem name="ExecuteCurrent" action="query-execute-current" />
+      <menuitem name="RunFile" action="query-run-file" />
+      <menuitem name="Stop" action="query-stop" />
       <menuitem name="Begin" action="query-begin" />
       <menuitem name="Commit" action="query-commit" />
       <menuitem name="Rollback" action="query-rollback" />
@@ -971,6 +1031,7 @@ UI = '''
     <placeholder name="EditorConnection" />
     <separator />
     <toolitem name="QueryExecute" action="query-execute" />
+    <toolitem name="QueryStop" action="query-stop" />
     <toolitem name="QueryBegin" action="query-begin" />
     <toolitem name="QueryCommit" action="query-commit" />
     <toolitem name="QueryRollback" action="query-rollback" />
@@ -22,7 +22,7 @@ from gettext import gettext as _
 
 import gtk
 
-from cf.ui.editor import Editor
+from cf.ui.editor import Editor, STATUSBAR_CONTEXT_STATS
 
 
 class CrunchyStatusbar(gtk.Statusbar):
@@ -153,6 +153,7 @@ class CrunchyStatusbar(gtk.Statusbar):
         """
         self._disconnect_editor_sigs()
         self.instance.statusbar.pop(1)
+        self.instance.statusbar.pop(STATUSBAR_CONTEXT_STATS)
         self._editor = editor
         self._set_connection_label(self._editor)
         self._set_overwrite_mode(self._editor)
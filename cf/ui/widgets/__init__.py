@@ -107,7 +107,7 @@ def rebuild_connection_menu(menu, win, editor=None):
         return
 
     def create_and_assign(menuitem, datasource, editor):
-        conn = datasource.dbconnect()
+        conn = datasource.pool.acquire()
         if conn is not None:
             editor.set_connection(conn)
 
@@ -21,8 +21,14 @@
 # NOTE:
 #     This module should have no cf dependencies!
 
+import array
+import itertools
+import logging
 import mimetypes
 import tempfile
+import threading
+
+from collections import OrderedDict
 
 import gtk
 import gobject
@@ -41,6 +47,147 @@ from gettext import gettext as _
 
 GRID_LABEL_MAX_LENGTH = 100
 
+# Number of rows with rendered markup cached by GridModel.
+MARKUP_CACHE_ROWS = 256
+
+# Characters in the text of numbers, see GridModel.set_filter().
+NUMBER_CHARS = frozenset('0123456789.,-+einfa ')
+
+# Kinds of model columns, see GridModel._setup_layout().
+COLUMN_LABEL = 0
+COLUMN_DATA = 1
+COLUMN_FG = 2
+COLUMN_BG = 3
+COLUMN_ROWNUM = 4
+
+
+class GridSelection(object):
+    """Selected cells of a grid.
+
+    The selection is stored as row ranges with a set of selected columns
+    each, so that selecting whole columns of a large result doesn't need
+    memory per row. Single rows are kept in a dictionary. Iterating the
+    selection yields (row, column) tuples ordered by row and column.
+
+    :param num_rows: Number of rows in the grid. Ranges added with
+      ``end=None`` extend to the last row.
+    """
+
+    def __init__(self, num_rows=0):
+        self.num_rows = num_rows
+        self._ranges = []
+        self._rows = {}
+
+    def __contains__(self, cell):
+        row, column = cell
+        columns = self._rows.get(row)
+        if columns is not None and column in columns:
+            return True
+        for start, end, columns in self._ranges:
+            if end is None:
+                end = self.num_rows
+            if start <= row < end and column in columns:
+                return True
+        return False
+
+    def __nonzero__(self):
+        return bool(self._rows) or any(self._resolve(end) > start
+                                       for start, end, columns
+                                       in self._ranges)
+
+    def __iter__(self):
+        for row, columns in self.iter_rows():
+            for column in columns:
+                yield row, column
+
+    def _resolve(self, end):
+        if end is None:
+            return self.num_rows
+        return end
+
+    def add(self, start, end, columns):
+        """Select *columns* in rows *start* to *end* (exclusive).
+
+        If *end* is ``None``, the range extends to the last row.
+        """
+        columns = set(columns)
+        if not columns:
+            return
+        if end is not None and end == start + 1:
+            self._rows.setdefault(start, set()).update(columns)
+        else:
+            self._ranges.append((start, end, columns))
+
+    def discard(self, start, end, columns):
+        """Unselect *columns* in rows *start* to *end* (exclusive)."""
+        columns = set(columns)
+        stop = self._resolve(end)
+        for row in [r for r in self._rows if start <= r < stop]:
+            self._rows[row].difference_update(columns)
+            if not self._rows[row]:
+                del self._rows[row]
+        ranges = []
+        for rstart, rend, rcolumns in self._ranges:
+            rstop = self._resolve(rend)
+            if rstop <= start or stop <= rstart or not rcolumns & columns:
+                ranges.append((rstart, rend, rcolumns))
+                continue
+            if rstart < start:
+                ranges.append((rstart, start, rcolumns))
+            remaining = rcolumns - columns
+            if remaining:
+                if rend is None and stop >= rstop:
+                    mid_end = None
+                else:
+                    mid_end = min(rstop, stop)
+                ranges.append((max(rstart, start), mid_end, remaining))
+            if end is not None and stop < rstop:
+                ranges.append((stop, rend, rcolumns))
+        self._ranges = ranges
+
+    def clear(self):
+        """Unselect all cells."""
+        self._ranges = []
+        self._rows = {}
+
+    def copy(self):
+        """Returns a copy of the selection."""
+        selection = GridSelection(self.num_rows)
+        selection._ranges = [(start, end, set(columns))
+                             for start, end, columns in self._ranges]
+        selection._rows = dict((row, set(columns))
+                               for row, columns in self._rows.iteritems())
+        return selection
+
+    def iter_rows(self):
+        """Yields 2-tuples (row, columns) ordered by row.
+
+        *columns* is a sorted list of the selected columns in that row.
+        The rows are computed while iterating.
+        """
+        ranges = [(start, self._resolve(end), columns)
+                  for start, end, columns in self._ranges]
+        ranges = [r for r in ranges if r[1] > r[0]]
+        bounds = set()
+        for start, stop, columns in ranges:
+            bounds.update((start, stop))
+        for row in self._rows:
+            bounds.update((row, row + 1))
+        bounds = sorted(bounds)
+        for idx in xrange(len(bounds) - 1):
+            start, stop = bounds[idx], bounds[idx + 1]
+            columns = set()
+            for rstart, rstop, rcolumns in ranges:
+                if rstart <= start < rstop:
+                    columns.update(rcolumns)
+            if stop == start + 1 and start in self._rows:
+                columns.update(self._rows[start])
+            if not columns:
+                continue
+            columns = sorted(columns)
+            for row in xrange(start, stop):
+                yield row, columns
+
 class Grid(gtk.TreeView):
     """Data grid
 
@@ -63,10 +210,21 @@ class Grid(gtk.TreeView):
         * a single cell
         * one or more rows
 
-    Columns can be selected by clicking on the column header. A click on the
-    header of the first column selects or de-selects all data. Rows can be
-    selected by clicking on the first column of a row. Individual cells can
-    be selected by clicking on that cell.
+    Columns can be selected by clicking on the column header while
+    holding the Control key. A click on the header of the first column
+    selects or de-selects all data. Rows can be selected by clicking on
+    the first column of a row. Individual cells can be selected by
+    clicking on that cell.
+
+    :Sorting and filtering:
+
+    A click on a column header sorts the rows by this column, ascending
+    first, then descending and then in their original order again.
+    :meth:`set_filter` shows only rows containing a text. Rows are
+    sorted and filtered in the model, the result itself isn't modified.
+    Row numbers always refer to the original order. If ``executor`` is
+    set, the new order is computed in a worker thread and the rows are
+    reordered when it's done.
     """
 
     __gsignals__ = {
@@ -82,7 +240,13 @@ class Grid(gtk.TreeView):
         self.get_selection().set_mode(gtk.SELECTION_NONE)
         self.selected_columns = list()
         self.selected_rows = list()
+        # Executor for sorting and filtering in the background
+        # (an object with a submit() method like cf.executor.Executor).
+        self.executor = None
+        # 'sort' or 'filter' -> (future, cancelled event) of running jobs.
+        self._jobs = {}
         self.connect("button-press-event", self.on_button_pressed)
+        self.connect("style-set", self.on_style_set)
 
     def _setup_columns(self, rows):
         sample_size = 50  # less samples, better performance :)
@@ -122,9 +286,15 @@ class Grid(gtk.TreeView):
         self.set_fixed_height_mode(True)
 
     def _setup_model(self, rows, description, coding_hint):
-        model = GridModel(rows, description, self.get_style(),
-                          coding_hint=coding_hint)
+        if hasattr(rows, 'request'):
+            model_class = VirtualGridModel
+        else:
+            model_class = GridModel
+        model = model_class(rows, description, self.get_style(),
+                            coding_hint=coding_hint)
         old_model = self.get_model()
+        if isinstance(old_model, VirtualGridModel):
+            old_model.disconnect_result()
         if old_model:
             del old_model
         self.set_model(model)
@@ -256,8 +426,29 @@ class Grid(gtk.TreeView):
 
 
     def on_column_header_clicked(self, column):
-        selected = not column in self.get_selected_columns()
-        self.select_column(column, selected)
+        event = gtk.get_current_event()
+        if (event is not None
+            and event.get_state() & gtk.gdk.CONTROL_MASK):
+            selected = not column in self.get_selected_columns()
+            self.select_column(column, selected)
+            return
+        model = self.get_model()
+        if not isinstance(model, GridModel) or not model.sortable:
+            return
+        col = self.get_model_index(column)-1
+        if model.sort_column != col:
+            self.sort(col)
+        elif not model.sort_descending:
+            self.sort(col, descending=True)
+        else:
+            self.sort(None)
+
+    def on_style_set(self, widget, previous_style):
+        model = self.get_model()
+        if isinstance(model, GridModel):
+            model.style = self.get_style()
+            model.clear_markup_cache()
+            self.queue_draw()
 
     def on_copy_value_to_clipboard(self, menuitem, value):
         display = gtk.gdk.display_manager_get().get_default_display()
@@ -342,8 +533,12 @@ class Grid(gtk.TreeView):
         return data
 
     def get_grid_data(self):
-        """Returns all data"""
-        return self.get_model().rows
+        """Returns all data
+
+        If the rows are sorted or filtered, the returned sequence
+        contains the displayed rows in the displayed order.
+        """
+        return self.get_model().get_displayed_rows()
 
     def get_model_index(self, treeview_column):
         """Returns the model index for a column
@@ -361,7 +556,11 @@ class Grid(gtk.TreeView):
                 return i
 
     def get_selected_cells(self):
-        """Returns selected cells"""
+        """Returns selected cells
+
+        The returned :class:`GridSelection` yields (row, column) tuples
+        ordered by row and column.
+        """
         return self.get_model().selected_cells
 
     def get_selected_columns(self):
@@ -374,7 +573,11 @@ class Grid(gtk.TreeView):
 
     def reset(self):
         """Resets the grid"""
+        self._cancel_job('sort')
+        self._cancel_job('filter')
         old_model = self.get_model()
+        if isinstance(old_model, VirtualGridModel):
+            old_model.disconnect_result()
         if old_model:
             self.unselect_cells()
             self.unselect_rows()
@@ -407,16 +610,12 @@ class Grid(gtk.TreeView):
                 ``True`` if the cell should be selected
         """
         col = self.get_model_index(column)-1
-        path = (row, col)
         model = self.get_model()
         self.unselect_cells()
         if selected:
             self.unselect_rows()
             self.unselect_columns()
-        if selected and path not in model.selected_cells:
-            model.selected_cells.append(path)
-        elif not selected and path in model.selected_cells:
-            model.selected_cells.remove(path)
+            model.selected_cells.add(row, row+1, [col])
         self.emit("selection-changed", model.selected_cells)
 
     def select_column(self, column, selected):
@@ -448,10 +647,9 @@ class Grid(gtk.TreeView):
         # rebuild selected_cells
         self.unselect_cells()
         model = self.get_model()
-        for i in range(len(model.rows)):
-            for column in self.get_selected_columns():
-                j = self.get_model_index(column)-1
-                model.selected_cells.append((i, j))
+        model.selected_cells.add(0, None,
+                                 [self.get_model_index(col)-1
+                                  for col in self.get_selected_columns()])
         self.queue_draw()
         self.emit("selection-changed", model.selected_cells)
 
@@ -470,21 +668,133 @@ class Grid(gtk.TreeView):
                 self.unselect_cells()
             self.selected_rows.append(row)
             model = self.get_model()
-            for i in range(len(self.get_columns())):
-                path = (row, i)
-                model.selected_cells.append(path)
+            model.selected_cells.add(row, row+1,
+                                     range(len(self.description)))
         elif not selected and self.row_is_selected(row):
             self.selected_rows.remove(row)
             model = self.get_model()
-            for i in range(len(self.get_columns())):
-                path = (row, i)
-                if path in model.selected_cells:
-                    model.selected_cells.remove(path)
+            model.selected_cells.discard(row, row+1,
+                                         range(len(self.description)))
         else:
             return
         self.queue_draw()
         self.emit("selection-changed", model.selected_cells)
 
+    def rows_appended(self):
+        """Updates the grid after rows were appended to the result.
+
+        Call this method when the sequence passed to :meth:`set_result`
+        has grown, e.g. while a result is fetched in batches.
+        """
+        model = self.get_model()
+        if not isinstance(model, GridModel):
+            return
+        model.rows_appended()
+        col = self.get_column(0)
+        if col is not None:
+            renderer = col.get_cell_renderers()[0]
+            renderer.set_property("width-chars", len(str(len(model.rows))))
+
+    def _reorder(self, func, *args):
+        """Calls *func* on the model with the view detached from it."""
+        model = self.get_model()
+        if not isinstance(model, GridModel) or not model.sortable:
+            return
+        selected_columns = list(self.get_selected_columns())
+        self.unselect_rows()
+        self.unselect_cells()
+        # Re-attaching the model is much cheaper than announcing each
+        # moved row.
+        self.set_model(None)
+        try:
+            func(*args)
+        finally:
+            self.set_model(model)
+        if selected_columns:
+            model.selected_cells.add(0, None,
+                                     [self.get_model_index(column)-1
+                                      for column in selected_columns])
+        for idx, column in enumerate(self.get_columns()[1:]):
+            column.set_sort_indicator(idx == model.sort_column)
+            if model.sort_descending:
+                column.set_sort_order(gtk.SORT_DESCENDING)
+            else:
+                column.set_sort_order(gtk.SORT_ASCENDING)
+        self.emit("selection-changed", model.selected_cells)
+
+    def _cancel_job(self, kind):
+        job = self._jobs.pop(kind, None)
+        if job is not None:
+            future, cancelled = job
+            cancelled.set()
+            future.cancel()
+
+    def _can_run_job(self, model):
+        return (self.executor is not None and isinstance(model, GridModel)
+                and model.sortable)
+
+    def _run_job(self, kind, func, apply, *args):
+        """Calls *func* in a worker thread, then *apply* with its result.
+
+        *func* is called with a ``threading.Event`` that is set when the
+        job is cancelled. *apply* is called through :meth:`_reorder` with
+        the result of *func* and *args* unless the model was replaced or
+        the job was cancelled in the meantime.
+        """
+        self._cancel_job(kind)
+        model = self.get_model()
+        cancelled = threading.Event()
+        future = self.executor.submit(func, cancelled)
+        future.add_done_callback(
+            lambda f: self._on_job_done(f, kind, model, apply, args))
+        self._jobs[kind] = future, cancelled
+
+    def _on_job_done(self, future, kind, model, apply, args):
+        job = self._jobs.get(kind)
+        if job is None or job[0] is not future:
+            return
+        del self._jobs[kind]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logging.error('Failed to reorder rows: %s', future.exception())
+            return
+        if self.get_model() is not model or future.result() is None:
+            return
+        self._reorder(apply, *(args + (future.result(),)))
+
+    def sort(self, column, descending=False):
+        """Sorts the rows by a column
+
+        :Parameter:
+            column
+                Column index or ``None`` to restore the original order
+            descending
+                ``True`` to sort in descending order
+        """
+        model = self.get_model()
+        self._cancel_job('sort')
+        if self._can_run_job(model):
+            func = model.prepare_sort(column)
+            if func is not None:
+                self._run_job('sort', func, model.set_sort, column,
+                              descending)
+                return
+        self._reorder(model.set_sort, column, descending)
+
+    def set_filter(self, text):
+        """Shows only rows containing *text* (case-insensitive)
+
+        An empty text or ``None`` shows all rows again.
+        """
+        model = self.get_model()
+        self._cancel_job('filter')
+        if text and self._can_run_job(model):
+            self._run_job('filter', model.prepare_filter(text),
+                          model.set_filter, text)
+            return
+        self._reorder(model.set_filter, text)
+
     def set_result(self, rows, description, coding_hint="utf-8"):
         """Sets the result and updates the grid
 
@@ -501,7 +811,8 @@ class Grid(gtk.TreeView):
     def unselect_cells(self):
         """Unselects all cells"""
         model = self.get_model()
-        model.selected_cells = []
+        if isinstance(model, GridModel):
+            model.selected_cells.clear()
 
     def unselect_columns(self):
         """Unselects all columns"""
@@ -518,11 +829,24 @@ class Grid(gtk.TreeView):
 class GridModel(gtk.GenericTreeModel):
     """Data grid model
 
-    The model stores it's data in a plain Python list. It provides
+    The model stores it's data in a plain Python list or any other
+    sequence that supports access by row index. If the sequence has a
+    ``get_value(row, column)`` method, it's used to read single values.
+    It provides
     three virtual columns for a displayed version of a value (limited
     to ``GRID_LABEL_MAX_LENGTH`` characters to increase perfomance),
     a foreground and a background color for selected cells.
 
+    Selected cells are kept in ``selected_cells``, a
+    :class:`GridSelection`. The displayed values of the most recently shown
+    ``MARKUP_CACHE_ROWS`` rows are cached.
+
+    Rows can be sorted (:meth:`set_sort`) and filtered (:meth:`set_filter`)
+    without copying them. The model maps displayed rows to row indexes
+    of ``rows`` through an array of row indexes. The sort order of each
+    column is computed once and cached until rows are appended. Iters,
+    paths and ``selected_cells`` refer to displayed rows.
+
     This class re-uses some code of the `Nicotine`_ project (`FastListModel`_)
     found via Google's Code Search.
 
@@ -530,13 +854,16 @@ class GridModel(gtk.GenericTreeModel):
     .. _FastListModel: http://www.google.com/codesearch?hl=de&q=+lang:python+GenericTreeModel+show:VRnMlwyOXFM:6NW9oRiVVfg:ANlgLtp-rX8&sa=N&cd=20&ct=rc&cs_p=http://ftp.tr.freebsd.org/pub/FreeBSD/distfiles/nicotine%2B-1.2.6.tar.bz2&cs_f=nicotine%2B-1.2.6/pynicotine/gtkgui/utils.py#first
     """
 
+    # False if set_sort() and set_filter() aren't supported.
+    sortable = True
+
     def __init__(self, rows, description, style, coding_hint="utf-8"):
         """
         The constructor takes three arguments:
 
         :Parameter:
             rows
-                Data as a plain python list of rows
+                Data as a sequence of rows
             description
                 DB-API2 like description
             style
@@ -547,7 +874,58 @@ class GridModel(gtk.GenericTreeModel):
         self.description = description
         self.style = style
         self.coding_hint = coding_hint
-        self.selected_cells = list()
+        # Number of rows the view knows about, see rows_appended().
+        self.n_rows = len(rows)
+        self.selected_cells = GridSelection(self.n_rows)
+        self._markup_cache = OrderedDict()
+        self._setup_layout()
+        # Displayed row -> index in rows, None if rows are displayed
+        # unchanged.
+        self._order = None
+        self.sort_column = None
+        self.sort_descending = False
+        self.filter_text = None
+        # Column -> array of row indexes in ascending order.
+        self._sort_cache = {}
+        # Rows matching filter_text (bytearray with 1 for each match).
+        self._filter_mask = None
+        # Number of rows included in _order and _filter_mask.
+        self._n_source = self.n_rows
+
+    def _setup_layout(self):
+        """Precomputes kind and data column of each model column."""
+        length = len(self.description)
+        self._layout = []
+        for kind in (COLUMN_LABEL, COLUMN_DATA, COLUMN_FG, COLUMN_BG):
+            self._layout.extend((kind, i) for i in xrange(length))
+        # The row number column has index n_columns, see _setup_columns().
+        self._layout.append(None)
+        self._layout.append((COLUMN_ROWNUM, None))
+        self._column_types = {COLUMN_LABEL: str,
+                              COLUMN_DATA: gobject.TYPE_PYOBJECT,
+                              COLUMN_FG: gtk.gdk.Color,
+                              COLUMN_BG: gtk.gdk.Color,
+                              COLUMN_ROWNUM: int}
+
+    def _get_markup(self, row, column):
+        cached = self._markup_cache.get(row)
+        if cached is None:
+            if len(self._markup_cache) >= MARKUP_CACHE_ROWS:
+                self._markup_cache.popitem(last=False)
+            cached = self._markup_cache[row] = {}
+        else:
+            # Mark as most recently used.
+            del self._markup_cache[row]
+            self._markup_cache[row] = cached
+        markup = cached.get(column)
+        if markup is None:
+            raw = self._get_cell(row, column)
+            markup = cached[column] = self._get_markup_for_value(raw)
+        return markup
+
+    def clear_markup_cache(self):
+        """Clears cached markup, e.g. after the style has changed."""
+        self._markup_cache.clear()
 
     def _get_markup_for_value(self, value, strip_length=True, markup=True):
         style = self.style
@@ -592,6 +970,254 @@ class GridModel(gtk.GenericTreeModel):
                 value = ""
         return value
 
+    def _get_cell(self, row, column):
+        # Column oriented results provide get_value() to avoid building
+        # a row tuple for each cell.
+        if hasattr(self.rows, 'get_value'):
+            return self.rows.get_value(row, column)
+        return self.rows[row][column]
+
+    def rows_appended(self):
+        """Announces rows appended to ``rows`` since the last call."""
+        if self._order is not None:
+            # New rows are displayed at the end, sorting again would
+            # move rows around while they are read.
+            self._sort_cache.clear()
+            start = self._n_source
+            self._n_source = len(self.rows)
+            new_rows = xrange(start, self._n_source)
+            mask = self._filter_mask
+            if mask is not None:
+                mask.extend(self._match_rows(self.filter_text, new_rows,
+                                             len(new_rows), start))
+                new_rows = [row for row in new_rows if mask[row]]
+            self._order.extend(new_rows)
+            target = len(self._order)
+        else:
+            self._n_source = target = len(self.rows)
+        while self.n_rows < target:
+            path = (self.n_rows,)
+            self.n_rows += 1
+            self.selected_cells.num_rows = self.n_rows
+            self.row_inserted(path, self.get_iter(path))
+
+    def _get_column_values(self, column):
+        if hasattr(self.rows, 'get_column'):
+            return self.rows.get_column(column)
+        return [row[column] for row in self.rows]
+
+    def _get_text(self, value):
+        """Returns the lower-cased text of *value* for filtering."""
+        if value is None or isinstance(value, buffer):
+            return u''
+        elif isinstance(value, bool):
+            return unicode(value).lower()
+        elif isinstance(value, (int, long, float)):
+            return str(value)
+        elif isinstance(value, str):
+            value = unicode(value, self.coding_hint, 'replace')
+        elif not isinstance(value, unicode):
+            value = unicode(value)
+        return value.lower()
+
+    def _match_rows(self, text, rows, size, offset=0, cancelled=None):
+        """Returns a mask of *rows* containing *text* in any column.
+
+        The returned bytearray has *size* items, item ``row-offset`` is
+        1 if *row* matches. Returns ``None`` if the ``threading.Event``
+        *cancelled* was set.
+        """
+        mask = bytearray(size)
+        remaining = list(rows)
+        # Numbers can't contain other characters, skip converting them.
+        # Booleans are ints too, but they're shown as true or false.
+        skip_types = ()
+        if not set(text).issubset(NUMBER_CHARS):
+            skip_types = (int, long, float)
+        get_text = self._get_text
+        for column in xrange(len(self.description)):
+            if not remaining:
+                break
+            if cancelled is not None and cancelled.is_set():
+                return None
+            if len(remaining) * 4 > len(self.rows):
+                values = self._get_column_values(column)
+                cells = [(row, values[row]) for row in remaining]
+                del values
+            else:
+                cells = [(row, self._get_cell(row, column))
+                         for row in remaining]
+            # Strings are often repeated, test each string once.
+            found = {}
+            remaining = []
+            for row, value in cells:
+                if isinstance(value, basestring):
+                    match = found.get(value)
+                    if match is None:
+                        match = found[value] = text in get_text(value)
+                elif (isinstance(value, skip_types)
+                      and not isinstance(value, bool)):
+                    match = False
+                else:
+                    match = text in get_text(value)
+                if match:
+                    mask[row-offset] = 1
+                else:
+                    remaining.append(row)
+        return mask
+
+    def _get_sort_index(self, column):
+        """Returns row indexes in ascending order of *column*."""
+        index = self._sort_cache.get(column)
+        if index is None:
+            index = self._sort_cache[column] = self._compute_sort_index(
+                column)
+        return index
+
+    def _compute_sort_index(self, column):
+        values = self._get_column_values(column)
+        # NULLs come first, some types (e.g. dates) can't be compared to
+        # None.
+        nulls = [row for row in xrange(len(values)) if values[row] is None]
+        if nulls:
+            rows = [row for row in xrange(len(values))
+                    if values[row] is not None]
+        else:
+            rows = xrange(len(values))
+        try:
+            rows = sorted(rows, key=values.__getitem__)
+        except (TypeError, UnicodeDecodeError):
+            # Values of different types (e.g. str and unicode values) are
+            # compared as text.
+            rows = sorted(rows, key=lambda row: self._get_text(values[row]))
+        index = array.array('l', nulls)
+        index.extend(rows)
+        return index
+
+    def _update_order(self, index=None):
+        self._n_source = len(self.rows)
+        if self.sort_column is None and self._filter_mask is None:
+            self._order = None
+            self.n_rows = self._n_source
+        else:
+            if self.sort_column is not None:
+                if index is None:
+                    index = self._get_sort_index(self.sort_column)
+                rows = index
+                if self.sort_descending:
+                    rows = reversed(rows)
+            else:
+                rows = None
+            mask = self._filter_mask
+            if mask is not None:
+                if rows is None:
+                    rows = itertools.compress(xrange(self._n_source), mask)
+                else:
+                    rows = (row for row in rows if mask[row])
+            self._order = array.array('l', rows)
+            self.n_rows = len(self._order)
+        self.selected_cells.num_rows = self.n_rows
+
+    def prepare_sort(self, column):
+        """Returns a function computing the sort order of *column*.
+
+        The function takes a ``threading.Event`` (unused) and can be
+        called in another thread as long as rows are only appended to
+        ``rows``. Pass its result to :meth:`set_sort`. Returns ``None``
+        if the order is already known.
+        """
+        if column is None or column in self._sort_cache:
+            return None
+        return lambda cancelled: self._compute_sort_index(column)
+
+    def set_sort(self, column, descending=False, index=None):
+        """Sorts displayed rows by *column*, ``None`` restores the order.
+
+        *index* is the result of the function returned by
+        :meth:`prepare_sort`, it's computed if not given.
+
+        Detach the model from the view before calling this method.
+        """
+        if index is not None:
+            if len(index) == len(self.rows):
+                self._sort_cache[column] = index
+            else:
+                # Rows were appended while sorting, they're displayed at
+                # the end like in rows_appended().
+                index = array.array('l', index)
+                index.extend(xrange(len(index), len(self.rows)))
+        self.sort_column = column
+        self.sort_descending = descending and column is not None
+        self._update_order(index)
+
+    def prepare_filter(self, text):
+        """Returns a function computing the rows matching *text*.
+
+        The current filter is copied, the function can be called in
+        another thread as long as rows are only appended to ``rows``.
+        It takes a ``threading.Event`` and returns ``None`` if the event
+        was set before it's done. Pass its result to :meth:`set_filter`.
+        """
+        text = text.lower()
+        previous = self.filter_text
+        mask = self._filter_mask
+        size = len(self.rows)
+        if previous and previous in text and len(mask) == size:
+            # The filter was narrowed, only rows that matched before can
+            # match now.
+            candidates = (row for row in xrange(size) if mask[row])
+        else:
+            candidates = xrange(size)
+        return lambda cancelled: self._match_rows(text, candidates, size,
+                                                  cancelled=cancelled)
+
+    def set_filter(self, text, mask=None):
+        """Displays only rows containing *text* (case-insensitive).
+
+        *mask* is the result of the function returned by
+        :meth:`prepare_filter`, it's computed if not given.
+
+        Detach the model from the view before calling this method.
+        """
+        if text:
+            if mask is None:
+                mask = self.prepare_filter(text)(None)
+            elif len(mask) < len(self.rows):
+                # Rows were appended while filtering.
+                new_rows = xrange(len(mask), len(self.rows))
+                mask.extend(self._match_rows(text.lower(), new_rows,
+                                             len(new_rows), len(mask)))
+            self._filter_mask = mask
+            self.filter_text = text.lower()
+        else:
+            self._filter_mask = None
+            self.filter_text = None
+        self._update_order()
+
+    def iter_values(self, selection):
+        """Returns an iterator over the values of the cells in *selection*.
+
+        The selection and the displayed order are copied first, the
+        iterator can be consumed in another thread as long as ``rows``
+        isn't modified.
+        """
+        selection = selection.copy()
+        order = self._order
+        get_cell = self._get_cell
+        def _iter():
+            for row, columns in selection.iter_rows():
+                if order is not None:
+                    row = order[row]
+                for column in columns:
+                    yield get_cell(row, column)
+        return _iter()
+
+    def get_displayed_rows(self):
+        """Returns the displayed rows in the displayed order."""
+        if self._order is None:
+            return self.rows
+        return OrderedRows(self.rows, self._order)
+
     def on_get_flags(self):
         '''returns the GtkTreeModelFlags for this particular type of model'''
         return gtk.TREE_MODEL_LIST_ONLY
@@ -602,21 +1228,11 @@ class GridModel(gtk.GenericTreeModel):
 
     def on_get_column_type(self, index):
         '''returns the type of a column in the model'''
-        length = len(self.description)
-        range_label = range(length)
-        range_data = range(length, length*2)
-        range_fg = range(length*2, length*3)
-        range_bg = range(length*3, length*4)
-        if index in range_label:
-            return str
-        elif index in range_data:
-            return gobject.TYPE_PYOBJECT
-        elif index == self.on_get_n_columns():
-            return int
-        elif (index in range_fg) or (index in range_bg):
-            return gtk.gdk.Color
-        else:
+        try:
+            kind = self._layout[index][0]
+        except (IndexError, TypeError):
             raise RuntimeError, "Unexpected index"
+        return self._column_types[kind]
 
     def on_get_path(self, iter):
         '''returns the tree path (a tuple of indices at the various
@@ -626,44 +1242,37 @@ class GridModel(gtk.GenericTreeModel):
     def on_get_iter(self, path):
         '''returns the node corresponding to the given path.  In our
         case, the node is the path'''
-        if path[0] < len(self.rows):
+        if path[0] < self.n_rows:
             return path[0]
         else:
             return None
 
     def on_get_value(self, iter, column):
         '''returns the value stored in a particular column for the node'''
-        length = len(self.description)
-        range_label = range(length)
-        range_data = range(length, length*2)
-        range_fg = range(length*2, length*3)
-        range_bg = range(length*3, length*4)
-        if column in range_label:
-            raw = self.rows[iter][column]
-            markup = self._get_markup_for_value(raw)
-            return markup
-        elif column in range_data:
-            return self.rows[iter][column-len(self.description)]
-        elif column == self.on_get_n_columns():
-            return iter+1
-        elif column in range_fg:
-            data_column = column-length*2
-            if (iter, data_column) in self.selected_cells:
-                return self.style.fg[gtk.STATE_SELECTED]
-            else:
-                return None
-        elif column in range_bg:
-            data_column = column-length*3
-            if (iter, data_column) in self.selected_cells:
-                return self.style.bg[gtk.STATE_SELECTED]
-            else:
-                return None
-        else:
+        try:
+            kind, data_column = self._layout[column]
+        except (IndexError, TypeError):
             raise RuntimeError, "Unexpected index %r" % column
+        if self._order is None:
+            row = iter
+        else:
+            row = self._order[iter]
+        if kind == COLUMN_LABEL:
+            return self._get_markup(row, data_column)
+        elif kind == COLUMN_DATA:
+            return self._get_cell(row, data_column)
+        elif kind == COLUMN_ROWNUM:
+            return row+1
+        elif (iter, data_column) not in self.selected_cells:
+            return None
+        elif kind == COLUMN_FG:
+            return self.style.fg[gtk.STATE_SELECTED]
+        else:
+            return self.style.bg[gtk.STATE_SELECTED]
 
     def on_iter_next(self, iter):
         '''returns the next node at this level of the tree'''
-        if iter + 1 < len(self.rows):
+        if iter + 1 < self.n_rows:
             return iter + 1
         else:
             return None
@@ -678,7 +1287,7 @@ class GridModel(gtk.GenericTreeModel):
 
     def on_iter_n_children(self, iter):
         '''returns the number of children of this node'''
-        return len(self.rows)
+        return self.n_rows
 
     def on_iter_nth_child(self, iter, n):
         '''returns the nth child of this node'''
@@ -689,6 +1298,80 @@ class GridModel(gtk.GenericTreeModel):
         return None
 
 
+class OrderedRows(object):
+    """Read-only sequence of *rows* in the order given by *order*."""
+
+    def __init__(self, rows, order):
+        self.rows = rows
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        for row in self.order:
+            yield self.rows[row]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.rows[row] for row in self.order[idx]]
+        return self.rows[self.order[idx]]
+
+
+class VirtualGridModel(GridModel):
+    """Grid model for results that are read on demand.
+
+    *rows* must provide ``is_loaded(row)`` and ``request(row)`` and emit
+    "rows-loaded" and "length-changed" like
+    :class:`cf.db.virtual.VirtualResult`. Cells of rows that aren't read
+    yet are empty until the result emits "rows-loaded".
+
+    Rows can't be sorted or filtered, that would read the whole result.
+    """
+
+    sortable = False
+
+    def __init__(self, rows, description, style, coding_hint="utf-8"):
+        GridModel.__init__(self, rows, description, style, coding_hint)
+        self._signals = [
+            rows.connect('rows-loaded', self.on_rows_loaded),
+            rows.connect('length-changed', self.on_length_changed),
+            ]
+
+    def _get_markup(self, row, column):
+        if not self.rows.is_loaded(row):
+            self.rows.request(row)
+            return ''
+        return GridModel._get_markup(self, row, column)
+
+    def _get_cell(self, row, column):
+        if not self.rows.is_loaded(row):
+            self.rows.request(row)
+            return None
+        return GridModel._get_cell(self, row, column)
+
+    def disconnect_result(self):
+        """Disconnects from the result's signals."""
+        while self._signals:
+            self.rows.disconnect(self._signals.pop())
+
+    def on_rows_loaded(self, rows, start, end):
+        for row in xrange(start, min(end, self.n_rows)):
+            self._markup_cache.pop(row, None)
+            path = (row,)
+            self.row_changed(path, self.get_iter(path))
+
+    def on_length_changed(self, rows):
+        # The length is an estimate until all rows are read, so the
+        # result may shrink too.
+        while self.n_rows > len(self.rows):
+            self.n_rows -= 1
+            self._markup_cache.pop(self.n_rows, None)
+            self.row_deleted((self.n_rows,))
+        self.selected_cells.num_rows = self.n_rows
+        self.rows_appended()
+
+
 class DataViewer(gtk.Dialog):
     """Dialog to display a value"""
 
@@ -58,11 +58,40 @@ try:
 except ImportError:
     HAVE_GCONF = False
 
-import sqlparse
+from cf.db.splitter import StatementIndex, iter_statements
+
+
+# Number of characters scanned for statements at once. Statements are
+# marked up to the end of the visible area, regions further down are
+# scanned when they're scrolled into view.
+INDEX_CHUNK_SIZE = 64*1024
 
 
 class SQLView(gtksourceview2.View):
-    """SQLViewBase implementation"""
+    """SQLViewBase implementation
+
+    Signals
+    =======
+
+    statements-changed
+      ``def callback(sqlview)``
+
+      Emitted when the statement marks were updated after the buffer
+      has changed.
+
+    Statement boundaries are kept in a
+    :class:`~cf.db.splitter.StatementIndex`. Edits are recorded while the
+    user types and only the statements around them are split again when
+    the marks are updated. The index is built lazily: statements are
+    marked up to the end of the visible area and further statements when
+    they're needed, e.g. when the view is scrolled.
+    """
+
+    __gsignals__ = {
+        'statements-changed': (gobject.SIGNAL_RUN_LAST,
+                               gobject.TYPE_NONE,
+                               tuple()),
+    }
 
     def __init__(self, win, editor=None):
         gtksourceview2.View.__init__(self)
@@ -86,11 +115,25 @@ class SQLView(gtksourceview2.View):
         self._buffer_changed_cb = None
         self.buffer.connect('end-user-action', self.on_buffer_changed)
         self.buffer.connect('mark-set', self.on_mark_set)
+        self.buffer.connect('insert-text', self.on_insert_text)
+        self.buffer.connect('delete-range', self.on_delete_range)
         if self.editor is not None:
             self.editor.connect('connection-changed', lambda e, c:
                                 self.on_buffer_changed(self.buffer))
         self.connect('expose-event', self.on_expose)
-        self._sql_marks = set()
+        self._statements = StatementIndex()
+        # (start mark, end mark) for each statement in _statements.
+        self._sql_marks = []
+        # False if the index has to be built from scratch.
+        self._statements_valid = False
+        # (start, end, delta) of the region edited since the last update,
+        # see _record_edit().
+        self._pending_edit = None
+        # See freeze_statements().
+        self._statements_frozen = False
+        # Offset up to which statements are indexed in the background.
+        self._index_target = 0
+        self._index_cb = None
         self.connect('destroy', self.on_destroy)
 
     def on_buffer_changed(self, buffer):
@@ -98,8 +141,32 @@ class SQLView(gtksourceview2.View):
         if self._buffer_changed_cb is not None:
             gobject.source_remove(self._buffer_changed_cb)
             self._buffer_changed_cb = None
-        self._buffer_change_cb = gobject.idle_add(self.buffer_changed_cb,
-                                                  buffer)
+        self._buffer_changed_cb = gobject.idle_add(self.buffer_changed_cb,
+                                                   buffer)
+
+    def on_insert_text(self, buffer_, iter_, text, length):
+        if self._statements_frozen:
+            return
+        self._record_edit(iter_.get_offset(), 0, len(text.decode('utf-8')))
+
+    def on_delete_range(self, buffer_, start, end):
+        if self._statements_frozen:
+            return
+        self._record_edit(start.get_offset(), end.get_offset() -
+                          start.get_offset(), 0)
+
+    def _record_edit(self, pos, removed, inserted):
+        """Merges an edit into the pending edited region."""
+        delta = inserted - removed
+        if self._pending_edit is None:
+            self._pending_edit = (pos, pos + inserted, delta)
+            return
+        start, end, total = self._pending_edit
+        if end >= pos + removed:
+            end += delta
+        else:
+            end = pos + inserted
+        self._pending_edit = (min(start, pos), end, total + delta)
 
     def on_config_changed(self, config, option, value):
         """Updates view and buffer on configuration change."""
@@ -110,6 +177,9 @@ class SQLView(gtksourceview2.View):
 
     def on_destroy(self, *args):
         self.app.config.disconnect(self._sig_app_config_changed)
+        if self._index_cb is not None:
+            gobject.source_remove(self._index_cb)
+            self._index_cb = None
 
     def on_expose(self, view, event):
         left_margin = view.get_window(gtk.TEXT_WINDOW_LEFT)
@@ -117,7 +187,6 @@ class SQLView(gtksourceview2.View):
         if left_margin != event.window:
             return False
 
-        buffer_ = view.get_buffer()
         color = self.get_style().base[gtk.STATE_SELECTED]
 
         cr = event.window.cairo_create()
@@ -130,46 +199,40 @@ class SQLView(gtksourceview2.View):
         y, _ = view.get_line_yrange(iter_)
         offset = y-visible_rect.y
         visible_rect.y += visible_rect.height
+        last_iter, _ = view.get_line_at_y(visible_rect.y)
 
         margin_width, _ = left_margin.get_size()
         cr.translate(margin_width-16, offset)
 
-        forward = True
-        within_statement = self._iter_in_statement(iter_.get_line())
-        curr = self.get_current_statement()
+        end_iter = last_iter.copy()
+        end_iter.forward_to_line_end()
+        self._index_visible(end_iter.get_offset())
+
+        statements = self.get_statement_lines(iter_.get_line(),
+                                              last_iter.get_line())
+        idx = 0
+        curr = self._get_current_statement()
         if curr:
             clstart, clend = [x.get_line() for x in curr]
         else:
             clstart = clend = None
-        current = False
 
         while not iter_.is_end():
             y, height = view.get_line_yrange(iter_)
             if y >= visible_rect.y:
                 break
             lineno = iter_.get_line()
-            start = False
-            end = False
-            for mark in buffer_.get_source_marks_at_line(lineno, None):
-                name = mark.get_category()
-                if name.startswith('sql'):
-                    if name.endswith('-start'):
-                        within_statement = True
-                        start = True
-                    elif name.endswith('-end'):
-                        end = True
-            if clstart is not None and clend is not None:
-                current = (lineno>=clstart and lineno<=clend)
-            else:
-                current = False
-            if within_statement:
+            while idx < len(statements) and statements[idx][1] < lineno:
+                idx += 1
+            if idx < len(statements) and statements[idx][0] <= lineno:
+                start_line, end_line = statements[idx]
+                current = (clstart is not None
+                           and lineno >= clstart and lineno <= clend)
                 self._render_sql_marker(cr, 16, height, color,
-                                        start, end, current)
-            if end == True:
-                within_statement = False
-                current = False
+                                        lineno == start_line,
+                                        lineno == end_line, current)
             cr.translate(0, height)
-            forward = iter_.forward_line()
+            iter_.forward_line()
 
     def _render_sql_marker(self, cr, width, height, color,
                            start, end, current):
@@ -259,35 +322,199 @@ class SQLView(gtksourceview2.View):
         self.queue_draw()
 
     def _iter_in_statement(self, lineno):
-        for start, end in self.get_statements():
-            startl = start.get_line()
-            endl = end.get_line()
-            if lineno >= startl and lineno <= endl:
-                return True
-        return False
+        idx = self._find_statement(lineno)
+        return (idx < len(self._sql_marks)
+                and self._get_statement_lines(idx)[0] <= lineno)
+
+    def _get_statement_lines(self, idx):
+        start, end = self._sql_marks[idx]
+        return (self.buffer.get_iter_at_mark(start).get_line(),
+                self.buffer.get_iter_at_mark(end).get_line())
+
+    def _find_statement(self, lineno):
+        """Returns the index of the first statement ending at or after
+        *lineno*.
+
+        The marks are ordered like the statements and move with the
+        text, so a binary search over them works even before the marks
+        are updated after an edit.
+        """
+        lo = 0
+        hi = len(self._sql_marks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            end = self.buffer.get_iter_at_mark(self._sql_marks[mid][1])
+            if end.get_line() < lineno:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get_statement_lines(self, first, last):
+        """Returns line ranges of statements on lines *first* to *last*.
+
+        Returns:
+            List of 2-tuples (start line, end line) ordered by line.
+        """
+        lines = []
+        idx = self._find_statement(first)
+        while idx < len(self._sql_marks):
+            start, end = self._get_statement_lines(idx)
+            if start > last:
+                break
+            lines.append((start, end))
+            idx += 1
+        return lines
+
+    def _create_sql_marks(self, buffer_, first, count):
+        marks = []
+        for idx in xrange(first, first + count):
+            start = buffer_.get_iter_at_offset(self._statements.starts[idx])
+            end = buffer_.get_iter_at_offset(self._statements.ends[idx])
+            marks.append((buffer_.create_source_mark(None, 'sql-start',
+                                                     start),
+                          buffer_.create_source_mark(None, 'sql-end', end)))
+        return marks
+
+    def _delete_sql_marks(self, buffer_, first, count):
+        for start, end in self._sql_marks[first:first + count]:
+            buffer_.delete_mark(start)
+            buffer_.delete_mark(end)
 
     def buffer_changed_cb(self, buffer):
-        """Update marks."""
-        # TODO(andi): Needs optimizations. Is there a way to fetch all marks?
-        while self._sql_marks:
-            mark = self._sql_marks.pop()
-            self.buffer.delete_mark(mark)
-        cursor_iter = buffer.get_iter_at_mark(buffer.get_insert())
-        cursor_line = cursor_iter.get_line()
-        if self.app.config.get("sqlparse.enabled", True):
-            for iter_start, iter_end in self.find_statements():
-                # Mark beginning of line
-                iter_start.set_line_offset(0)
-                iter_end.set_line_offset(0)
-                mark = buffer.create_source_mark(None, 'sql-start',
-                                                 iter_start)
-                self._sql_marks.add(mark)
-                mark = buffer.create_source_mark(None, 'sql-end', iter_end)
-                self._sql_marks.add(mark)
+        """Update marks.
+
+        Only marks of statements around the edited region are replaced,
+        marks of other statements move with the text.
+        """
+        if self._statements_frozen:
+            self._buffer_changed_cb = None
+            return False
+        edit = self._pending_edit
+        self._pending_edit = None
+        if not self.app.config.get("sqlparse.enabled", True):
+            self._delete_sql_marks(buffer, 0, len(self._sql_marks))
+            self._sql_marks = []
+            self._statements_valid = False
+        elif not self._statements_valid:
+            self._delete_sql_marks(buffer, 0, len(self._sql_marks))
+            self._sql_marks = []
+            self._statements.clear()
+            self._statements_valid = True
+            rect = self.get_visible_rect()
+            iter_, _ = self.get_line_at_y(rect.y + rect.height)
+            iter_.forward_to_line_end()
+            self._extend_statements(iter_.get_offset())
+        elif edit is not None:
+            pos, end, delta = edit
+            first, old_count, new_count = self._update_statements(
+                pos, end - pos - delta, end - pos)
+            self._delete_sql_marks(buffer, first, old_count)
+            self._sql_marks[first:first + old_count] = \
+                self._create_sql_marks(buffer, first, new_count)
         self._buffer_changed_cb = None
         self.queue_draw()
+        self.emit('statements-changed')
         return False
 
+    def _update_statements(self, pos, removed, inserted):
+        """Updates the statement index after an edit.
+
+        Only the text from the last statement before the edit is read
+        from the buffer, in chunks of :data:`INDEX_CHUNK_SIZE`
+        characters until the changed statements are scanned.
+        """
+        index = self._statements
+        buffer_ = self.buffer
+        offset = index.scan_start(pos)
+        size = max(INDEX_CHUNK_SIZE, pos + inserted - offset)
+        while True:
+            start = buffer_.get_iter_at_offset(offset)
+            end = buffer_.get_iter_at_offset(offset + size)
+            text = buffer_.get_text(start, end).decode('utf-8')
+            result = index.update(text, pos, removed, inserted, offset,
+                                  end.is_end())
+            if result is not None:
+                return result
+            size *= 2
+
+    def _extend_statements(self, offset):
+        """Marks the statements starting before *offset*.
+
+        Only the text following the indexed statements is read from the
+        buffer, in chunks of :data:`INDEX_CHUNK_SIZE` characters.
+        """
+        index = self._statements
+        if (self._statements_frozen or not self._statements_valid
+            or self._pending_edit is not None):
+            # The index doesn't match the buffer until the marks are
+            # updated.
+            return
+        buffer_ = self.buffer
+        size = INDEX_CHUNK_SIZE
+        while not index.complete and index.scanned < offset:
+            start = buffer_.get_iter_at_offset(index.scanned)
+            end = buffer_.get_iter_at_offset(index.scanned + size)
+            text = buffer_.get_text(start, end).decode('utf-8')
+            first = len(index)
+            count = index.extend(text, start.get_offset(), end.is_end())
+            if count:
+                self._sql_marks.extend(self._create_sql_marks(buffer_, first,
+                                                              count))
+                size = INDEX_CHUNK_SIZE
+            else:
+                # A long statement, read on until it ends.
+                size *= 2
+
+    def _index_visible(self, offset):
+        """Marks the statements up to *offset* for drawing.
+
+        Nearby statements are marked right away. If the view was
+        scrolled further down, the statements are marked in the
+        background and the view is redrawn afterwards.
+        """
+        index = self._statements
+        if (not self._statements_valid or index.complete
+            or index.scanned >= offset):
+            return
+        if offset - index.scanned <= INDEX_CHUNK_SIZE:
+            self._extend_statements(offset)
+            return
+        self._index_target = max(self._index_target, offset)
+        if self._index_cb is None:
+            self._index_cb = gobject.idle_add(self._index_idle_cb,
+                                              priority=gobject.PRIORITY_LOW)
+
+    def _index_idle_cb(self):
+        index = self._statements
+        if (self._statements_valid and not self._statements_frozen
+            and self._pending_edit is None):
+            self._extend_statements(index.scanned + INDEX_CHUNK_SIZE)
+            if not index.complete and index.scanned < self._index_target:
+                return True
+        self._index_cb = None
+        self._index_target = 0
+        self.queue_draw()
+        return False
+
+    def freeze_statements(self):
+        """Stops marking statements, e.g. while a file is loaded.
+
+        All marks are removed. Statements are marked again after
+        :meth:`thaw_statements` was called.
+        """
+        self._statements_frozen = True
+        self._delete_sql_marks(self.buffer, 0, len(self._sql_marks))
+        self._sql_marks = []
+        self._statements.clear()
+        self._statements_valid = False
+        self._pending_edit = None
+
+    def thaw_statements(self):
+        """Marks statements again after :meth:`freeze_statements`."""
+        self._statements_frozen = False
+        self.on_buffer_changed(self.buffer)
+
     def update_textview_options(self):
         c = self.app.config
         buf = self.get_buffer()
@@ -328,52 +555,49 @@ class SQLView(gtksourceview2.View):
         """
         buffer_ = self.get_buffer()
         buffer_start, buffer_end = buffer_.get_bounds()
-        content = buffer_.get_text(buffer_start, buffer_end)
-        iter_ = buffer_.get_start_iter()
-        for stmt in sqlparse.split(content):
-            if not stmt.strip():
-                continue
-            # FIXME: Does not work if linebreaks in buffers are not '\n'.
-            #    sqlparse unifies them!
-            bounds = iter_.forward_search(stmt.strip(),
-                                          gtk.TEXT_SEARCH_TEXT_ONLY)
-            if bounds is None:
-                continue
-            start, end = bounds
-            yield start, end
-            iter_ = end
-            if not iter_:
-                raise StopIteration
-        raise StopIteration
+        content = buffer_.get_text(buffer_start, buffer_end).decode('utf-8')
+        for start, end, split in iter_statements(content):
+            yield (buffer_.get_iter_at_offset(start),
+                   buffer_.get_iter_at_offset(end))
 
     def get_statements(self):
-        """Returns iter 2-tuples for marked statements."""
+        """Returns iter 2-tuples for marked statements.
+
+        Statements that aren't marked yet are marked while iterating.
+        """
         buffer_ = self.buffer
-        iter_ = buffer_.get_iter_at_line(0)
-        start = None
-        end = None
-        while not iter_.is_end():
-            lineno = iter_.get_line()
-            for mark in buffer_.get_source_marks_at_line(lineno, None):
-                name = mark.get_category()
-                if name.endswith('-start'):
-                    start = buffer_.get_iter_at_mark(mark)
-                elif name.endswith('-end'):
-                    end = buffer_.get_iter_at_mark(mark)
-            if start is not None and end is not None:
-                end.forward_to_line_end()
-                yield start, end
-                start = end = None
-            iter_.forward_line()
-        raise StopIteration
+        idx = 0
+        while True:
+            if idx >= len(self._sql_marks):
+                self._extend_statements(self._statements.scanned + 1)
+                if idx >= len(self._sql_marks):
+                    break
+            start_mark, end_mark = self._sql_marks[idx]
+            idx += 1
+            start = buffer_.get_iter_at_mark(start_mark)
+            end = buffer_.get_iter_at_mark(end_mark)
+            end.forward_to_line_end()
+            yield start, end
 
     def get_current_statement(self):
         """Returns iters for statement where insert mark is or None."""
         iter_ = self.buffer.get_iter_at_mark(self.buffer.get_insert())
+        iter_.forward_to_line_end()
+        self._extend_statements(iter_.get_offset())
+        return self._get_current_statement()
+
+    def _get_current_statement(self):
+        """Like get_current_statement(), but only looks at marked
+        statements."""
+        iter_ = self.buffer.get_iter_at_mark(self.buffer.get_insert())
         lineno = iter_.get_line()
-        for start, end in self.get_statements():
-            startl = start.get_line()
-            endl = end.get_line()
-            if lineno >= startl and lineno <= endl:
-                return start, end
-        return None
+        idx = self._find_statement(lineno)
+        if idx >= len(self._sql_marks):
+            return None
+        start_mark, end_mark = self._sql_marks[idx]
+        start = self.buffer.get_iter_at_mark(start_mark)
+        if start.get_line() > lineno:
+            return None
+        end = self.buffer.get_iter_at_mark(end_mark)
+        end.forward_to_line_end()
+        return start, end
@@ -0,0 +1,59 @@
+import unittest
+
+from cf import autocompletion
+
+
+class FakeConfig(dict):
+    pass
+
+
+class FakeApp(object):
+
+    def __init__(self):
+        self.config = FakeConfig()
+
+    def get_data(self, key):
+        return None
+
+
+class FakeEditor(object):
+
+    def __init__(self):
+        self.app = FakeApp()
+        self.connection = None
+
+
+class TestAutocompletion(unittest.TestCase):
+
+    def test_parse_identifiers(self):
+        identifiers = autocompletion.parse_identifiers(
+            'select f.a from foo f, bar')
+        self.assertEqual(identifiers.get('f'), 'foo')
+        self.assertEqual(identifiers.get('bar'), 'bar')
+
+    def test_find_matches(self):
+        completions = [('Customers', 'Table'), ('orders', 'Table')]
+        matches = autocompletion.find_matches(completions, 'TOM')
+        self.assertEqual(matches.values(),
+                         [[([3, 4, 5], ('Customers', 'Table'))]])
+        best = min(autocompletion.find_matches(completions, 'rs').items())
+        self.assertEqual(best[1][0][1][0], 'orders')
+
+    def test_prepare_matches(self):
+        editor = FakeEditor()
+        func = autocompletion.prepare_matches(editor, 'selct', None)
+        best = min(func().items())
+        self.assertEqual(best[1][0][1], ('SELECT', 'Keyword'))
+
+    def test_is_counted(self):
+        self.assert_(autocompletion.is_counted('select a from foo'))
+        self.assert_(autocompletion.is_counted('-- foo\n/* x */ SELECT 1'))
+        self.failIf(autocompletion.is_counted('insert into foo values (1)'))
+        self.failIf(autocompletion.is_counted(
+            'select 1' + ' ' * autocompletion.USAGE_MAX_STATEMENT))
+
+    def test_extract_identifiers(self):
+        names = autocompletion.extract_identifiers(
+            'select f.a, "B" from foo f')
+        self.assert_(names.issuperset(['f', 'a', 'b', 'foo']))
+        self.failIf('select' in names)
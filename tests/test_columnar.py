@@ -0,0 +1,42 @@
+import datetime
+import unittest
+
+from cf.db.columnar import ColumnarResult
+
+
+DESCRIPTION = (('a', None, None, None, None, None, None),
+               ('b', None, None, None, None, None, None),
+               ('c', None, None, None, None, None, None))
+
+
+class TestColumnarResult(unittest.TestCase):
+
+    def test_roundtrip(self):
+        rows = [(1, u'foo', datetime.date(2009, 1, 1)),
+                (None, u'foo', None),
+                (3, None, datetime.date(2009, 12, 31))]
+        res = ColumnarResult(DESCRIPTION, rows)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(list(res), rows)
+        self.assertEqual(res[-1], rows[-1])
+        self.assertEqual(res.get_value(1, 0), None)
+        self.assertEqual(res.get_column(1), [u'foo', u'foo', None])
+        self.assertEqual(res.get_column_type(0), 'array')
+        self.assertEqual(res.get_column_type(1), 'dict')
+        self.assertEqual(res.get_column_type(2), 'array')
+
+    def test_timestamp(self):
+        value = datetime.datetime(2009, 6, 1, 12, 30, 15, 123456)
+        res = ColumnarResult(DESCRIPTION[:1], [(value,)])
+        self.assertEqual(res.get_value(0, 0), value)
+
+    def test_mixed_types(self):
+        rows = [(None,), (1,), ('x',), (2 ** 70,)]
+        res = ColumnarResult(DESCRIPTION[:1], rows)
+        self.assertEqual(res.get_column_type(0), 'object')
+        self.assertEqual(res.get_column(0), [None, 1, 'x', 2 ** 70])
+
+    def test_null_column(self):
+        res = ColumnarResult(DESCRIPTION[:1], [(None,), (None,)])
+        self.assertEqual(res.get_column_type(0), None)
+        self.assertEqual(res[1], (None,))
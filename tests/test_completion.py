@@ -0,0 +1,81 @@
+import threading
+import unittest
+
+from cf.db.completion import CompletionIndex, fuzzy_score, rank
+
+
+class TestCompletionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = CompletionIndex()
+        for name in ('customer', 'customer_orders', 'orders', 'order_items'):
+            self.index.add(name, 'Table', key=name)
+
+    def test_find(self):
+        self.assertEqual(sorted(c for c, d in self.index.find('ORDER')),
+                         ['customer_orders', 'order_items', 'orders'])
+        self.assertEqual(self.index.find('xyz'), [])
+        self.assertEqual(len(self.index.find('')), 4)
+        self.assertEqual(len(self.index.find('o')), 4)
+
+    def test_find_prefix(self):
+        self.assertEqual([c for c, d in self.index.find_prefix('cust')],
+                         ['customer', 'customer_orders'])
+
+    def test_replace_and_remove(self):
+        self.index.add('clients', 'Table', key='customer')
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual([c for c, d in self.index.find_prefix('cust')],
+                         ['customer_orders'])
+        self.index.remove('orders')
+        self.assertEqual(sorted(c for c, d in self.index.find('orders')),
+                         ['customer_orders'])
+
+    def test_find_fuzzy(self):
+        found = [c for c, d in self.index.find_fuzzy('cuor')]
+        self.assert_('customer_orders' in found)
+
+    def test_threads(self):
+        errors = []
+        def find():
+            try:
+                for i in xrange(200):
+                    self.index.find_fuzzy('cu')
+                    self.index.find_prefix('c')
+            except Exception, err:
+                errors.append(err)
+        thread = threading.Thread(target=find)
+        thread.start()
+        for i in xrange(2000):
+            self.index.add('customer_%d' % (i % 50), 'Table', key=i % 50)
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.index), 54)
+
+
+class TestFuzzy(unittest.TestCase):
+
+    completions = [(name, 'Table') for name in
+                   ('customer', 'customer_orders', 'orders', 'vendors')]
+
+    def test_fuzzy_score(self):
+        score, positions = fuzzy_score('customer_orders', 'cuor')
+        self.assertEqual(positions, [0, 1, 9, 10])
+        self.assertEqual(fuzzy_score('orders', 'xy'), (None, None))
+
+    def test_boundary(self):
+        # "ord" at a word start beats "ord" inside "vendors".
+        ranked = [c[0] for s, p, c in rank(self.completions, 'ors')]
+        self.assertEqual(ranked[0], 'orders')
+        self.assert_(fuzzy_score('customer_orders', 'ord')[0] >
+                     fuzzy_score('vendors', 'ord')[0])
+
+    def test_usage(self):
+        ranked = [c[0] for s, p, c in rank(self.completions, 'cust')]
+        self.assertEqual(ranked[:2], ['customer', 'customer_orders'])
+        ranked = [c[0] for s, p, c in rank(self.completions, 'cust',
+                                           usage={'customer_orders': 10})]
+        self.assertEqual(ranked[:2], ['customer_orders', 'customer'])
+
+    def test_limit(self):
+        self.assertEqual(len(rank(self.completions, 'r', limit=2)), 2)
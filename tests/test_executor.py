@@ -0,0 +1,53 @@
+import threading
+import time
+import unittest
+
+from cf.executor import Executor, Future, CancelledError
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = Executor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_result(self):
+        future = self.executor.submit(lambda x, y: x + y, 1, 2)
+        self.assertEqual(future.result(5), 3)
+        self.assert_(future.done())
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('foo')
+        future = self.executor.submit(fail)
+        self.assertRaises(ValueError, future.result, 5)
+        self.assert_(isinstance(future.exception(), ValueError))
+
+    def test_serialized(self):
+        lock = threading.Lock()
+        active = []
+        overlaps = []
+        def job(num):
+            lock.acquire()
+            if active:
+                overlaps.append(num)
+            active.append(num)
+            lock.release()
+            time.sleep(0.01)
+            lock.acquire()
+            active.remove(num)
+            lock.release()
+            return num
+        key = object()
+        futures = [self.executor.submit_for(key, job, i) for i in range(8)]
+        self.assertEqual([f.result(5) for f in futures], range(8))
+        self.assertEqual(overlaps, [])
+
+    def test_cancel(self):
+        future = Future()
+        self.assert_(future.cancel())
+        future.run(lambda: 1)
+        self.assert_(future.cancelled())
+        self.assertRaises(CancelledError, future.result, 0)
@@ -0,0 +1,134 @@
+import threading
+import unittest
+from datetime import date
+
+from cf.ui.widgets.grid import GridModel, GridSelection
+
+
+class TestGridSelection(unittest.TestCase):
+
+    def test_column_selection(self):
+        sel = GridSelection(5000000)
+        sel.add(0, None, [1, 3])
+        self.assert_((4999999, 1) in sel)
+        self.assert_((4999999, 2) not in sel)
+        self.assert_((5000000, 1) not in sel)
+        sel.num_rows += 1
+        self.assert_((5000000, 3) in sel)
+
+    def test_discard(self):
+        sel = GridSelection(10)
+        sel.add(0, None, [1, 3])
+        sel.discard(4, 5, [1])
+        self.assert_((4, 1) not in sel)
+        self.assert_((4, 3) in sel)
+        self.assert_((5, 1) in sel)
+        sel.discard(0, None, [1, 3])
+        self.failIf(sel)
+
+    def test_iter_rows(self):
+        sel = GridSelection(4)
+        sel.add(1, None, [2])
+        sel.add(2, 3, [0])
+        self.assertEqual(list(sel.iter_rows()),
+                         [(1, [2]), (2, [0, 2]), (3, [2])])
+        self.assertEqual(list(sel)[:3], [(1, 2), (2, 0), (2, 2)])
+
+
+class TestGridModel(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [(3, u'c'), (1, u'a'), (None, u'b'), (2, u'ab')]
+        self.model = GridModel(self.rows, (('x',), ('y',)), None)
+
+    def _displayed(self):
+        return list(self.model.get_displayed_rows())
+
+    def test_sort(self):
+        self.model.set_sort(0)
+        self.assertEqual([row[0] for row in self._displayed()],
+                         [None, 1, 2, 3])
+        self.model.set_sort(0, descending=True)
+        self.assertEqual([row[0] for row in self._displayed()],
+                         [3, 2, 1, None])
+        # Row numbers refer to the original order.
+        self.assertEqual(self.model.on_get_value(0, 9), 1)
+        self.model.set_sort(None)
+        self.assertEqual(self._displayed(), self.rows)
+
+    def test_sort_nullable_date(self):
+        rows = [(date(2020, 1, 2),), (None,), (date(2019, 1, 1),), (None,)]
+        model = GridModel(rows, (('d',),), None)
+        model.set_sort(0)
+        self.assertEqual(list(model.get_displayed_rows()),
+                         [(None,), (None,), (date(2019, 1, 1),),
+                          (date(2020, 1, 2),)])
+        model.set_sort(0, descending=True)
+        self.assertEqual(list(model.get_displayed_rows())[0],
+                         (date(2020, 1, 2),))
+
+    def test_sort_mixed_types(self):
+        rows = [(u'b',), (date(2019, 1, 1),), (None,), (u'a',)]
+        model = GridModel(rows, (('x',),), None)
+        model.set_sort(0)
+        self.assertEqual(list(model.get_displayed_rows()),
+                         [(None,), (date(2019, 1, 1),), (u'a',), (u'b',)])
+
+    def test_filter(self):
+        self.model.set_filter(u'A')
+        self.assertEqual(self._displayed(), [(1, u'a'), (2, u'ab')])
+        self.model.set_filter(u'ab')
+        self.assertEqual(self._displayed(), [(2, u'ab')])
+        self.model.set_sort(0, descending=True)
+        self.model.set_filter(u'3')
+        self.assertEqual(self._displayed(), [(3, u'c')])
+        self.assertEqual(self.model.n_rows, 1)
+        self.model.set_filter(None)
+        self.assertEqual(len(self._displayed()), 4)
+
+    def test_filter_bool(self):
+        rows = [(True, 1), (False, 10), (None, 0)]
+        model = GridModel(rows, (('x',), ('y',)), None)
+        model.set_filter(u'true')
+        self.assertEqual(list(model.get_displayed_rows()), [(True, 1)])
+        model.set_filter(u'fals')
+        self.assertEqual(list(model.get_displayed_rows()), [(False, 10)])
+        model.set_filter(u'1')
+        self.assertEqual(list(model.get_displayed_rows()),
+                         [(True, 1), (False, 10)])
+
+    def test_prepared(self):
+        # The functions returned by prepare_*() run in worker threads.
+        mask = self.model.prepare_filter(u'A')(None)
+        index = self.model.prepare_sort(0)(None)
+        self.rows.append((0, u'xa'))
+        self.model.rows_appended()
+        self.model.set_filter(u'A', mask)
+        self.model.set_sort(0, True, index)
+        # The appended row wasn't sorted yet.
+        self.assertEqual(self._displayed(), [(0, u'xa'), (2, u'ab'),
+                                             (1, u'a')])
+        self.assertEqual(self.model.prepare_sort(1)(None).tolist(),
+                         [1, 3, 2, 0, 4])
+        self.model.set_sort(0)
+        self.assertEqual(self.model.prepare_sort(0), None)
+
+    def test_filter_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertEqual(self.model.prepare_filter(u'a')(cancelled), None)
+
+    def test_rows_appended(self):
+        self.model.set_filter(u'a')
+        self.rows.append((4, u'ba'))
+        self.rows.append((5, u'x'))
+        self.model.rows_appended()
+        self.assertEqual([row[0] for row in self._displayed()], [1, 2, 4])
+
+    def test_iter_values(self):
+        self.model.set_sort(0)
+        selection = GridSelection(4)
+        selection.add(0, 2, [0, 1])
+        values = self.model.iter_values(selection)
+        selection.clear()
+        self.assertEqual(list(values), [None, u'b', 1, u'a'])
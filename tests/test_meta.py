@@ -0,0 +1,135 @@
+import cPickle
+import os
+import shutil
+import tempfile
+
+from tests.utils import DbTest
+
+from cf.db import objects, schemacache
+from cf.db.backends import in_lists
+from cf.executor import Future
+
+
+class TestDatabaseMeta(DbTest):
+
+    def setUp(self):
+        super(TestDatabaseMeta, self).setUp()
+        self.conn = self.ds.dbconnect()
+        self.meta = self.ds.meta
+
+    def test_find_indexed(self):
+        tables = objects.Tables(self.meta)
+        self.meta.set_object(tables)
+        tbl1 = objects.Table(self.meta, name='foo', oid=1, parent=tables)
+        tbl2 = objects.Table(self.meta, name='bar', oid=2, parent=tables)
+        view = objects.View(self.meta, name='foo', oid=3, parent=tables)
+        [self.meta.set_object(obj) for obj in (tbl1, tbl2, view)]
+        self.assertEqual(self.meta.find_exact(oid=2), tbl2)
+        self.assertEqual(self.meta.find_exact(cls=objects.Table,
+                                              parent=tables, oid=1), tbl1)
+        self.assertEqual(len(self.meta.find(name='foo')), 2)
+        self.assertEqual(self.meta.find(cls=objects.View), [view])
+        self.assertEqual(self.meta.find(cls=objects.Table, name='baz'), [])
+
+    def test_find_after_rename(self):
+        tables = objects.Tables(self.meta)
+        tbl = objects.Table(self.meta, name='foo', parent=tables)
+        self.meta.set_object(tbl)
+        tbl.name = 'bar'
+        self.assertEqual(self.meta.find(name='foo'), [])
+        self.assertEqual(self.meta.find_exact(name='bar'), tbl)
+
+    def test_completions(self):
+        tables = objects.Tables(self.meta)
+        tbl = objects.Table(self.meta, name='customers', parent=tables)
+        self.meta.set_object(tbl)
+        self.assertEqual(self.meta.completions.find('TOM'),
+                         [('customers', tbl.typestr)])
+        tbl.name = 'orders'
+        self.assertEqual(self.meta.completions.find('tom'), [])
+        self.assertEqual(self.meta.completions.find_prefix('ord'),
+                         [('orders', tbl.typestr)])
+
+    def test_schemacache_roundtrip(self):
+        tables = objects.Tables(self.meta)
+        self.meta.set_object(tables)
+        tbl = objects.Table(self.meta, name='foo', oid=1, parent=tables)
+        self.meta.set_object(tbl)
+        records = schemacache.serialize([tables, tbl, tbl.columns,
+                                         tbl.constraints])
+        records = cPickle.loads(cPickle.dumps(records, 2))
+        new_tables, new_tbl, new_cols, new_cons = schemacache.deserialize(
+            self.meta, records)
+        self.assert_(isinstance(new_tbl, objects.Table))
+        self.assertEqual(new_tbl.name, 'foo')
+        self.assertEqual(new_tbl.get_data('oid'), 1)
+        self.assert_(new_tbl.parent is new_tables)
+        self.assert_(new_tbl.columns is new_cols)
+        self.assert_(new_cols.parent is new_tbl)
+
+    def test_schemacache_save(self):
+        cache_dir = tempfile.mkdtemp()
+        old_dir = schemacache.CACHE_DIR
+        schemacache.CACHE_DIR = cache_dir
+        try:
+            self.ds.id = 'test'
+            self.meta._catalog_version = 1
+            tables = objects.Tables(self.meta)
+            self.meta.set_object(tables)
+            self.meta.save_cache_later().result(5)
+            # Nothing changed since the cache was written.
+            self.assertEqual(self.meta.save_cache_later(), None)
+            schemacache.save(self.ds, [tables], 2)
+            self.assertEqual(os.listdir(cache_dir), ['test'])
+            self.assertEqual(schemacache.load(self.ds)[0], 2)
+        finally:
+            schemacache.CACHE_DIR = old_dir
+            shutil.rmtree(cache_dir)
+
+    def test_prefetch(self):
+        self.meta.conn.execute('create table foo (a integer, b text)')
+        tables = objects.Tables(self.meta)
+        self.meta.set_object(tables)
+        tbl = objects.Table(self.meta, name='foo', parent=tables)
+        self.meta.set_object(tbl)
+        future = Future()
+        future.run(self.meta._read_children, [tbl.columns])
+        self.assertEqual(self.meta.find(parent=tbl.columns), [])
+        self.meta._children_read(future, [tbl.columns])
+        self.assertEqual(tbl.columns.props.refresh_required, False)
+        self.assertEqual(sorted(c.name for c in tbl.columns.get_children()),
+                         ['a', 'b'])
+
+    def test_prefetch_sync(self):
+        self.meta.conn.execute('create table foo (a integer, b text)')
+        tables = objects.Tables(self.meta)
+        self.meta.set_object(tables)
+        tbl = objects.Table(self.meta, name='foo', parent=tables)
+        self.meta.set_object(tbl)
+        # SQLite connections aren't used in worker threads, the columns
+        # are read at once.
+        self.assertEqual(self.meta.prefetch([tbl.columns]), None)
+        self.assertEqual(tbl.columns.props.refresh_required, False)
+        self.assertEqual(sorted(c.name for c in
+                                self.meta.find(parent=tbl.columns)),
+                         ['a', 'b'])
+
+    def test_refresh_many(self):
+        self.meta.conn.execute('create table foo (a integer, b text)')
+        self.meta.conn.execute("create table \"it's\" (c integer)")
+        tables = objects.Tables(self.meta)
+        self.meta.set_object(tables)
+        foo = objects.Table(self.meta, name='foo', parent=tables)
+        its = objects.Table(self.meta, name="it's", parent=tables)
+        [self.meta.set_object(tbl) for tbl in (foo, its)]
+        self.meta.backend.refresh_many([foo.columns, its.columns],
+                                       self.meta, self.meta.conn)
+        self.assertEqual(sorted(c.name for c in
+                                self.meta.find(parent=foo.columns)),
+                         ['a', 'b'])
+        self.assertEqual([c.name for c in self.meta.find(parent=its.columns)],
+                         ['c'])
+
+    def test_in_lists(self):
+        self.assertEqual(list(in_lists([1, "it's", 3], size=2)),
+                         ["1, 'it''s'", '3'])
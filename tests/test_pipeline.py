@@ -0,0 +1,67 @@
+import unittest
+
+from tests.utils import DbTest
+
+from cf.db.pipeline import ExecutionPipeline, iter_text_statements
+
+
+class TestIterTextStatements(unittest.TestCase):
+
+    def test_lines(self):
+        text = 'select 1;\n\nselect\n2;  select 3;\n-- end\n'
+        self.assertEqual(list(iter_text_statements(text, 5)),
+                         [('select 1;', 5), ('select\n2;', 7),
+                          ('select 3;', 8)])
+
+    def test_no_split(self):
+        self.assertEqual(list(iter_text_statements('select 1; select 2',
+                                                   split=False)),
+                         [('select 1; select 2', 1)])
+        self.assertEqual(list(iter_text_statements('  \n', split=False)),
+                         [])
+
+
+class TestExecutionPipeline(DbTest):
+
+    def setUp(self):
+        super(TestExecutionPipeline, self).setUp()
+        self.conn = self.ds.dbconnect()
+        self.conn.execute('create table foo (a integer)')
+
+    def _run(self, text, stop_on_error=True):
+        batches = []
+        lines = {}
+        def setup_query(query, line):
+            lines[query] = line
+        pipeline = ExecutionPipeline(self.conn, iter_text_statements(text),
+                                     setup_query, stop_on_error)
+        pipeline.connect('queries-executed',
+                         lambda p, queries: batches.append(queries))
+        pipeline.run()
+        self.assert_(pipeline.finished)
+        queries = [query for batch in batches for query in batch]
+        return pipeline, [(lines[q], q.failed) for q in queries]
+
+    def test_execute(self):
+        text = '\n'.join('insert into foo values (%d);' % i
+                         for i in range(100))
+        pipeline, result = self._run(text + '\nselect count(*) from foo')
+        self.assertEqual(pipeline.executed, 101)
+        self.assertEqual(pipeline.failed, 0)
+        self.assertEqual(result, [(i + 1, False) for i in range(101)])
+
+    def test_stop_on_error(self):
+        text = 'insert into foo values (1);\nbad;\ninsert into foo values (2);'
+        pipeline, result = self._run(text)
+        self.assertEqual(result, [(1, False), (2, True)])
+        pipeline, result = self._run(text, stop_on_error=False)
+        self.assertEqual(result, [(1, False), (2, True), (3, False)])
+        self.assertEqual(pipeline.failed, 1)
+
+    def test_cancel(self):
+        pipeline = ExecutionPipeline(self.conn,
+                                     iter_text_statements('select 1;'))
+        pipeline.cancel()
+        pipeline.run()
+        self.assertEqual(pipeline.executed, 0)
+        self.assert_(pipeline.finished)
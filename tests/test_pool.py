@@ -0,0 +1,34 @@
+import time
+
+from tests.utils import DbTest
+
+
+class TestConnectionPool(DbTest):
+
+    def test_acquire(self):
+        pool = self.ds.pool
+        conn1 = pool.acquire()
+        self.assert_(conn1 is self.ds.internal_connection)
+        conn2 = pool.acquire()
+        self.assert_(conn2 is not conn1)
+        # conn2 is unused and will be handed out again
+        self.assert_(pool.acquire() is conn2)
+        pool.checkout(conn2, self)
+        conn3 = pool.acquire()
+        self.assert_(conn3 not in (conn1, conn2))
+        pool.checkin(conn2, self)
+        self.assert_(pool.acquire() is conn2)
+
+    def test_reap(self):
+        pool = self.ds.pool
+        pool.min_size = 1
+        pool.idle_timeout = 60
+        conn1 = pool.acquire()
+        conn2 = self.ds.dbconnect()
+        conn3 = self.ds.dbconnect()
+        pool.checkout(conn3, self)
+        self.assertEqual(pool.reap(), 0)
+        for conn in (conn1, conn2, conn3):
+            conn.last_used = time.time() - 120
+        self.assertEqual(pool.reap(), 1)
+        self.assertEqual(self.ds.connections, set([conn1, conn3]))
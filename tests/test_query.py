@@ -1,7 +1,10 @@
 from tests.utils import DbTest
 
+import time
+
 import sqlparse
 import sqlparse.sql
+import cf.db
 from cf.db import Query
 
 
@@ -15,3 +18,120 @@ class TestQuery(DbTest):
         q = Query('select * from foo', self.conn)
         self.assert_(isinstance(q.parsed, sqlparse.sql.Statement),
                      'Expected sqlparse.sql.Statement, got %r' % q.parsed)
+
+    def test_fetch_size(self):
+        self.conn.execute('create table foo (a integer)')
+        for i in range(5):
+            self.conn.execute('insert into foo values (%d)' % i)
+        q = Query('select a from foo', self.conn)
+        q.fetch_size = 2
+        batches = []
+        q.connect('rows-fetched', lambda q, rows: batches.append(len(rows)))
+        q.execute()
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(len(q.rows), 5)
+        self.assertEqual(q.rowcount, 5)
+
+    def test_deferred_finish(self):
+        q = Query('select 1', self.conn)
+        signals = []
+        q.connect('started', lambda q: signals.append('started'))
+        q.connect('finished', lambda q: signals.append('finished'))
+        q.execute(notify=False)
+        self.assert_(q.executed)
+        self.assertEqual(signals, [])
+        q.finish()
+        self.assertEqual(signals, ['finished'])
+
+    def test_cancel_before_execute(self):
+        q = Query('select 1', self.conn)
+        q.cancel()
+        q.execute()
+        self.assert_(q.failed)
+        self.assert_(q.cancelled)
+        self.assertEqual(q.rows, None)
+
+    def test_cancel_retry(self):
+        calls = []
+        def cancel(connection):
+            calls.append(connection)
+            return True
+        old_delay = cf.db.CANCEL_RETRY_DELAY
+        cf.db.CANCEL_RETRY_DELAY = 0.01
+        self.ds.backend.cancel = cancel
+        try:
+            q = Query('select 1', self.conn)
+            # The statement is running, but may not have reached the
+            # server yet.
+            q._running = True
+            self.assert_(q.cancel())
+            time.sleep(0.2)
+            self.assertEqual(len(calls), 1 + cf.db.CANCEL_RETRIES)
+            del calls[:]
+            q._running = False
+            q.cancel()
+            time.sleep(0.05)
+            self.assertEqual(calls, [])
+        finally:
+            del self.ds.backend.cancel
+            cf.db.CANCEL_RETRY_DELAY = old_delay
+
+    def test_statement_timeout(self):
+        self.ds.statement_timeout = 1
+        q = Query('with recursive c(x) as'
+                  ' (select 1 union all select x+1 from c)'
+                  ' select count(*) from c', self.conn)
+        q.execute()
+        self.assert_(q.failed)
+        self.assert_(q.timed_out)
+
+    def test_result_cache(self):
+        self.conn.execute('create table foo (a integer)')
+        self.conn.execute('insert into foo values (1)')
+        q = Query('select a from foo', self.conn)
+        q.use_cache = True
+        q.execute()
+        self.assertEqual(q.cached_at, None)
+        self.conn.execute('insert into foo values (2)')
+        q = Query('select  a\nfrom foo', self.conn)
+        q.use_cache = True
+        q.execute()
+        self.assertNotEqual(q.cached_at, None)
+        self.assertEqual(len(q.rows), 1)
+        q = Query('delete from foo', self.conn)
+        q.execute()
+        q = Query('select a from foo', self.conn)
+        q.use_cache = True
+        q.execute()
+        self.assertEqual(q.cached_at, None)
+        self.assertEqual(len(q.rows), 0)
+
+    def test_memory_limit(self):
+        self.conn.execute('create table foo (a integer)')
+        for i in range(50):
+            self.conn.execute('insert into foo values (%d)' % i)
+        q = Query('select a from foo', self.conn)
+        q.memory_limit = 200
+        q.execute()
+        self.assert_(q.rows.spilled)
+        self.assertEqual(len(q.rows), 50)
+        self.assertEqual(q.rows[49], (49,))
+
+    def test_columnar(self):
+        self.conn.execute('create table foo (a integer, b text)')
+        for i in range(10):
+            self.conn.execute("insert into foo values (%d, 'x')" % i)
+        q = Query('select a, b from foo', self.conn)
+        q.columnar = True
+        q.execute()
+        self.assertEqual(len(q.rows), 10)
+        self.assertEqual(q.rows.get_value(9, 0), 9)
+        self.assertEqual(q.rows[0], (0, u'x'))
+
+    def test_timings(self):
+        q = Query('select 1', self.conn)
+        q.parsed
+        q.execute()
+        for phase in ('prepare', 'parse', 'execute', 'fetch'):
+            self.assert_(phase in q.timings, '%s not in timings' % phase)
+        self.assert_(q.format_timings().startswith('prepare '))
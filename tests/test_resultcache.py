@@ -0,0 +1,53 @@
+import unittest
+
+from cf.db.resultcache import ResultCache
+
+
+class FakeDatasource(object):
+
+    def __init__(self, id_):
+        self.id = id_
+
+
+class FakeQuery(object):
+
+    def __init__(self, statement, rows):
+        self.statement = statement
+        self.rows = rows
+        self.description = (('a', None, None, None, None, None, None),)
+        self.rowcount = len(rows)
+        self.messages = []
+        self.coding_hint = 'utf-8'
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_lru(self):
+        ds = FakeDatasource('ds1')
+        cache = ResultCache(max_size=1024*1024, ttl=0)
+        size = cache.put(ds, FakeQuery('select 1', [(1,)])).size
+        cache.max_size = size * 2
+        cache.put(ds, FakeQuery('select 2', [(2,)]))
+        self.assert_(cache.get(ds, 'select 1') is not None)
+        cache.put(ds, FakeQuery('select 3', [(3,)]))
+        self.assertEqual(len(cache), 2)
+        self.assert_(cache.get(ds, 'select 2') is None)
+        self.assert_(cache.get(ds, 'select   1') is not None)
+
+    def test_ttl(self):
+        ds = FakeDatasource('ds1')
+        cache = ResultCache(ttl=10)
+        entry = cache.put(ds, FakeQuery('select 1', [(1,)]))
+        entry.timestamp -= 11
+        self.assert_(cache.get(ds, 'select 1') is None)
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        ds1 = FakeDatasource('ds1')
+        ds2 = FakeDatasource('ds2')
+        cache = ResultCache()
+        cache.put(ds1, FakeQuery('select 1', [(1,)]))
+        cache.put(ds2, FakeQuery('select 1', [(1,)]))
+        cache.invalidate(ds1)
+        self.assert_(not cache.has_entries(ds1))
+        self.assert_(cache.has_entries(ds2))
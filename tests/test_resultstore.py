@@ -0,0 +1,36 @@
+import unittest
+
+from cf.db.resultstore import ResultStore, estimate_row_size
+
+
+class TestResultStore(unittest.TestCase):
+
+    def test_in_memory(self):
+        store = ResultStore(1024*1024)
+        store.extend([(1, 'a'), (2, 'b')])
+        self.assert_(not store.spilled)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store[1], (2, 'b'))
+
+    def test_spill(self):
+        rows = [(i, 'row %d' % i, buffer('x' * i)) for i in range(100)]
+        store = ResultStore(estimate_row_size(rows[0]) * 10)
+        store.extend(rows[:50])
+        for row in rows[50:]:
+            store.append(row)
+        self.assert_(store.spilled)
+        self.assertEqual(len(store), 100)
+        self.assertEqual(store[5], rows[5])
+        self.assertEqual(store[99][:2], rows[99][:2])
+        self.assertEqual(str(store[-1][2]), 'x' * 99)
+        self.assert_(isinstance(store[80][2], buffer))
+        self.assertEqual([r[0] for r in store[8:13]], range(8, 13))
+        self.assertEqual([r[0] for r in store], range(100))
+        self.assertRaises(IndexError, store.__getitem__, 100)
+
+    def test_close(self):
+        store = ResultStore(0)
+        store.extend([(1,), (2,)])
+        store.close()
+        self.assertEqual(len(store), 0)
+        self.assert_(not store.spilled)
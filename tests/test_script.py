@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from cf.db import script
+from cf.db.script import ScriptRunner, iter_file_statements
+
+
+class ResultCache(object):
+
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, datasource):
+        self.invalidated.append(datasource)
+
+
+class Datasource(object):
+
+    def __init__(self):
+        self.manager = self
+        self.result_cache = ResultCache()
+
+
+class SQLiteConnection(object):
+    """Minimal stand-in for cf.db.Connection."""
+
+    threadsafety = 1
+    last_used = None
+
+    def __init__(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.datasource = Datasource()
+
+    def get_dbapi_connection(self):
+        return self.connection
+
+    def update_transaction_state(self):
+        pass
+
+
+SCRIPT = """-- a comment
+create table foo (a integer, b text);
+insert into foo values (1, 'a;b');
+
+insert into foo values (2, 'c
+d');
+create trigger foo_trg after insert on foo
+begin
+  update foo set b = 'x' where a = new.a;
+end;
+select * from foo"""
+
+
+class TestIterFileStatements(unittest.TestCase):
+
+    def _statements(self, text, chunk_size):
+        return list(iter_file_statements(StringIO(text), chunk_size))
+
+    def test_chunks(self):
+        expected = self._statements(SCRIPT, 1024)
+        self.assertEqual([item[:2] for item in expected],
+                         [('-- a comment\n'
+                           'create table foo (a integer, b text);', 1),
+                          ("insert into foo values (1, 'a;b');", 3),
+                          ("insert into foo values (2, 'c\nd');", 5),
+                          ("create trigger foo_trg after insert on foo\n"
+                           "begin\n"
+                           "  update foo set b = 'x' where a = new.a;\n"
+                           "end;", 7),
+                          ('select * from foo', 11)])
+        for chunk_size in (1, 2, 3, 7, 16, 50):
+            result = self._statements(SCRIPT, chunk_size)
+            self.assertEqual([item[:2] for item in result],
+                             [item[:2] for item in expected])
+
+    def test_bytes_read(self):
+        result = self._statements(SCRIPT, 16)
+        positions = [item[2] for item in result]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(positions[-1], len(SCRIPT))
+        self.assert_(positions[0] < len(SCRIPT))
+
+    def test_empty(self):
+        self.assertEqual(self._statements('', 10), [])
+        self.assertEqual(self._statements('  -- foo\n', 10), [])
+
+
+class TestScriptRunner(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sql')
+        os.write(fd, 'create table foo (a integer);\n'
+                 'insert into foo values (1);\n'
+                 'insert into bar values (2);\n'
+                 'insert into foo values (3);\n')
+        os.close(fd)
+        self.conn = SQLiteConnection()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _run(self, stop_on_error):
+        runner = ScriptRunner(self.conn, self.filename, stop_on_error)
+        failed = []
+        runner.connect('statement-failed',
+                       lambda r, stmt, line, msg: failed.append(line))
+        runner.run()
+        self.assert_(runner.finished)
+        self.assertEqual(failed, [3])
+        self.assertEqual(runner.errors, 1)
+        cur = self.conn.connection.cursor()
+        cur.execute('select a from foo order by a')
+        return runner, [row[0] for row in cur.fetchall()]
+
+    def test_stop_on_error(self):
+        runner, rows = self._run(True)
+        self.assertEqual(runner.statements, 3)
+        self.assertEqual(rows, [1])
+
+    def test_continue(self):
+        runner, rows = self._run(False)
+        self.assertEqual(runner.statements, 4)
+        self.assertEqual(rows, [1, 3])
+        self.assertEqual(runner.fraction, 1.0)
+        self.assertEqual(self.conn.datasource.result_cache.invalidated,
+                         [self.conn.datasource])
+
+    def test_select_only(self):
+        fileobj = open(self.filename, 'w')
+        fileobj.write('-- comment\nselect 1;\n/* x */ SELECT 2;')
+        fileobj.close()
+        runner = ScriptRunner(self.conn, self.filename)
+        runner.run()
+        self.assertEqual(runner.statements, 2)
+        self.assertEqual(self.conn.datasource.result_cache.invalidated, [])
+
+    def test_slices(self):
+        # Connections that aren't thread-safe run in the main loop.
+        idle = []
+        old_idle_add = script.gobject.idle_add
+        script.gobject.idle_add = lambda func, *args: idle.append((func,
+                                                                   args))
+        old_slice_time = script.SLICE_TIME
+        script.SLICE_TIME = 0
+        try:
+            runner = ScriptRunner(self.conn, self.filename, False)
+            runner.run(executor=object())
+            self.failIf(runner.finished)
+            func, args = idle[0]
+            slices = 1
+            while func(*args):
+                slices += 1
+            self.assert_(runner.finished)
+            self.assertEqual(runner.statements, 4)
+            # One statement per slice, the last one emits "finished".
+            self.assertEqual(slices, 5)
+        finally:
+            script.gobject.idle_add = old_idle_add
+            script.SLICE_TIME = old_slice_time
+
+    def test_read_error(self):
+        runner = ScriptRunner(self.conn, self.filename + '.missing')
+        runner.run()
+        self.assert_(runner.finished)
+        self.assert_(runner.read_error)
+        self.assertEqual(runner.error, None)
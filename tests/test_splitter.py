@@ -0,0 +1,128 @@
+import random
+import unittest
+
+from cf.db.splitter import StatementIndex, iter_statements
+
+
+class TestSplitter(unittest.TestCase):
+
+    def _split(self, text):
+        return [text[start:end] for start, end, split
+                in iter_statements(text)]
+
+    def test_split(self):
+        self.assertEqual(self._split(u'select 1;  select 2\n'),
+                         [u'select 1;', u'select 2'])
+        self.assertEqual(self._split(u"select ';' from foo; select 2;"),
+                         [u"select ';' from foo;", u'select 2;'])
+        self.assertEqual(self._split(u'select 1; -- comment\n;'),
+                         [u'select 1;'])
+        self.assertEqual(self._split(u'select $x$;$x$; select 2;'),
+                         [u'select $x$;$x$;', u'select 2;'])
+
+    def test_create_block(self):
+        sql = (u'create function foo() returns int as begin'
+               u' select 1; if x then select 2; end if; end;')
+        self.assertEqual(self._split(sql + u' select 3;'),
+                         [sql, u'select 3;'])
+        self.assertEqual(self._split(u'begin; select 1;'),
+                         [u'begin;', u'select 1;'])
+
+    def test_update(self):
+        parts = [u'select 1', u';', u' ', u'\n', u"'", u'(', u')', u'--',
+                 u'/*', u'*/', u'begin', u'end', u'create', u'$$']
+        rnd = random.Random(0)
+        for trial in xrange(200):
+            text = u''.join(rnd.choice(parts) for i in xrange(30))
+            index = StatementIndex()
+            index.reset(text)
+            for edit in xrange(5):
+                pos = rnd.randint(0, len(text))
+                removed = rnd.randint(0, min(5, len(text) - pos))
+                inserted = u''.join(rnd.choice(parts)
+                                    for i in xrange(rnd.randint(0, 3)))
+                text = text[:pos] + inserted + text[pos+removed:]
+                index.update(text, pos, removed, len(inserted))
+                expected = StatementIndex()
+                expected.reset(text)
+                self.assertEqual(list(index), list(expected))
+
+    def _update_chunked(self, index, text, pos, removed, inserted, size):
+        offset = index.scan_start(pos)
+        while True:
+            chunk = text[offset:offset + size]
+            result = index.update(chunk, pos, removed, inserted, offset,
+                                  offset + size >= len(text))
+            if result is not None:
+                return result
+            size *= 2
+
+    def test_update_chunked(self):
+        parts = [u'select 1', u';', u' ', u'\n', u"'", u'(', u')', u'--',
+                 u'/*', u'*/', u'begin', u'end', u'create', u'$$']
+        rnd = random.Random(2)
+        for trial in xrange(200):
+            text = u''.join(rnd.choice(parts) for i in xrange(30))
+            index = StatementIndex()
+            index.reset(text)
+            for edit in xrange(5):
+                pos = rnd.randint(0, len(text))
+                removed = rnd.randint(0, min(5, len(text) - pos))
+                inserted = u''.join(rnd.choice(parts)
+                                    for i in xrange(rnd.randint(0, 3)))
+                text = text[:pos] + inserted + text[pos+removed:]
+                self._update_chunked(index, text, pos, removed,
+                                     len(inserted), rnd.randint(1, 8))
+                expected = StatementIndex()
+                expected.reset(text)
+                self.assertEqual(list(index), list(expected))
+
+    def test_update_is_local(self):
+        text = u'select 1;\n' * 1000
+        index = StatementIndex()
+        index.reset(text)
+        pos = 505 * 10 + 7
+        text = text[:pos] + u'0' + text[pos:]
+        self.assertEqual(index.update(text, pos, 0, 1), (505, 1, 1))
+        self.assertEqual(index.starts[506], 5061)
+        # Only the text around the edit is needed.
+        text = text[:pos] + text[pos+1:]
+        self.assertEqual(index.update(text[5040:5100], pos, 1, 0, 5040,
+                                      False), (505, 1, 1))
+        self.assertEqual(index.starts[506], 5060)
+
+    def test_extend(self):
+        text = u"select 1; select 'a;b';\n-- x\nselect (2); select 3"
+        expected = StatementIndex()
+        expected.reset(text)
+        for size in xrange(1, len(text) + 1):
+            index = StatementIndex()
+            want = size
+            while not index.complete:
+                pos = index.scanned
+                if index.extend(text[pos:pos + want], pos,
+                                pos + want >= len(text)):
+                    want = size
+                else:
+                    want *= 2
+            self.assertEqual(list(index), list(expected))
+
+    def test_update_incomplete(self):
+        parts = [u'select 1', u';', u' ', u'\n', u"'", u'(', u')', u'--',
+                 u'/*', u'*/', u'begin', u'end', u'create', u'$$']
+        rnd = random.Random(1)
+        for trial in xrange(200):
+            text = u''.join(rnd.choice(parts) for i in xrange(30))
+            index = StatementIndex()
+            index.extend(text[:15], 0, False)
+            for edit in xrange(5):
+                pos = rnd.randint(0, len(text))
+                removed = rnd.randint(0, min(5, len(text) - pos))
+                inserted = u''.join(rnd.choice(parts)
+                                    for i in xrange(rnd.randint(0, 3)))
+                text = text[:pos] + inserted + text[pos+removed:]
+                index.update(text, pos, removed, len(inserted))
+            index.extend(text[index.scanned:], index.scanned)
+            expected = StatementIndex()
+            expected.reset(text)
+            self.assertEqual(list(index), list(expected))
@@ -0,0 +1,46 @@
+import decimal
+import threading
+import unittest
+
+from cf.db import stats
+from cf.db.stats import compute_stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_compute_stats(self):
+        result = compute_stats([1, 2, None, 2, u'x', 1.5])
+        self.assertEqual(result.count, 6)
+        self.assertEqual(result.distinct, 4)
+        self.assertEqual(result.nulls, 1)
+        self.assertEqual(result.numeric, 4)
+        self.assertEqual(result.sum, 6.5)
+        self.assertEqual(result.avg, 6.5 / 4)
+        self.assertEqual(result.min, 1)
+        self.assertEqual(result.max, u'x')
+
+    def test_exact_sum(self):
+        values = [decimal.Decimal('0.1')] * 3 + [1]
+        result = compute_stats(values)
+        self.assertEqual(result.sum, decimal.Decimal('1.3'))
+        self.assertEqual(result.avg, decimal.Decimal('0.325'))
+
+    def test_chunks(self):
+        values = range(stats.CHUNK_SIZE * 2 + 5) + [None]
+        result = compute_stats(values)
+        self.assertEqual(result.count, len(values))
+        self.assertEqual(result.nulls, 1)
+        self.assertEqual(result.max, stats.CHUNK_SIZE * 2 + 4)
+        self.assertEqual(result.sum, sum(values[:-1]))
+
+    def test_no_values(self):
+        result = compute_stats([None, None])
+        self.assertEqual(result.nulls, 2)
+        self.assertEqual(result.sum, None)
+        self.assertEqual(result.min, None)
+        self.assert_(result.format())
+
+    def test_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertEqual(compute_stats([1, 2], cancelled), None)
@@ -0,0 +1,76 @@
+import sqlite3
+import unittest
+
+from cf.db.virtual import VirtualResult
+
+
+class ListCursor(object):
+    """Scrollable cursor on a list of rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pos = 0
+        self.fetches = 0
+
+    def scroll(self, value, mode='relative'):
+        self.pos = value
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        rows = self.rows[self.pos:self.pos+size]
+        self.pos += len(rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+class TestVirtualResult(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('create table foo (a integer)')
+        self.conn.executemany('insert into foo values (?)',
+                              [(i,) for i in range(25)])
+
+    def _create(self, **kwds):
+        cur = self.conn.cursor()
+        cur.execute('select a from foo order by a')
+        return VirtualResult(cur, page_size=10, **kwds)
+
+    def test_forward_only(self):
+        result = self._create()
+        result.load(0)
+        self.assertEqual(result.total, None)
+        self.assertEqual(len(result), 20)
+        self.assert_(result.is_loaded(9))
+        self.failIf(result.is_loaded(10))
+        self.assertEqual(result[22], (22,))
+        self.assertEqual(result.total, 25)
+        self.assertEqual(len(result), 25)
+        self.assertEqual(list(result), [(i,) for i in range(25)])
+
+    def test_estimate(self):
+        result = self._create(estimate=1000)
+        self.assertEqual(len(result), 1000)
+        result.request(0)
+        self.assertEqual(result[0:3], [(0,), (1,), (2,)])
+
+    def test_scrollable(self):
+        cursor = ListCursor([(i,) for i in range(250)])
+        result = VirtualResult(cursor, scrollable=True, estimate=1000,
+                               page_size=10)
+        self.assertEqual(result[245], (245,))
+        self.failIf(result.is_loaded(0))
+        self.assertEqual(result[3], (3,))
+        self.assertRaises(IndexError, lambda: result[900])
+        self.assert_(len(result) < 1000)
+        self.assertEqual(list(result)[-1], (249,))
+        self.assertEqual(result.total, 250)
+
+    def test_close(self):
+        result = self._create()
+        result.load(0)
+        result.close()
+        self.failIf(result.is_loaded(0))
+        self.assertEqual(result._load(1), None)